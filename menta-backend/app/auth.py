@@ -1,19 +1,60 @@
+import asyncio
+import hmac
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from app.schemas import TokenData, UserOut
+from app.schemas import TokenData
 from fastapi import Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer, OAuth2PasswordBearer
 from decouple import config
-from app.utils import get_user_by_email
+from app.repository import find_user_profile_by_email
+from app.cache import TTLCache
 from typing import Optional
 
 SECRET_KEY = config("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Bearer token for /metrics and /jobs/metrics; both answer 404 while it is unset
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Pinning min/max rounds to the configured cost makes hashes of any other cost "need update"
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", default=12, cast=int)
+HASH_WORKERS = config("HASH_WORKERS", default=4, cast=int)
+HASH_QUEUE_LIMIT = config("HASH_QUEUE_LIMIT", default=64, cast=int)
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending_hashes = 0
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+metrics_scheme = HTTPBearer(auto_error=False)
+
+# Decoded claims and the resolved user, keyed by bearer token. Entries never outlive the
+# token's own expiry, and invalidating a user drops every token cached for them before that.
+principal_cache = TTLCache(
+    maxsize=config("PRINCIPAL_CACHE_SIZE", default=10000, cast=int),
+    ttl=config("PRINCIPAL_CACHE_TTL", default=60, cast=int),
+)
+# When each user was last invalidated, on the _invalidations clock. A mark only has to outlive
+# the principals cached before it, so it expires with them.
+_invalidated = TTLCache(maxsize=config("INVALIDATION_CACHE_SIZE", default=10000, cast=int), ttl=principal_cache.ttl)
+_invalidations = 0
+
+def invalidate_user(user_id: str):
+    global _invalidations
+    _invalidations += 1
+    if len(_invalidated) >= _invalidated.maxsize and _invalidated.get(user_id) is None:
+        # Evicting a mark could revive a stale principal, so start every principal afresh instead
+        principal_cache.clear()
+        _invalidated.clear()
+    _invalidated.set(user_id, _invalidations)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -21,6 +62,28 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_hash(func, *args):
+    # bcrypt releases the GIL, so the pool hashes in parallel while the event loop keeps serving
+    global _pending_hashes
+    if _pending_hashes >= HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, please retry",
+            headers={"Retry-After": "1"},
+        )
+    _pending_hashes += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, func, *args)
+    finally:
+        _pending_hashes -= 1
+
+async def hash_password(password):
+    return await _run_hash(get_password_hash, password)
+
+async def verify_and_update_password(plain_password, hashed_password):
+    # Returns (verified, new_hash); new_hash is set when the stored cost differs from BCRYPT_ROUNDS
+    return await _run_hash(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -37,6 +100,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached = principal_cache.get(token)
+    if cached is not None:
+        cached_at, payload, user = cached
+        if _invalidated.get(user.id, 0) <= cached_at:
+            return user.copy(deep=True)
+        principal_cache.pop(token)
+    invalidations = _invalidations
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -45,7 +115,21 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user_dict = await get_user_by_email(token_data.email)
-    if user_dict is None:
+    user = await find_user_profile_by_email(token_data.email)
+    if user is None:
         raise credentials_exception
-    return UserOut(**user_dict)
+    # Skip caching if any user was invalidated while the lookup was in flight
+    if invalidations == _invalidations:
+        principal_cache.set(token, (invalidations, payload, user), ttl=payload["exp"] - time.time())
+    return user
+
+def require_metrics_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(metrics_scheme)):
+    # Scrapers authenticate with the shared METRICS_TOKEN rather than a user session
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
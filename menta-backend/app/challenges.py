@@ -0,0 +1,201 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.database import challenge_collection, challenge_participant_collection, notification_collection
+from app.clubs import activity_key
+from app.crud import notification, utcnow
+from app.idempotency import apply_once
+from app.pagination import DEFAULT_PAGE_SIZE, fetch_page
+from app.repository import CHALLENGE_GOALS
+
+# Challenges are evaluated as activities arrive: each participation keeps running totals and a
+# streak, so a new activity only updates its author's open participations for that activity
+# type and never rereads their history. Progress starts counting when the user joins.
+
+# activity_key of participations in challenges that take any activity type
+ANY_ACTIVITY = "*"
+
+class InvalidChallenge(Exception):
+    pass
+
+def validate_challenge(challenge_data: dict):
+    if not challenge_data["title"].strip():
+        raise InvalidChallenge("title must not be empty")
+    if challenge_data["goal"] not in CHALLENGE_GOALS:
+        raise InvalidChallenge(f"goal must be one of: {', '.join(CHALLENGE_GOALS)}")
+    if challenge_data["target"] < 1:
+        raise InvalidChallenge("target must be at least 1")
+    try:
+        starts = datetime.strptime(challenge_data["starts"], "%Y-%m-%d")
+        ends = datetime.strptime(challenge_data["ends"], "%Y-%m-%d")
+    except ValueError:
+        raise InvalidChallenge("starts and ends must be YYYY-MM-DD dates")
+    if ends < starts:
+        raise InvalidChallenge("ends must not be before starts")
+
+async def find_challenge(challenge_id: str):
+    if not ObjectId.is_valid(challenge_id):
+        return None
+    return await challenge_collection.find_one({"_id": ObjectId(challenge_id)})
+
+async def create_challenge(creator_id: str, challenge_data: dict):
+    validate_challenge(challenge_data)
+    challenge = {
+        **challenge_data,
+        "activity_key": activity_key(challenge_data.get("activity")),
+        "creator_id": creator_id,
+        "created_at": utcnow(),
+        "participant_count": 0,
+        "completion_count": 0,
+    }
+    await challenge_collection.insert_one(challenge)
+    participant = await join_challenge(challenge, creator_id)
+    return challenge, participant
+
+async def join_challenge(challenge, user_id: str):
+    # The new participation, or None if the user had already joined
+    if challenge["ends"] < datetime.utcnow().strftime("%Y-%m-%d"):
+        raise InvalidChallenge("This challenge has ended")
+    participant = {
+        "challenge_id": str(challenge["_id"]),
+        "user_id": user_id,
+        # Copied from the challenge so evaluating an activity never has to read it
+        "activity_key": challenge.get("activity_key") or ANY_ACTIVITY,
+        "goal": challenge["goal"],
+        "target": challenge["target"],
+        "starts": challenge["starts"],
+        "ends": challenge["ends"],
+        "seconds": 0,
+        "sessions": 0,
+        "streak": 0,
+        "best_streak": 0,
+        "last_day": None,
+        "completed_at": None,
+        "completed_by": None,
+        "created_at": utcnow(),
+    }
+    try:
+        await challenge_participant_collection.insert_one(participant)
+    except DuplicateKeyError:
+        return None
+    await challenge_collection.update_one({"_id": challenge["_id"]}, {"$inc": {"participant_count": 1}})
+    challenge["participant_count"] = challenge.get("participant_count", 0) + 1
+    return participant
+
+async def leave_challenge(challenge_id: str, user_id: str) -> bool:
+    participant = await challenge_participant_collection.find_one_and_delete(
+        {"challenge_id": challenge_id, "user_id": user_id}, projection={"completed_at": 1}
+    )
+    if participant is None:
+        return False
+    counts = {"participant_count": -1}
+    if participant.get("completed_at"):
+        counts["completion_count"] = -1
+    await challenge_collection.update_one({"_id": ObjectId(challenge_id)}, {"$inc": counts})
+    return True
+
+def evaluation_update(goal: str, activity_id, day: str, seconds: int, now) -> list:
+    # Pipeline update: totals and streak move as in app.crud's progress summary, then the
+    # completion is stamped by the same write that reaches the target, so exactly one
+    # activity ever completes a participation
+    previous_day = (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+    reached = {"$and": [{"$eq": ["$completed_at", None]}, {"$gte": [f"${CHALLENGE_GOALS[goal]}", "$target"]}]}
+    return [
+        {"$set": {
+            "streak": {"$switch": {
+                "branches": [
+                    {"case": {"$gte": ["$last_day", day]}, "then": "$streak"},
+                    {"case": {"$eq": ["$last_day", previous_day]}, "then": {"$add": ["$streak", 1]}},
+                ],
+                "default": 1,
+            }},
+            "last_day": {"$max": ["$last_day", day]},
+            "seconds": {"$add": ["$seconds", seconds]},
+            "sessions": {"$add": ["$sessions", 1]},
+        }},
+        {"$set": {"best_streak": {"$max": ["$best_streak", "$streak"]}}},
+        {"$set": {
+            "completed_by": {"$cond": [reached, activity_id, "$completed_by"]},
+            "completed_at": {"$cond": [reached, now, "$completed_at"]},
+        }},
+    ]
+
+async def evaluate_activity(activity) -> list:
+    # Applies one new activity to its author's open challenges; returns the ids of the
+    # challenges it completed. A rerun adds nothing to the totals (see app.idempotency) but
+    # still finishes recording a completion an earlier run stopped short of.
+    day = activity["date"]
+    participations = await challenge_participant_collection.find({
+        "user_id": activity["user_id"],
+        "activity_key": {"$in": [activity_key(activity["activity"]), ANY_ACTIVITY]},
+        "ends": {"$gte": day},
+        "starts": {"$lte": day},
+        "$or": [{"completed_at": None}, {"completed_by": activity["_id"]}],
+    }, {"challenge_id": 1, "goal": 1, "completed_by": 1}).to_list(None)
+    now = utcnow()
+
+    async def evaluate(participant):
+        if participant.get("completed_by") == activity["_id"]:
+            return participant
+        _, updated = await apply_once(
+            challenge_participant_collection,
+            # A concurrent activity may have completed it since the find; then this one no longer counts
+            {"_id": participant["_id"], "completed_at": None},
+            evaluation_update(participant["goal"], activity["_id"], day, activity["duration"], now),
+            activity["_id"],
+            projection={"challenge_id": 1, "completed_by": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        return updated
+
+    updated = await asyncio.gather(*(evaluate(participant) for participant in participations))
+    completed = [participant["challenge_id"] for participant in updated if participant and participant.get("completed_by") == activity["_id"]]
+    await asyncio.gather(*(record_completion(challenge_id, activity, now) for challenge_id in completed))
+    return completed
+
+async def record_completion(challenge_id: str, activity, now):
+    # Both writes are keyed by the completing activity, so recording it again is a no-op
+    notice = {
+        **notification(activity["user_id"], "challenge", activity["user_id"], activity["_id"]),
+        "challenge_id": challenge_id,
+        "created_at": now,
+    }
+    await asyncio.gather(
+        apply_once(challenge_collection, {"_id": ObjectId(challenge_id)}, {"$inc": {"completion_count": 1}}, activity["_id"], projection={"_id": 1}),
+        notification_collection.update_one(
+            {field: notice[field] for field in ("user_id", "kind", "challenge_id", "activity_id")},
+            {"$setOnInsert": notice},
+            upsert=True,
+        ),
+    )
+
+async def participations_among(user_id: str, challenge_ids) -> dict:
+    participants = await challenge_participant_collection.find(
+        {"challenge_id": {"$in": list(challenge_ids)}, "user_id": user_id}
+    ).to_list(None)
+    return {participant["challenge_id"]: participant for participant in participants}
+
+async def get_challenge(challenge_id: str, viewer_id: str):
+    # (challenge, the viewer's participation or None), or None
+    challenge = await find_challenge(challenge_id)
+    if challenge is None:
+        return None
+    participants = await participations_among(viewer_id, [challenge_id])
+    return challenge, participants.get(challenge_id)
+
+async def get_challenge_page(viewer_id: str, activity: str = None, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    query = {"activity_key": activity_key(activity)} if activity_key(activity) else {}
+    challenges, next_cursor = await fetch_page(challenge_collection, query, cursor, limit)
+    participants = await participations_among(viewer_id, [str(challenge["_id"]) for challenge in challenges])
+    return challenges, next_cursor, participants
+
+async def get_joined_page(user_id: str, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    # The user's participations, most recently joined first
+    participants, next_cursor = await fetch_page(challenge_participant_collection, {"user_id": user_id}, cursor, limit)
+    challenge_ids = [ObjectId(participant["challenge_id"]) for participant in participants]
+    challenges = await challenge_collection.find({"_id": {"$in": challenge_ids}}).to_list(len(challenge_ids))
+    by_id = {challenge["_id"]: challenge for challenge in challenges}
+    ordered = [by_id[challenge_id] for challenge_id in challenge_ids if challenge_id in by_id]
+    return ordered, next_cursor, {participant["challenge_id"]: participant for participant in participants}
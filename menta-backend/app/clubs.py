@@ -0,0 +1,201 @@
+import asyncio
+import random
+from collections import defaultdict
+from datetime import datetime
+from bson import ObjectId
+from decouple import config
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.crud import utcnow
+from app.database import (
+    user_collection, club_collection, club_member_collection, club_feed_collection, club_counter_collection,
+    club_contribution_collection,
+)
+from app.idempotency import apply_once
+from app.leaderboards import expires_at, period_bounds
+from app.loaders import UserSummaryLoader
+from app.pagination import DEFAULT_PAGE_SIZE, fetch_page
+from app.repository import USER_SUMMARY_PROJECTION
+from app.stats import BUCKET_FORMATS
+from app.timeline import load_activities
+from app.versions import PROFILE, forget, version_increments
+
+# Club totals are sharded counters: a write $incs one of CLUB_COUNTER_SHARDS documents for its
+# (club, bucket), picked at random, and a read sums the shards. Concurrent posts to a big club
+# then land on different documents instead of queueing on one. The "total" bucket holds the
+# member count; one bucket per ISO week holds the seconds and sessions members logged.
+CLUB_COUNTER_SHARDS = config("CLUB_COUNTER_SHARDS", default=16, cast=int)
+CLUB_TOP_CONTRIBUTORS = config("CLUB_TOP_CONTRIBUTORS", default=5, cast=int)
+TOTAL = "total"
+
+def activity_key(activity: str):
+    # Club types and activity names are matched case-insensitively ("Reading" vs "reading")
+    return activity.strip().casefold() if activity and activity.strip() else None
+
+def week_bucket(day) -> str:
+    return day.strftime(BUCKET_FORMATS["week"])
+
+async def add_counts(club_id: str, bucket: str, expires: datetime = None, effect_id=None, **amounts):
+    # With effect_id the shard follows from it, so a rerun of the same effect finds the shard
+    # it already counted on (see app.idempotency); effect ids are ObjectIds, spread evenly
+    shard = random.randrange(CLUB_COUNTER_SHARDS) if effect_id is None else int(str(effect_id), 16) % CLUB_COUNTER_SHARDS
+    on_insert = {"club_id": club_id, "bucket": bucket}
+    if expires is not None:
+        on_insert["expires_at"] = expires
+    await apply_once(
+        club_counter_collection,
+        {"_id": f"{club_id}:{bucket}:{shard}"},
+        {"$inc": amounts, "$setOnInsert": on_insert},
+        effect_id,
+        upsert=True,
+        projection={"_id": 1},
+    )
+
+async def read_counts(club_ids, bucket: str) -> dict:
+    # {club_id: {"members": n, ...}} summed over every shard of the bucket
+    totals = defaultdict(lambda: defaultdict(int))
+    projection = {"_id": 0, "club_id": 1, "members": 1, "seconds": 1, "sessions": 1}
+    async for shard in club_counter_collection.find({"club_id": {"$in": list(club_ids)}, "bucket": bucket}, projection):
+        for field, value in shard.items():
+            if field != "club_id":
+                totals[shard["club_id"]][field] += value
+    return totals
+
+async def find_club(club_id: str):
+    if not ObjectId.is_valid(club_id):
+        return None
+    return await club_collection.find_one({"_id": ObjectId(club_id)})
+
+async def create_club(owner_id: str, club_data: dict):
+    now = utcnow()
+    club = {**club_data, "activity_key": activity_key(club_data.get("activity")), "owner_id": owner_id, "created_at": now, "updated_at": now}
+    await club_collection.insert_one(club)
+    await join_club(str(club["_id"]), owner_id)
+    return club
+
+async def join_club(club_id: str, user_id: str) -> bool:
+    # The unique (club_id, user_id) index makes a repeated join a no-op
+    try:
+        await club_member_collection.insert_one({"club_id": club_id, "user_id": user_id, "created_at": utcnow()})
+    except DuplicateKeyError:
+        return False
+    await asyncio.gather(
+        user_collection.update_one({"_id": ObjectId(user_id)}, {"$addToSet": {"clubs": club_id}, "$inc": version_increments(PROFILE)}),
+        add_counts(club_id, TOTAL, members=1),
+    )
+    forget(user_id, PROFILE)
+    return True
+
+async def leave_club(club_id: str, user_id: str) -> bool:
+    result = await club_member_collection.delete_one({"club_id": club_id, "user_id": user_id})
+    if result.deleted_count == 0:
+        return False
+    await asyncio.gather(
+        user_collection.update_one({"_id": ObjectId(user_id)}, {"$pull": {"clubs": club_id}, "$inc": version_increments(PROFILE)}),
+        add_counts(club_id, TOTAL, members=-1),
+        club_feed_collection.delete_many({"club_id": club_id, "author_id": user_id}),
+    )
+    forget(user_id, PROFILE)
+    return True
+
+async def memberships_among(user_id: str, club_ids) -> set:
+    edges = await club_member_collection.find(
+        {"club_id": {"$in": list(club_ids)}, "user_id": user_id}, {"club_id": 1}
+    ).to_list(None)
+    return {edge["club_id"] for edge in edges}
+
+async def get_club(club_id: str, viewer_id: str):
+    # (club, member count, whether the viewer is a member), or None
+    club = await find_club(club_id)
+    if club is None:
+        return None
+    counts, memberships = await asyncio.gather(read_counts([club_id], TOTAL), memberships_among(viewer_id, [club_id]))
+    return club, counts.get(club_id, {}).get("members", 0), club_id in memberships
+
+async def get_club_page(viewer_id: str, activity: str = None, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    query = {"activity_key": activity_key(activity)} if activity_key(activity) else {}
+    clubs, next_cursor = await fetch_page(club_collection, query, cursor, limit)
+    club_ids = [str(club["_id"]) for club in clubs]
+    counts, memberships = await asyncio.gather(read_counts(club_ids, TOTAL), memberships_among(viewer_id, club_ids))
+    return clubs, next_cursor, {club_id: totals.get("members", 0) for club_id, totals in counts.items()}, memberships
+
+async def get_member_page(club_id: str, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    edges, next_cursor = await fetch_page(club_member_collection, {"club_id": club_id}, cursor, limit, {"user_id": 1, "created_at": 1})
+    user_ids = [ObjectId(edge["user_id"]) for edge in edges]
+    users = await user_collection.find({"_id": {"$in": user_ids}}, USER_SUMMARY_PROJECTION).to_list(len(user_ids))
+    by_id = {user["_id"]: user for user in users}
+    return [by_id[user_id] for user_id in user_ids if user_id in by_id], next_cursor
+
+async def get_club_feed(club_id: str, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    rows, next_cursor = await fetch_page(club_feed_collection, {"club_id": club_id}, cursor, limit,
+                                         {"activity_id": 1, "created_at": 1}, tie_field="activity_id")
+    return await load_activities([row["activity_id"] for row in rows]), next_cursor
+
+async def record_club_activity(activity):
+    # Fans a new activity out to the feeds of its author's clubs and adds it to their weekly
+    # totals. Clubs with a type only take sessions of that type.
+    user = await user_collection.find_one({"_id": ObjectId(activity["user_id"])}, {"clubs": 1})
+    club_ids = [ObjectId(club_id) for club_id in (user or {}).get("clubs", []) if ObjectId.is_valid(club_id)]
+    if not club_ids:
+        return
+    clubs = await club_collection.find({"_id": {"$in": club_ids}}, {"activity_key": 1}).to_list(None)
+    key = activity_key(activity["activity"])
+    club_ids = [str(club["_id"]) for club in clubs if club.get("activity_key") in (None, key)]
+    if not club_ids:
+        return
+
+    try:
+        await club_feed_collection.insert_many([
+            {"club_id": club_id, "activity_id": activity["_id"], "author_id": activity["user_id"], "created_at": activity["created_at"]}
+            for club_id in club_ids
+        ], ordered=False)
+    except BulkWriteError as e:
+        # Duplicate (club_id, activity_id) pairs mean the entry is already there
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+
+    day = datetime.strptime(activity["date"], "%Y-%m-%d").date()
+    expires = expires_at("week", day)
+    if expires <= utcnow():
+        return
+    week = week_bucket(day)
+
+    async def add_to_week(club_id: str):
+        # One contribution document per member and week, so only a member's own posts ever touch
+        # it, plus the week's shared totals. Each write is guarded on its own (see app.idempotency),
+        # so a rerun after a crash between them still makes the one that is missing.
+        await asyncio.gather(
+            apply_once(
+                club_contribution_collection,
+                {"club_id": club_id, "week": week, "user_id": activity["user_id"]},
+                {"$inc": {"seconds": activity["duration"]}, "$setOnInsert": {"expires_at": expires}},
+                activity["_id"],
+                upsert=True,
+                projection={"_id": 1},
+            ),
+            add_counts(club_id, week, expires, activity["_id"], seconds=activity["duration"], sessions=1),
+        )
+
+    await asyncio.gather(*(add_to_week(club_id) for club_id in club_ids))
+
+async def get_club_totals(club_id: str, day) -> dict:
+    week = week_bucket(day)
+    members, weekly, top = await asyncio.gather(
+        read_counts([club_id], TOTAL),
+        read_counts([club_id], week),
+        club_contribution_collection.find({"club_id": club_id, "week": week}, {"_id": 0, "user_id": 1, "seconds": 1})
+            .sort([("seconds", -1), ("user_id", 1)])
+            .limit(CLUB_TOP_CONTRIBUTORS)
+            .to_list(CLUB_TOP_CONTRIBUTORS),
+    )
+    users = await UserSummaryLoader().want(*(contributor["user_id"] for contributor in top)).load()
+    start, end = period_bounds("week", day)
+    this_week = weekly.get(club_id, {})
+    return {
+        "club_id": club_id,
+        "members": members.get(club_id, {}).get("members", 0),
+        "starts": start.isoformat(),
+        "ends": end.isoformat(),
+        "seconds": this_week.get("seconds", 0),
+        "sessions": this_week.get("sessions", 0),
+        "top_contributors": [{**contributor, "user": users.get(contributor["user_id"])} for contributor in top],
+    }
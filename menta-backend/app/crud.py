@@ -1,80 +1,209 @@
-from app.database import user_collection, user_helper, activity_collection, activity_helper, progress_collection, progress_helper
-from app.auth import get_password_hash, verify_password
+import asyncio
+from app.database import user_collection, activity_collection, progress_collection, progress_daily_collection, comment_collection, COMMENT_PREVIEW_SIZE
+from app.auth import hash_password, verify_and_update_password, invalidate_user
 from datetime import datetime, timedelta
-from app.utils import get_user_by_email
+from app.repository import user_profile, activity_card, comment_out, find_user_credentials, update_user_profile
+from app.jobs import enqueue, enqueue_many
+from app.push import publish_activity, publish_comment
+from app.versions import ACTIVITIES, PROFILE, bump_versions, forget
+from app.loaders import activity_users, comment_users, forget_summary
+from app.directory import index_name_tokens, search_fields
+from app.idempotency import apply_once
+from app.outbox import outbox_fields
 from bson import ObjectId
 
+def utcnow():
+    # BSON dates keep milliseconds; truncating up front keeps in-memory documents identical to stored ones
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
 async def create_user(user_data):
-    user_data["hashed_password"] = get_password_hash(user_data["password"])
+    user_data["hashed_password"] = await hash_password(user_data["password"])
+    # Filled in by app.clubs as the user joins clubs
+    user_data["clubs"] = []
     user_data.pop("password")
-    user_data["created_at"] = datetime.utcnow()
-    user_data["updated_at"] = datetime.utcnow()
-    new_user = await user_collection.insert_one(user_data)
-    created_user = await user_collection.find_one({"_id": new_user.inserted_id})
-    return user_helper(created_user)
+    user_data["created_at"] = utcnow()
+    user_data["updated_at"] = user_data["created_at"]
+    user_data.update(search_fields(user_data["first_name"], user_data["last_name"], user_data.get("location")))
+    # insert_one sets _id on user_data, so there is nothing to read back
+    await user_collection.insert_one(user_data)
+    await index_name_tokens(user_data["_id"], user_data["name_tokens"])
+    return user_profile(user_data)
 
 async def authenticate_user(email: str, password: str):
-    user = await get_user_by_email(email)
-    print(f"User found: {user}")  # Debugging line
+    user = await find_user_credentials(email)
     if not user:
         return False
-    if not verify_password(password, user["hashed_password"]):
+    verified, new_hash = await verify_and_update_password(password, user["hashed_password"])
+    if not verified:
         return False
+    if new_hash:
+        await user_collection.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
     return user
 
-async def create_activity(activity_data, user_id):
+def prepare_activity(activity_data, user_id, now):
     activity_data["user_id"] = user_id
-    activity_data["created_at"] = datetime.utcnow()
-    activity_data["updated_at"] = datetime.utcnow()
+    activity_data["created_at"] = now
+    activity_data["updated_at"] = now
     activity_data["end_time"] = (datetime.strptime(activity_data["start_time"], "%H:%M") + timedelta(minutes=activity_data["duration"])).strftime("%H:%M")
-    new_activity = await activity_collection.insert_one(activity_data)
-    created_activity = await activity_collection.find_one({"_id": new_activity.inserted_id})
+    return activity_data
 
-    # Update or create progress
-    existing_progress = await progress_collection.find_one({"user_id": user_id, "activity": activity_data["activity"]})
-    if existing_progress:
-        updated_streak = existing_progress["streak"] + 1
-        updated_time_spent = existing_progress["total_time_spent"] + activity_data["duration"] // 60
-        await progress_collection.update_one(
-            {"_id": existing_progress["_id"]},
-            {"$set": {
-                "streak": updated_streak,
-                "last_completed": datetime.utcnow(),
-                "total_time_spent": updated_time_spent,
-                "updated_at": datetime.utcnow()
-            }}
-        )
-    else:
-        new_progress = {
-            "user_id": user_id,
-            "activity": activity_data["activity"],
-            "streak": 1,
-            "last_completed": datetime.utcnow(),
-            "total_time_spent": activity_data["duration"] // 60,
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
-        await progress_collection.insert_one(new_progress)
+def activity_jobs(activity, staged_images=None) -> list:
+    # Feed fan-out, progress, leaderboards, clubs, challenges and image variants run on the job
+    # workers. Every payload carries the activity's _id, which is what keeps a rerun of the job
+    # from counting it twice (see app.tasks).
+    event = {
+        "_id": activity["_id"], "user_id": activity["user_id"], "activity": activity["activity"],
+        "date": activity["date"], "duration": activity["duration"], "created_at": activity["created_at"],
+    }
+    jobs = [
+        ("fan_out", {"_id": activity["_id"], "user_id": activity["user_id"], "created_at": activity["created_at"]}),
+        ("progress", event),
+        ("leaderboard", event),
+        ("club_activity", event),
+        ("challenges", event),
+    ]
+    if staged_images:
+        jobs.append(("image_variants", {"activity_id": activity["_id"], "staged_keys": staged_images}))
+    return jobs
+
+async def create_activity(activity_data, user_id, staged_images=None):
+    now = utcnow()
+    prepare_activity(activity_data, user_id, now)
+    activity_data["_id"] = ObjectId()
+    # Only the insert happens in the request. The jobs are written into the same document (see
+    # app.outbox), so they still run if this process dies before enqueueing them.
+    jobs = activity_jobs(activity_data, staged_images)
+    activity_data.update(outbox_fields(jobs, now))
+    await activity_collection.insert_one(activity_data)
+    await bump_versions(user_id, ACTIVITIES)
+    await enqueue_many(jobs)
+    await publish_activity(activity_data)
+
+    return activity_card(activity_data, await activity_users([activity_data]))
+
+def progress_daily_update(user_id: str, activity: str, day: str, seconds: int, sessions: int, now):
+    return (
+        {"user_id": user_id, "activity": activity, "day": day},
+        {
+            "$inc": {"time_spent_seconds": seconds, "sessions": sessions},
+            "$set": {"updated_at": now},
+            "$setOnInsert": {"created_at": now},
+        },
+    )
+
+def progress_summary_update(user_id: str, activity: str, day: str, seconds: int, sessions: int, now):
+    # Pipeline update: the streak grows on consecutive days, holds on the same day or for
+    # back-dated activities, and restarts at 1 after a gap
+    previous_day = (datetime.strptime(day, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+    return (
+        {"user_id": user_id, "activity": activity},
+        [{"$set": {
+            "streak": {"$switch": {
+                "branches": [
+                    {"case": {"$gte": ["$last_day", day]}, "then": "$streak"},
+                    {"case": {"$eq": ["$last_day", previous_day]}, "then": {"$add": ["$streak", 1]}},
+                ],
+                "default": 1,
+            }},
+            "last_day": {"$max": ["$last_day", day]},
+            "time_spent_seconds": {"$add": [
+                {"$ifNull": ["$time_spent_seconds", {"$multiply": [{"$ifNull": ["$total_time_spent", 0]}, 60]}]},
+                seconds,
+            ]},
+            "sessions": {"$add": [{"$ifNull": ["$sessions", 0]}, sessions]},
+            "last_completed": now,
+            "created_at": {"$ifNull": ["$created_at", now]},
+            "updated_at": now,
+        }}],
+    )
 
-    return activity_helper(created_activity)
+async def update_progress(user_id: str, activity: str, day: str, duration: int, activity_id=None):
+    # duration is in seconds; time is accumulated in seconds so short sessions are not rounded away.
+    # With activity_id, a rerun for the same activity changes nothing (see app.idempotency).
+    now = utcnow()
+    await asyncio.gather(
+        apply_once(progress_daily_collection, *progress_daily_update(user_id, activity, day, duration, 1, now), activity_id, upsert=True, projection={"_id": 1}),
+        apply_once(progress_collection, *progress_summary_update(user_id, activity, day, duration, 1, now), activity_id, upsert=True, projection={"_id": 1}),
+    )
 
 async def add_comment_to_activity(activity_id: str, comment: dict):
-    comment["timestamp"] = datetime.utcnow()
-    result = await activity_collection.update_one(
-        {"_id": ObjectId(activity_id)},
-        {"$push": {"comments": comment}}
+    if not ObjectId.is_valid(activity_id):
+        return None
+    comment["_id"] = ObjectId()
+    comment["activity_id"] = ObjectId(activity_id)
+    comment["timestamp"] = utcnow()
+    # The activity keeps only a counter and a bounded preview of the newest comments
+    activity = await activity_collection.find_one_and_update(
+        {"_id": comment["activity_id"]},
+        {
+            "$inc": {"comment_count": 1},
+            "$push": {"comments_preview": {
+                "$each": [{"user_id": comment["user_id"], "text": comment["text"], "timestamp": comment["timestamp"]}],
+                "$slice": -COMMENT_PREVIEW_SIZE,
+            }},
+        },
+        projection={"user_id": 1},
     )
-    if result.modified_count == 1:
-        updated_activity = await activity_collection.find_one({"_id": ObjectId(activity_id)})
-        return activity_helper(updated_activity)
-    return None
+    if activity is None:
+        return None
+    await comment_collection.insert_one(comment)
+    # The owner's activity list shows comment counts and previews
+    await bump_versions(activity["user_id"], ACTIVITIES)
+    await publish_comment(comment, activity["user_id"])
+    if activity["user_id"] != comment["user_id"]:
+        await enqueue("notification", notification(activity["user_id"], "comment", comment["user_id"], comment["activity_id"]))
+    return comment_out(comment, await comment_users([comment]))
+
+def notification(user_id: str, kind: str, actor_id: str, activity_id=None) -> dict:
+    # The _id is fixed at enqueue time so a rerun of the job can't notify twice
+    return {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "kind": kind,
+        "actor_id": actor_id,
+        "activity_id": activity_id,
+        "read": False,
+    }
 
 async def update_user(user_id, updated_data):
-    result = await user_collection.update_one(
-        {"_id": ObjectId(user_id)},
-        {"$set": updated_data}
-    )
-    if result.modified_count == 1:
-        updated_user = await user_collection.find_one({"_id": ObjectId(user_id)})
-        return user_helper(updated_user)
-    return None
+    if "first_name" in updated_data and "last_name" in updated_data:
+        updated_data.update(search_fields(updated_data["first_name"], updated_data["last_name"], updated_data.get("location")))
+    updated_user = await update_user_profile(user_id, updated_data)
+    if updated_user and "name_tokens" in updated_data:
+        await index_name_tokens(ObjectId(user_id), updated_data["name_tokens"])
+    invalidate_user(user_id)
+    forget(user_id, PROFILE, ACTIVITIES)
+    forget_summary(user_id)
+    return updated_user
+
+async def migrate_embedded_comments():
+    # One-off: move the comments older activities still embed into the comments collection.
+    # Comments already added since then sit in comment_count and comments_preview, so the old
+    # ones are counted on top and prepended to the preview, and the embedded array goes away.
+    # Comments copied by a run that died before its activity update are replaced, not doubled.
+    async for activity in activity_collection.find({"comments": {"$exists": True}}, {"user_id": 1, "comments": 1}):
+        comments = [
+            {"_id": ObjectId(), "activity_id": activity["_id"], "user_id": comment["user_id"], "text": comment["text"],
+             "timestamp": comment["timestamp"], "migrated": True}
+            for comment in activity["comments"]
+        ]
+        await comment_collection.delete_many({"activity_id": activity["_id"], "migrated": True})
+        if comments:
+            await comment_collection.insert_many(comments)
+        await activity_collection.update_one(
+            {"_id": activity["_id"], "comments": {"$exists": True}},
+            {
+                "$inc": {"comment_count": len(comments)},
+                "$push": {"comments_preview": {
+                    "$each": [{key: comment[key] for key in ("user_id", "text", "timestamp")} for comment in comments[-COMMENT_PREVIEW_SIZE:]],
+                    "$position": 0,
+                    "$slice": -COMMENT_PREVIEW_SIZE,
+                }},
+                "$unset": {"comments": ""},
+            },
+        )
+        await bump_versions(activity["user_id"], ACTIVITIES)
+
+if __name__ == "__main__":
+    asyncio.run(migrate_embedded_comments())
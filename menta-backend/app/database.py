@@ -1,72 +1,214 @@
 import motor.motor_asyncio
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
 from decouple import config
 import certifi
+from app.metrics import command_timer
 
 MONGO_DETAILS = config("MONGO_DETAILS")
+COMMENT_PREVIEW_SIZE = config("COMMENT_PREVIEW_SIZE", default=3, cast=int)
 
+# Motor doesn't open a connection until the first operation, so building the client at import
+# time is free; connect() and close() below tie its pool to the app's lifespan
 client = motor.motor_asyncio.AsyncIOMotorClient(
     MONGO_DETAILS,
-    serverSelectionTimeoutMS=50000, 
-    socketTimeoutMS=50000, 
-    connectTimeoutMS=50000,  
-    tlsCAFile=certifi.where() 
+    maxPoolSize=config("MONGO_MAX_POOL_SIZE", default=100, cast=int),
+    minPoolSize=config("MONGO_MIN_POOL_SIZE", default=0, cast=int),
+    maxIdleTimeMS=config("MONGO_MAX_IDLE_TIME_MS", default=300000, cast=int),
+    # How long a request may wait for a free pooled connection before failing
+    waitQueueTimeoutMS=config("MONGO_WAIT_QUEUE_TIMEOUT_MS", default=5000, cast=int),
+    serverSelectionTimeoutMS=config("MONGO_SERVER_SELECTION_TIMEOUT_MS", default=5000, cast=int),
+    connectTimeoutMS=config("MONGO_CONNECT_TIMEOUT_MS", default=5000, cast=int),
+    socketTimeoutMS=config("MONGO_SOCKET_TIMEOUT_MS", default=20000, cast=int),
+    tlsCAFile=certifi.where(),
+    event_listeners=[command_timer],
 )
 database = client["menta"]
 
 user_collection = database.get_collection("users")
+name_token_collection = database.get_collection("user_name_tokens")
 activity_collection = database.get_collection("activities")
 progress_collection = database.get_collection("progress")
+progress_daily_collection = database.get_collection("progress_daily")
+timeline_collection = database.get_collection("timelines")
+comment_collection = database.get_collection("comments")
+follow_collection = database.get_collection("follows")
+job_collection = database.get_collection("jobs")
+effect_collection = database.get_collection("applied_effects")
+notification_collection = database.get_collection("notifications")
+leaderboard_collection = database.get_collection("leaderboards")
+leaderboard_rank_collection = database.get_collection("leaderboard_ranks")
+club_collection = database.get_collection("clubs")
+club_member_collection = database.get_collection("club_members")
+club_feed_collection = database.get_collection("club_feeds")
+club_counter_collection = database.get_collection("club_counters")
+club_contribution_collection = database.get_collection("club_contributions")
+challenge_collection = database.get_collection("challenges")
+challenge_participant_collection = database.get_collection("challenge_participants")
 
-def user_helper(user) -> dict:
-    return {
-        "id": str(user["_id"]),
-        "first_name": user["first_name"],
-        "last_name": user["last_name"],
-        "email": user["email"],
-        "dob": user.get("dob"),  
-        "interests": user["interests"],
-        "profile_picture": user.get("profile_picture"), 
-        "cover_photo": user.get("cover_photo"),
-        "location": user.get("location"), 
-        "bio": user.get("bio"),  
-        "clubs": user.get("clubs", []),
-        "followers": user.get("followers", []),
-        "following": user.get("following", []),
-        "hashed_password": user["hashed_password"],
-        "created_at": user["created_at"],
-        "updated_at": user["updated_at"],
-    }
-
-def activity_helper(activity) -> dict:
-    return {
-        "id": str(activity["_id"]),
-        "title": activity["title"],
-        "description": activity["description"],
-        "activity": activity["activity"],
-        "date": activity["date"],
-        "start_time": activity["start_time"],
-        "end_time": activity["end_time"],
-        "duration": activity["duration"],
-        "private_notes": activity["private_notes"],
-        "privacy_type": activity["privacy_type"],
-        "perceived_performance": activity["perceived_performance"],
-        "images": activity["images"],
-        "user_id": activity["user_id"],
-        "created_at": activity["created_at"],
-        "updated_at": activity["updated_at"],
-        "comments": activity.get("comments", [])
-    }
-
-def progress_helper(progress) -> dict:
-    return {
-        "id": str(progress["_id"]),
-        "user_id": progress["user_id"],
-        "activity": progress["activity"],
-        "streak": progress["streak"],
-        "last_completed": progress["last_completed"],
-        "total_completed": progress["total_completed"],
-        "time_spent": progress["time_spent"],  # Time spent on this activity in minutes
-        "created_at": progress["created_at"],
-        "updated_at": progress["updated_at"],
-    }
+# Keyset pagination walks (created_at, _id) in descending order
+ACTIVITY_INDEXES = [
+    IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_at_id"),
+    IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date"),
+    # Only activities with jobs still outstanding carry outbox_due_at (see app.outbox)
+    IndexModel([("outbox_due_at", ASCENDING)], name="outbox_due_at", sparse=True),
+]
+
+TIMELINE_TTL_DAYS = config("TIMELINE_TTL_DAYS", default=30, cast=int)
+
+# Home timelines are read as one range scan per owner and expire after TIMELINE_TTL_DAYS
+TIMELINE_INDEXES = [
+    IndexModel([("owner_id", ASCENDING), ("created_at", DESCENDING), ("activity_id", DESCENDING)], name="owner_created_at_activity"),
+    IndexModel([("owner_id", ASCENDING), ("activity_id", ASCENDING)], name="owner_activity", unique=True),
+    IndexModel([("owner_id", ASCENDING), ("author_id", ASCENDING)], name="owner_author"),
+    IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=TIMELINE_TTL_DAYS * 86400),
+]
+
+# One summary row per (user, activity) and one rollup row per (user, activity, day)
+PROGRESS_INDEXES = [
+    IndexModel([("user_id", ASCENDING), ("activity", ASCENDING)], name="user_activity", unique=True),
+]
+
+PROGRESS_DAILY_INDEXES = [
+    IndexModel([("user_id", ASCENDING), ("activity", ASCENDING), ("day", ASCENDING)], name="user_activity_day", unique=True),
+    IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], name="user_day"),
+]
+
+COMMENT_INDEXES = [
+    IndexModel([("activity_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="activity_timestamp_id"),
+]
+
+# A follow is one edge document; both directions page by (created_at, _id)
+FOLLOW_INDEXES = [
+    IndexModel([("follower_id", ASCENDING), ("followee_id", ASCENDING)], name="follower_followee", unique=True),
+    IndexModel([("followee_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="followee_created_at_id"),
+    IndexModel([("follower_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="follower_created_at_id"),
+]
+
+# Login and registration look users up by email; the unique index also closes the
+# check-then-insert race in /register. Directory listing: exact filters, newest accounts first.
+USER_INDEXES = [
+    IndexModel([("email", ASCENDING)], name="email", unique=True),
+    IndexModel([("interests", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="interests_created_at_id"),
+    IndexModel([("location_key", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="location_created_at_id"),
+    IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+    IndexModel([("high_fanout", ASCENDING)], name="high_fanout", partialFilterExpression={"high_fanout": True}),
+]
+
+# Name search walks one (token, user) entry per normalized name token, so a prefix is a
+# single range scan already in page order (see app.directory)
+NAME_TOKEN_INDEXES = [
+    IndexModel([("token", ASCENDING), ("user_id", ASCENDING)], name="token_user", unique=True),
+    IndexModel([("user_id", ASCENDING)], name="user"),
+]
+
+JOB_RETENTION_DAYS = config("JOB_RETENTION_DAYS", default=7, cast=int)
+
+# Workers claim the oldest due job, or a running one whose lease ran out; finished jobs
+# (done or out of retries) are kept JOB_RETENTION_DAYS for inspection
+JOB_INDEXES = [
+    IndexModel([("status", ASCENDING), ("run_at", ASCENDING)], name="status_run_at"),
+    IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease_expires_at"),
+    IndexModel([("finished_at", ASCENDING)], name="finished_at_ttl", expireAfterSeconds=JOB_RETENTION_DAYS * 86400),
+]
+
+# Receipts of applied job side effects (see app.idempotency); reruns come within hours
+APPLIED_EFFECT_RETENTION_DAYS = config("APPLIED_EFFECT_RETENTION_DAYS", default=14, cast=int)
+
+EFFECT_INDEXES = [
+    IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=APPLIED_EFFECT_RETENTION_DAYS * 86400),
+]
+
+NOTIFICATION_INDEXES = [
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_at_id"),
+]
+
+# A leaderboard is every (board, user) score of one period; boards are read top-down, or for a
+# given set of users. Rank counters (see app.leaderboards) are only ever read by _id. Both
+# expire LEADERBOARD_RETENTION_DAYS after their period ends.
+LEADERBOARD_INDEXES = [
+    IndexModel([("board", ASCENDING), ("seconds", DESCENDING), ("user_id", ASCENDING)], name="board_seconds_user"),
+    IndexModel([("board", ASCENDING), ("user_id", ASCENDING)], name="board_user", unique=True),
+    IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+]
+
+LEADERBOARD_RANK_INDEXES = [
+    IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+]
+
+CLUB_INDEXES = [
+    IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+    IndexModel([("activity_key", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="activity_created_at_id"),
+]
+
+# Membership is an edge per (club, user), paged from either side like follows
+CLUB_MEMBER_INDEXES = [
+    IndexModel([("club_id", ASCENDING), ("user_id", ASCENDING)], name="club_user", unique=True),
+    IndexModel([("club_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="club_created_at_id"),
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_at_id"),
+]
+
+# Club feeds are fanned out like home timelines and expire with them
+CLUB_FEED_INDEXES = [
+    IndexModel([("club_id", ASCENDING), ("created_at", DESCENDING), ("activity_id", DESCENDING)], name="club_created_at_activity"),
+    IndexModel([("club_id", ASCENDING), ("activity_id", ASCENDING)], name="club_activity", unique=True),
+    IndexModel([("club_id", ASCENDING), ("author_id", ASCENDING)], name="club_author"),
+    IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=TIMELINE_TTL_DAYS * 86400),
+]
+
+# Counter shards are summed per (club, bucket); weekly buckets and contributions expire like leaderboards
+CLUB_COUNTER_INDEXES = [
+    IndexModel([("club_id", ASCENDING), ("bucket", ASCENDING)], name="club_bucket"),
+    IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+]
+
+CLUB_CONTRIBUTION_INDEXES = [
+    IndexModel([("club_id", ASCENDING), ("week", ASCENDING), ("user_id", ASCENDING)], name="club_week_user", unique=True),
+    IndexModel([("club_id", ASCENDING), ("week", ASCENDING), ("seconds", DESCENDING), ("user_id", ASCENDING)], name="club_week_seconds_user"),
+    IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+]
+
+CHALLENGE_INDEXES = [
+    IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+    IndexModel([("activity_key", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="activity_created_at_id"),
+]
+
+# A participation carries its challenge's activity type and window, so a new activity finds the
+# author's open challenges for that type with one range scan, however many challenges exist
+CHALLENGE_PARTICIPANT_INDEXES = [
+    IndexModel([("challenge_id", ASCENDING), ("user_id", ASCENDING)], name="challenge_user", unique=True),
+    IndexModel([("user_id", ASCENDING), ("activity_key", ASCENDING), ("ends", ASCENDING)], name="user_activity_ends"),
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_at_id"),
+]
+
+async def connect():
+    # Fail fast at startup if Mongo is unreachable, then make sure every index exists.
+    # create_indexes is a no-op for indexes that already exist with the same definition.
+    await client.admin.command("ping")
+    await ensure_indexes()
+
+def close():
+    client.close()
+
+async def ensure_indexes():
+    await activity_collection.create_indexes(ACTIVITY_INDEXES)
+    await timeline_collection.create_indexes(TIMELINE_INDEXES)
+    await user_collection.create_indexes(USER_INDEXES)
+    await name_token_collection.create_indexes(NAME_TOKEN_INDEXES)
+    await progress_collection.create_indexes(PROGRESS_INDEXES)
+    await progress_daily_collection.create_indexes(PROGRESS_DAILY_INDEXES)
+    await comment_collection.create_indexes(COMMENT_INDEXES)
+    await follow_collection.create_indexes(FOLLOW_INDEXES)
+    await job_collection.create_indexes(JOB_INDEXES)
+    await effect_collection.create_indexes(EFFECT_INDEXES)
+    await notification_collection.create_indexes(NOTIFICATION_INDEXES)
+    await leaderboard_collection.create_indexes(LEADERBOARD_INDEXES)
+    await leaderboard_rank_collection.create_indexes(LEADERBOARD_RANK_INDEXES)
+    await club_collection.create_indexes(CLUB_INDEXES)
+    await club_member_collection.create_indexes(CLUB_MEMBER_INDEXES)
+    await club_feed_collection.create_indexes(CLUB_FEED_INDEXES)
+    await club_counter_collection.create_indexes(CLUB_COUNTER_INDEXES)
+    await club_contribution_collection.create_indexes(CLUB_CONTRIBUTION_INDEXES)
+    await challenge_collection.create_indexes(CHALLENGE_INDEXES)
+    await challenge_participant_collection.create_indexes(CHALLENGE_PARTICIPANT_INDEXES)
@@ -0,0 +1,112 @@
+import asyncio
+import re
+import unicodedata
+from decouple import config
+from pymongo import UpdateOne
+from app.database import name_token_collection, user_collection
+from app.pagination import DEFAULT_PAGE_SIZE, decode_key_cursor, encode_key_cursor, fetch_page
+from app.repository import USER_SUMMARY_PROJECTION
+
+# Token entries read per round trip while filling a page of name search results
+SEARCH_SCAN_BATCH = config("SEARCH_SCAN_BATCH", default=200, cast=int)
+
+def normalize(text: str) -> str:
+    # Lowercase and strip accents so "Zoë" and "zoe" share an index range
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower().strip()
+
+def tokenize(text: str) -> list:
+    return [token for token in re.split(r"[^\w]+", normalize(text)) if token]
+
+def search_fields(first_name: str, last_name: str, location: str = None) -> dict:
+    return {
+        "name_tokens": sorted(set(tokenize(first_name) + tokenize(last_name))),
+        "location_key": normalize(location) or None,
+    }
+
+def prefix_range(prefix: str) -> dict:
+    # [prefix, prefix with its last character bumped) covers every string starting with prefix
+    return {"$gte": prefix, "$lt": prefix[:-1] + chr(ord(prefix[-1]) + 1)}
+
+def search_query(q: str = None, interest: str = None, location: str = None) -> dict:
+    clauses = [{"name_tokens": prefix_range(token)} for token in tokenize(q)]
+    if interest:
+        clauses.append({"interests": interest})
+    if location:
+        clauses.append({"location_key": normalize(location)})
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+def name_token_entries(user_id, tokens: list) -> list:
+    return [{"token": token, "user_id": user_id} for token in tokens]
+
+async def index_name_tokens(user_id, tokens: list):
+    # Brings the user's search entries in line with their current name tokens
+    await name_token_collection.delete_many({"user_id": user_id, "token": {"$nin": tokens}})
+    if tokens:
+        await name_token_collection.bulk_write([
+            UpdateOne(entry, {"$setOnInsert": entry}, upsert=True) for entry in name_token_entries(user_id, tokens)
+        ], ordered=False)
+
+def first_match(tokens: list, prefix: str):
+    return min((token for token in tokens if token.startswith(prefix)), default=None)
+
+async def search_by_name(q: str, interest: str, location: str, cursor: str, limit: int):
+    # Name search pages through the token entries of the longest query token (the narrowest
+    # range) in (token, user_id) order, straight off their index, so nothing is sorted in
+    # memory however many names share a short prefix. Sorting users by their multikey
+    # name_tokens can't be served by an index once the range narrows it. The other filters are
+    # checked against the candidates' user documents, and a user whose name has several tokens
+    # under the prefix is only listed under the first of them.
+    lead = max(tokenize(q), key=len)
+    query = search_query(q, interest, location)
+    position = decode_key_cursor(cursor) if cursor else None
+    found = []
+    while len(found) <= limit:
+        scan = {"token": prefix_range(lead)}
+        if position:
+            scan["$or"] = [{"token": {"$gt": position[0]}}, {"token": position[0], "user_id": {"$gt": position[1]}}]
+        entries = await name_token_collection.find(scan, {"_id": 0, "token": 1, "user_id": 1}) \
+            .sort([("token", 1), ("user_id", 1)]) \
+            .limit(SEARCH_SCAN_BATCH) \
+            .to_list(SEARCH_SCAN_BATCH)
+        if not entries:
+            break
+        users = await user_collection.find(
+            {**query, "_id": {"$in": [entry["user_id"] for entry in entries]}}, {**USER_SUMMARY_PROJECTION, "name_tokens": 1}
+        ).to_list(None)
+        by_id = {user["_id"]: user for user in users}
+        for entry in entries:
+            user = by_id.get(entry["user_id"])
+            if user and first_match(user["name_tokens"], lead) == entry["token"]:
+                found.append((entry, user))
+        position = (entries[-1]["token"], entries[-1]["user_id"])
+        if len(entries) < SEARCH_SCAN_BATCH:
+            break
+    if len(found) <= limit:
+        return [user for _, user in found], None
+    last, _ = found[limit - 1]
+    return [user for _, user in found[:limit]], encode_key_cursor(last["token"], last["user_id"])
+
+async def search_users(q: str = None, interest: str = None, location: str = None,
+                       cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    if tokenize(q):
+        return await search_by_name(q, interest, location, cursor, limit)
+    return await fetch_page(user_collection, search_query(None, interest, location), cursor, limit, USER_SUMMARY_PROJECTION)
+
+async def backfill_search_fields():
+    # One-off: derive the normalized search keys for users created before they existed, and
+    # the name token entries search pages through
+    async for user in user_collection.find({"name_tokens": {"$exists": False}}, {"first_name": 1, "last_name": 1, "location": 1}):
+        await user_collection.update_one(
+            {"_id": user["_id"]},
+            {"$set": search_fields(user["first_name"], user["last_name"], user.get("location"))},
+        )
+    async for user in user_collection.find({}, {"name_tokens": 1}):
+        await index_name_tokens(user["_id"], user["name_tokens"])
+
+if __name__ == "__main__":
+    asyncio.run(backfill_search_fields())
@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from decouple import config
+from app.database import activity_collection
+
+# Documents per getMore; the response is written row by row, so memory stays flat
+EXPORT_BATCH_SIZE = config("EXPORT_BATCH_SIZE", default=500, cast=int)
+
+# Same columns the importer reads, so an export can be re-imported as is
+EXPORT_FIELDS = [
+    "title", "description", "activity", "date", "start_time", "end_time", "duration",
+    "private_notes", "privacy_type", "perceived_performance", "images", "comment_count",
+    "created_at", "updated_at",
+]
+EXPORT_PROJECTION = {field: 1 for field in EXPORT_FIELDS}
+
+def export_row(activity) -> dict:
+    row = {field: activity.get(field) for field in EXPORT_FIELDS}
+    row["id"] = str(activity["_id"])
+    row["images"] = row["images"] or []
+    row["comment_count"] = row["comment_count"] or 0
+    for field in ("created_at", "updated_at"):
+        if row[field] is not None:
+            row[field] = row[field].isoformat()
+    return row
+
+def csv_line(values) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+async def export_activities(user_id: str, file_format: str):
+    # Oldest first, straight off the (user_id, created_at, _id) index
+    cursor = activity_collection.find({"user_id": user_id}, EXPORT_PROJECTION) \
+        .sort([("created_at", 1), ("_id", 1)]) \
+        .batch_size(EXPORT_BATCH_SIZE)
+    if file_format == "csv":
+        yield csv_line(["id"] + EXPORT_FIELDS)
+    async for activity in cursor:
+        row = export_row(activity)
+        if file_format == "csv":
+            row["images"] = ";".join(row["images"])
+            yield csv_line([row["id"]] + [row[field] for field in EXPORT_FIELDS])
+        else:
+            yield json.dumps(row) + "\n"
@@ -0,0 +1,82 @@
+import asyncio
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.crud import utcnow
+from app.database import user_collection, follow_collection
+from app.pagination import DEFAULT_PAGE_SIZE, fetch_page
+from app.repository import USER_SUMMARY_PROJECTION
+from app.versions import PROFILE, forget, version_increments
+
+async def add_follow(follower_id: str, followee_id: str) -> bool:
+    # The unique (follower_id, followee_id) index makes a repeated follow a no-op
+    try:
+        await follow_collection.insert_one({
+            "follower_id": follower_id,
+            "followee_id": followee_id,
+            "created_at": utcnow(),
+        })
+    except DuplicateKeyError:
+        return False
+    await asyncio.gather(
+        user_collection.update_one({"_id": ObjectId(followee_id)}, {"$inc": {"follower_count": 1, **version_increments(PROFILE)}}),
+        user_collection.update_one({"_id": ObjectId(follower_id)}, {"$inc": {"following_count": 1, **version_increments(PROFILE)}}),
+    )
+    forget(followee_id, PROFILE)
+    forget(follower_id, PROFILE)
+    return True
+
+async def remove_follow(follower_id: str, followee_id: str) -> bool:
+    result = await follow_collection.delete_one({"follower_id": follower_id, "followee_id": followee_id})
+    if result.deleted_count == 0:
+        return False
+    await asyncio.gather(
+        user_collection.update_one({"_id": ObjectId(followee_id)}, {"$inc": {"follower_count": -1, **version_increments(PROFILE)}}),
+        user_collection.update_one({"_id": ObjectId(follower_id)}, {"$inc": {"following_count": -1, **version_increments(PROFILE)}}),
+    )
+    forget(followee_id, PROFILE)
+    forget(follower_id, PROFILE)
+    return True
+
+async def is_following(follower_id: str, followee_id: str) -> bool:
+    edge = await follow_collection.find_one({"follower_id": follower_id, "followee_id": followee_id}, {"_id": 1})
+    return edge is not None
+
+async def following_among(follower_id: str, user_ids) -> list:
+    # Which of user_ids does follower_id follow; one probe of the unique edge index per id
+    edges = await follow_collection.find(
+        {"follower_id": follower_id, "followee_id": {"$in": list(user_ids)}},
+        {"followee_id": 1},
+    ).to_list(None)
+    return [edge["followee_id"] for edge in edges]
+
+async def iter_follower_ids(followee_id: str, batch_size: int):
+    batch = []
+    async for edge in follow_collection.find({"followee_id": followee_id}, {"follower_id": 1}).batch_size(batch_size):
+        batch.append(edge["follower_id"])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def get_follow_page(user_id: str, direction: str, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    # direction is "followers" (edges pointing at user_id) or "following" (edges from user_id)
+    if direction == "followers":
+        query, other = {"followee_id": user_id}, "follower_id"
+    else:
+        query, other = {"follower_id": user_id}, "followee_id"
+    edges, next_cursor = await fetch_page(follow_collection, query, cursor, limit, {other: 1, "created_at": 1})
+    user_ids = [ObjectId(edge[other]) for edge in edges]
+    users = await user_collection.find({"_id": {"$in": user_ids}}, USER_SUMMARY_PROJECTION).to_list(len(user_ids))
+    by_id = {user["_id"]: user for user in users}
+    return [by_id[user_id] for user_id in user_ids if user_id in by_id], next_cursor
+
+async def migrate_embedded_follows():
+    # One-off: turn the old followers/following arrays on user documents into edges and counters
+    async for user in user_collection.find({"following": {"$exists": True}}, {"following": 1}):
+        for followee_id in user.get("following", []):
+            await add_follow(str(user["_id"]), followee_id)
+    await user_collection.update_many({}, {"$unset": {"followers": "", "following": ""}})
+
+if __name__ == "__main__":
+    asyncio.run(migrate_embedded_follows())
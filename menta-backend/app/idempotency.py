@@ -0,0 +1,79 @@
+import hashlib
+from datetime import datetime
+from bson import json_util
+from decouple import config
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.database import effect_collection
+
+# The side effects of a new activity (progress, leaderboards, club totals, challenges) run as
+# jobs, and a job can run more than once (see app.jobs). Every (effect, target document) pair
+# gets a receipt in applied_effects, unique by _id, and applying the effect goes:
+#   1. create the receipt, or find it; a done receipt means there is nothing left to do
+#   2. update the target only while its pending_effects doesn't hold the receipt, in the same
+#      write that adds it, so a rerun after a crash between steps 2 and 3 can't count twice
+#   3. mark the receipt done, then take it off the target
+# A target only ever lists effects in flight, never a history of them, so however many other
+# effects reach a busy document before a rerun comes, the receipt still recognises it.
+# Receipts expire after APPLIED_EFFECT_RETENTION_DAYS (see app.database), long after any rerun.
+PENDING_EFFECTS_LIMIT = config("PENDING_EFFECTS_LIMIT", default=64, cast=int)
+
+def receipt_id(collection, query: dict, effect_id) -> str:
+    # The target is whatever the query selects, so the same effect on the same query is the same receipt
+    target = hashlib.sha1(json_util.dumps(query, sort_keys=True).encode()).hexdigest()
+    return f"{effect_id}:{collection.name}:{target}"
+
+def marked(update, receipt: str):
+    # The update, also listing the receipt as in flight on the document. Only effects that died
+    # between steps 2 and 3 linger in the list, and only the newest PENDING_EFFECTS_LIMIT of them.
+    if isinstance(update, list):
+        return update + [{"$set": {"pending_effects": {"$slice": [
+            {"$concatArrays": [{"$ifNull": ["$pending_effects", []]}, [receipt]]}, -PENDING_EFFECTS_LIMIT,
+        ]}}}]
+    return {**update, "$push": {"pending_effects": {"$each": [receipt], "$slice": -PENDING_EFFECTS_LIMIT}}}
+
+async def open_receipt(receipt: str) -> dict:
+    try:
+        return await effect_collection.find_one_and_update(
+            {"_id": receipt},
+            {"$setOnInsert": {"done": False, "created_at": datetime.utcnow()}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Another run of the same job created it first
+        return await effect_collection.find_one({"_id": receipt})
+
+async def close_receipt(collection, receipt: str, target_id):
+    await effect_collection.update_one({"_id": receipt}, {"$set": {"done": True}})
+    if target_id is not None:
+        await collection.update_one({"_id": target_id}, {"$pull": {"pending_effects": receipt}})
+
+async def apply_once(collection, query: dict, update, effect_id, upsert: bool = False, **kwargs):
+    # find_one_and_update that applies effect_id to the document query selects at most once.
+    # Returns (whether this call applied it, the document find_one_and_update returned). An
+    # effect_id of None applies unconditionally, for callers that never rerun (e.g. imports).
+    if effect_id is None:
+        return True, await collection.find_one_and_update(query, update, upsert=upsert, **kwargs)
+    receipt = receipt_id(collection, query, effect_id)
+    if (await open_receipt(receipt))["done"]:
+        return False, None
+    guarded, update = {**query, "pending_effects": {"$ne": receipt}}, marked(update, receipt)
+    try:
+        document = await collection.find_one_and_update(guarded, update, upsert=upsert, **kwargs)
+        applied = document is not None or upsert
+    except DuplicateKeyError:
+        # The upsert found no document without the receipt and tried to insert one: either the
+        # document already lists it, or another effect created the document first. Only in the
+        # second case does the update match now.
+        document = await collection.find_one_and_update(guarded, update, **kwargs)
+        applied = document is not None
+    if document is not None and "_id" in document:
+        target_id = document["_id"]
+    else:
+        # Inserted by the upsert, or applied by an earlier run that died before step 3
+        target = await collection.find_one({**query, "pending_effects": receipt}, {"_id": 1})
+        target_id = target["_id"] if target else None
+    if applied or target_id is not None:
+        await close_receipt(collection, receipt, target_id)
+    return applied, document
@@ -0,0 +1,95 @@
+import asyncio
+import io
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from decouple import config
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+IMAGE_WORKERS = config("IMAGE_WORKERS", default=2, cast=int)
+IMAGE_QUALITY = config("IMAGE_QUALITY", default=82, cast=int)
+# Uploads are only checked this far in (format and dimensions); the image job decodes the rest
+IMAGE_HEADER_BYTES = config("IMAGE_HEADER_BYTES", default=256 * 1024, cast=int)
+
+# Longest edge in pixels. "full" is what gets served instead of the original, which is never stored.
+VARIANTS = {
+    "thumbnail": 160,
+    "feed": 640,
+    "full": 1600,
+}
+
+class InvalidImage(ValueError):
+    pass
+
+def decode(data: bytes) -> Image.Image:
+    # Opening only reads the header; load() decodes the pixels, so truncated or corrupt files
+    # fail here as InvalidImage rather than halfway through a resize. Pillow reports broken
+    # files as OSError, SyntaxError or ValueError depending on the format.
+    try:
+        image = Image.open(io.BytesIO(data))
+        # JPEG can decode straight at a reduced scale when the original is much larger than we need
+        image.draft("RGB", (VARIANTS["full"], VARIANTS["full"]))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+        return image.convert("RGB")
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        raise InvalidImage(str(e) or type(e).__name__)
+
+def check_header(data: bytes, complete: bool):
+    # Opening parses the format and dimensions, which also turns away decompression bombs;
+    # verify() needs the whole file, so it only runs when the header read got all of it
+    try:
+        image = Image.open(io.BytesIO(data))
+        if complete:
+            image.verify()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError, ValueError) as e:
+        raise InvalidImage(str(e) or type(e).__name__)
+
+def render_variants(data: bytes) -> dict:
+    # Runs in a worker process: decode once, then downscale from the largest variant to the smallest
+    image = decode(data)
+    rendered = {}
+    for name, size in sorted(VARIANTS.items(), key=lambda item: -item[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        # Nothing but pixels is written back, so EXIF (GPS, camera serials) is dropped here
+        image.save(buffer, "JPEG", quality=IMAGE_QUALITY, optimize=True, progressive=True)
+        rendered[name] = buffer.getvalue()
+    return rendered
+
+class ImageProcessor:
+    def __init__(self, storage):
+        self.storage = storage
+        # spawn keeps forked children from inheriting the event loop's threads and sockets
+        self.pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def save_image(self, upload) -> dict:
+        return await self.save_rendered(await upload.read())
+
+    async def save_staged(self, key: str) -> dict:
+        return await self.save_rendered(await self.storage.load_staged(key))
+
+    async def save_rendered(self, data: bytes) -> dict:
+        rendered = await asyncio.get_running_loop().run_in_executor(self.pool, render_variants, data)
+        key = uuid.uuid4()
+        names = list(rendered)
+        urls = await asyncio.gather(*(
+            self.storage.save(io.BytesIO(rendered[name]), f"{key}-{name}.jpg", "image/jpeg") for name in names
+        ))
+        return dict(zip(names, urls))
+
+    async def check_uploads(self, files):
+        # Raises InvalidImage for the first file whose header isn't an image, and leaves every
+        # file rewound for staging. Only IMAGE_HEADER_BYTES of each are read, and parsing a
+        # header is cheap enough to do here rather than in the pool.
+        for upload in files:
+            data = await upload.read(IMAGE_HEADER_BYTES + 1)
+            await upload.seek(0)
+            check_header(data[:IMAGE_HEADER_BYTES], len(data) <= IMAGE_HEADER_BYTES)
+
+    async def save_uploads(self, files) -> list:
+        # One {variant: url} dict per file, in the order the files were sent
+        return list(await asyncio.gather(*(self.save_image(file) for file in files)))
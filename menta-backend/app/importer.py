@@ -0,0 +1,141 @@
+import asyncio
+import csv
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+from decouple import config
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from app.database import activity_collection, progress_collection, progress_daily_collection
+from app.schemas import ActivityCreate
+from app.crud import prepare_activity, progress_daily_update, progress_summary_update, utcnow
+from app.leaderboards import add_activities
+from app.versions import ACTIVITIES, PROGRESS, bump_versions
+
+IMPORT_BATCH_SIZE = config("IMPORT_BATCH_SIZE", default=1000, cast=int)
+# Only the first few row errors are echoed back; the rest are just counted
+IMPORT_MAX_REPORTED_ERRORS = config("IMPORT_MAX_REPORTED_ERRORS", default=100, cast=int)
+IMPORT_MAX_LINE_BYTES = config("IMPORT_MAX_LINE_BYTES", default=64 * 1024, cast=int)
+
+class LineTooLong(ValueError):
+    pass
+
+class ImportReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def row_failed(self, row_number: int, error: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "error": error})
+
+    def result(self) -> dict:
+        seconds = time.perf_counter() - self.started
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": self.errors,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(self.imported / seconds, 1) if seconds else 0.0,
+        }
+
+async def iter_lines(stream):
+    # Only the current partial line is ever buffered, whatever the body size
+    pending = b""
+    async for chunk in stream:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+        if len(pending) > IMPORT_MAX_LINE_BYTES:
+            raise LineTooLong(f"Rows may not exceed {IMPORT_MAX_LINE_BYTES} bytes")
+    if pending.strip():
+        yield pending.rstrip(b"\r")
+
+async def iter_rows(stream, file_format: str):
+    # Yields (row_number, dict or error message). CSV records must fit on one line.
+    header = None
+    row_number = 0
+    async for raw_line in iter_lines(stream):
+        try:
+            line = raw_line.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            row_number += 1
+            yield row_number, "Row is not valid UTF-8"
+            continue
+        if not line.strip():
+            continue
+        if file_format == "csv" and header is None:
+            header = next(csv.reader([line]))
+            continue
+        row_number += 1
+        if file_format == "csv":
+            values = next(csv.reader([line]))
+            row = {key: value if value != "" else None for key, value in zip(header, values)}
+            if row.get("images"):
+                row["images"] = row["images"].split(";")
+            yield row_number, row
+        else:
+            try:
+                yield row_number, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, f"Invalid JSON: {e.msg}"
+
+def progress_operations(user_id: str, documents: list, now):
+    # Rows of a batch collapse to one daily upsert per (activity, day) and one summary upsert
+    # per (activity, day) in date order, so the streak pipeline sees the days ascending
+    totals = defaultdict(lambda: [0, 0])
+    for document in documents:
+        entry = totals[(document["activity"], document["date"])]
+        entry[0] += document["duration"]
+        entry[1] += 1
+    daily, summary = [], []
+    for (activity, day), (seconds, sessions) in sorted(totals.items(), key=lambda item: (item[0][1], item[0][0])):
+        daily.append(UpdateOne(*progress_daily_update(user_id, activity, day, seconds, sessions, now), upsert=True))
+        summary.append(UpdateOne(*progress_summary_update(user_id, activity, day, seconds, sessions, now), upsert=True))
+    return daily, summary
+
+async def flush_batch(user_id: str, documents: list):
+    now = utcnow()
+    await activity_collection.insert_many(documents, ordered=False)
+    daily, summary = progress_operations(user_id, documents, now)
+    await asyncio.gather(
+        progress_daily_collection.bulk_write(daily, ordered=False),
+        progress_collection.bulk_write(summary, ordered=True),
+        add_activities(user_id, documents),
+    )
+    await bump_versions(user_id, ACTIVITIES, PROGRESS)
+
+async def import_activities(stream, file_format: str, user_id: str) -> dict:
+    report = ImportReport()
+    batch = []
+    async for row_number, row in iter_rows(stream, file_format):
+        if isinstance(row, str):
+            report.row_failed(row_number, row)
+            continue
+        try:
+            activity_data = ActivityCreate(**row).dict(exclude={"comments"})
+            started = datetime.strptime(f"{activity_data['date']} {activity_data['start_time']}", "%Y-%m-%d %H:%M")
+            document = prepare_activity(activity_data, user_id, utcnow())
+            # Feeds page by created_at, so an imported session goes where it happened (read as
+            # UTC) rather than on top of the user's newest posts
+            document["created_at"] = started
+            batch.append(document)
+        except ValidationError as e:
+            report.row_failed(row_number, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()))
+            continue
+        except (TypeError, ValueError) as e:
+            report.row_failed(row_number, str(e))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush_batch(user_id, batch)
+            report.imported += len(batch)
+            batch = []
+    if batch:
+        await flush_batch(user_id, batch)
+        report.imported += len(batch)
+    return report.result()
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from decouple import config
+from pymongo import ASCENDING, ReturnDocument
+from app.database import job_collection
+
+JOB_WORKERS = config("JOB_WORKERS", default=4, cast=int)
+JOB_LEASE_SECONDS = config("JOB_LEASE_SECONDS", default=60, cast=int)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=5, cast=int)
+JOB_RETRY_BASE_SECONDS = config("JOB_RETRY_BASE_SECONDS", default=2, cast=int)
+JOB_POLL_SECONDS = config("JOB_POLL_SECONDS", default=1.0, cast=float)
+JOB_SHUTDOWN_SECONDS = config("JOB_SHUTDOWN_SECONDS", default=10.0, cast=float)
+
+logger = logging.getLogger("uvicorn")
+
+# Jobs are delivered at least once: a job whose worker dies mid-run is picked up again when
+# its lease runs out, so handlers must tolerate running twice
+handlers = {}
+
+def job_handler(kind: str):
+    def register(function):
+        handlers[kind] = function
+        return function
+    return register
+
+# Set by enqueue so idle workers in this process don't wait out the poll interval
+_wakeup = None
+
+# In-process counters and recent timings, per job kind
+_outcomes = defaultdict(lambda: {"completed": 0, "retried": 0, "failed": 0})
+_latencies = deque(maxlen=1000)  # enqueue to finish, seconds
+_run_times = deque(maxlen=1000)  # handler only, seconds
+
+def new_job(kind: str, payload: dict, now, delay: float = 0) -> dict:
+    return {
+        "kind": kind,
+        "payload": payload,
+        "status": "queued",
+        "attempts": 0,
+        "max_attempts": JOB_MAX_ATTEMPTS,
+        "run_at": now + timedelta(seconds=delay),
+        "created_at": now,
+        "last_error": None,
+    }
+
+async def enqueue_many(jobs: list):
+    # jobs is a list of (kind, payload) pairs, written in one round trip
+    if not jobs:
+        return
+    now = datetime.utcnow()
+    await job_collection.insert_many([new_job(kind, payload, now) for kind, payload in jobs])
+    if _wakeup is not None:
+        _wakeup.set()
+
+async def enqueue(kind: str, payload: dict):
+    await enqueue_many([(kind, payload)])
+
+async def claim_job(worker_id: str):
+    now = datetime.utcnow()
+    return await job_collection.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "run_at": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lt": now}},
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "worker": worker_id,
+                "started_at": now,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("run_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+def _lease(job) -> dict:
+    # Matches only while this claim still holds; a worker that lost its lease can't overwrite the rerun
+    return {"_id": job["_id"], "worker": job["worker"], "attempts": job["attempts"]}
+
+async def complete_job(job):
+    now = datetime.utcnow()
+    await job_collection.update_one(_lease(job), {"$set": {"status": "done", "finished_at": now}})
+    _outcomes[job["kind"]]["completed"] += 1
+    _latencies.append((now - job["created_at"]).total_seconds())
+
+async def fail_job(job, error: Exception):
+    now = datetime.utcnow()
+    update = {"last_error": f"{type(error).__name__}: {error}"}
+    if job["attempts"] >= job["max_attempts"]:
+        update.update(status="failed", finished_at=now)
+        _outcomes[job["kind"]]["failed"] += 1
+        logger.error(f"Job {job['_id']} ({job['kind']}) failed for good: {error}")
+    else:
+        # Exponential backoff: 2s, 4s, 8s, ... with the default base
+        update.update(status="queued", run_at=now + timedelta(seconds=JOB_RETRY_BASE_SECONDS * 2 ** (job["attempts"] - 1)))
+        _outcomes[job["kind"]]["retried"] += 1
+    await job_collection.update_one(_lease(job), {"$set": update})
+
+async def run_job(job, state):
+    started = time.perf_counter()
+    try:
+        handler = handlers.get(job["kind"])
+        if handler is None:
+            raise LookupError(f"No handler for job kind {job['kind']}")
+        await handler(job["payload"], state)
+    except Exception as e:
+        await fail_job(job, e)
+    else:
+        await complete_job(job)
+    finally:
+        _run_times.append(time.perf_counter() - started)
+
+class JobWorkers:
+    # A few asyncio tasks per process pulling from the shared jobs collection
+    def __init__(self, state):
+        self.state = state
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+        self.tasks = []
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    def start(self):
+        global _wakeup
+        _wakeup = self.wakeup
+        self.tasks = [asyncio.create_task(self._work(f"{self.worker_id}-{n}")) for n in range(JOB_WORKERS)]
+
+    async def close(self):
+        # Let in-flight jobs finish; anything still running after the grace period is rerun elsewhere
+        global _wakeup
+        _wakeup = None
+        self.stopping = True
+        self.wakeup.set()
+        if not self.tasks:
+            return
+        _, pending = await asyncio.wait(self.tasks, timeout=JOB_SHUTDOWN_SECONDS)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _work(self, worker_id: str):
+        while not self.stopping:
+            self.wakeup.clear()
+            try:
+                job = await claim_job(worker_id)
+            except Exception as e:
+                logger.error(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await run_job(job, self.state)
+
+def percentiles(values) -> dict:
+    ordered = sorted(values)
+    if not ordered:
+        return {"p50": None, "p95": None, "p99": None}
+    pick = lambda q: round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+async def job_metrics() -> dict:
+    # Queue depth comes from the collection (shared by every process); the rest is this process only
+    counts = await job_collection.aggregate([
+        {"$match": {"status": {"$in": ["queued", "running", "failed"]}}},
+        {"$group": {"_id": {"kind": "$kind", "status": "$status"}, "count": {"$sum": 1}}},
+    ]).to_list(None)
+    depth = defaultdict(dict)
+    for row in counts:
+        depth[row["_id"]["status"]][row["_id"]["kind"]] = row["count"]
+    return {
+        "depth": {status: depth.get(status, {}) for status in ("queued", "running", "failed")},
+        "outcomes": dict(_outcomes),
+        "latency_seconds": percentiles(_latencies),
+        "run_seconds": percentiles(_run_times),
+    }
@@ -0,0 +1,203 @@
+import asyncio
+import re
+import sys
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decouple import config
+from pymongo import DeleteMany, UpdateOne
+from app.database import connect, follow_collection, leaderboard_collection, leaderboard_rank_collection
+from app.idempotency import apply_once
+from app.loaders import UserSummaryLoader
+from app.stats import BUCKET_FORMATS
+
+# Weekly and monthly boards per activity type, keyed by the period of the activity's own date
+# ("week:2024-W03:reading"), so a new period simply starts a new board and old ones expire.
+PERIODS = ("week", "month")
+LEADERBOARD_RETENTION_DAYS = config("LEADERBOARD_RETENTION_DAYS", default=90, cast=int)
+
+# Ranks come from a Fenwick (binary indexed) tree of how many users hold each score, stored
+# sparsely as one counter document per node that has ever been touched. Positions run from
+# the highest score down, so the prefix sum before a score's position is the number of users
+# ahead of it. Moving a score or reading a rank touches about log2(RANK_SCORE_LIMIT) nodes,
+# however many users are on the board. Scores are seconds; anything past the limit (48 days,
+# longer than any period) counts as the limit for ranking purposes.
+RANK_SCORE_LIMIT = 1 << 22
+
+def position(seconds: int) -> int:
+    return RANK_SCORE_LIMIT - min(max(seconds, 0), RANK_SCORE_LIMIT - 1)
+
+def update_nodes(index: int) -> list:
+    nodes = []
+    while index <= RANK_SCORE_LIMIT:
+        nodes.append(index)
+        index += index & -index
+    return nodes
+
+def prefix_nodes(index: int) -> list:
+    nodes = []
+    while index > 0:
+        nodes.append(index)
+        index -= index & -index
+    return nodes
+
+def period_bounds(period: str, day: date):
+    # [start, end) of the week (ISO, Monday first) or calendar month containing day
+    if period == "week":
+        start = day - timedelta(days=day.isoweekday() - 1)
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def board_key(period: str, activity: str, day: date) -> str:
+    return f"{period}:{day.strftime(BUCKET_FORMATS[period])}:{activity}"
+
+def expires_at(period: str, day: date) -> datetime:
+    return datetime.combine(period_bounds(period, day)[1], time()) + timedelta(days=LEADERBOARD_RETENTION_DAYS)
+
+def node_id(board: str, node: int) -> str:
+    return f"{board}:{node}"
+
+async def add_score(board: str, user_id: str, seconds: int, expires: datetime, effect_id=None):
+    # With effect_id, the score only moves if that effect hasn't moved it already (see
+    # app.idempotency), and the counters below only follow a score that did move
+    applied, before = await apply_once(
+        leaderboard_collection,
+        {"board": board, "user_id": user_id},
+        {"$inc": {"seconds": seconds}, "$setOnInsert": {"expires_at": expires}},
+        effect_id,
+        upsert=True,
+        projection={"seconds": 1},
+    )
+    if not applied:
+        return
+    old = before["seconds"] if before else None
+    new = (old or 0) + seconds
+    # Take the user out of the old score's nodes and add them to the new one's; shared ancestors cancel
+    deltas = defaultdict(int)
+    if old is not None:
+        for node in update_nodes(position(old)):
+            deltas[node] -= 1
+    for node in update_nodes(position(new)):
+        deltas[node] += 1
+    operations = [
+        UpdateOne({"_id": node_id(board, node)}, {"$inc": {"count": delta}, "$setOnInsert": {"expires_at": expires}}, upsert=True)
+        for node, delta in deltas.items() if delta
+    ]
+    if operations:
+        await leaderboard_rank_collection.bulk_write(operations, ordered=False)
+
+async def add_activities(user_id: str, activities: list, effect_id=None):
+    # One score update per board however many of the activities land on it. effect_id makes a
+    # rerun for the same activities a no-op; imports, which don't rerun, leave it out.
+    now = datetime.utcnow()
+    totals = defaultdict(int)
+    for activity in activities:
+        day = datetime.strptime(activity["date"], "%Y-%m-%d").date()
+        for period in PERIODS:
+            expires = expires_at(period, day)
+            # Back-dated past the retention window: the board is gone or about to be
+            if expires > now:
+                totals[(board_key(period, activity["activity"], day), expires)] += activity["duration"]
+    await asyncio.gather(*(add_score(board, user_id, seconds, expires, effect_id) for (board, expires), seconds in totals.items()))
+
+async def rank_of(board: str, seconds: int):
+    # (1 + users with a strictly higher score, users on the board): one _id lookup of ~23 counters
+    ahead_nodes = prefix_nodes(position(seconds) - 1)
+    ids = [node_id(board, node) for node in ahead_nodes + [RANK_SCORE_LIMIT]]
+    counts = {doc["_id"]: doc["count"] for doc in await leaderboard_rank_collection.find({"_id": {"$in": ids}}, {"count": 1}).to_list(None)}
+    return 1 + sum(counts.get(node, 0) for node in ids[:-1]), counts.get(ids[-1], 0)
+
+async def board_size(board: str) -> int:
+    # The root node counts everyone
+    root = await leaderboard_rank_collection.find_one({"_id": node_id(board, RANK_SCORE_LIMIT)}, {"count": 1})
+    return root["count"] if root else 0
+
+async def rebuild_ranks(board: str) -> int:
+    # Recounts the board's rank nodes from its scores and overwrites the stored counters, e.g.
+    # after a crash between a score write and its counter write. Scores that move while it runs
+    # can be counted twice or not at all, so run it once the board is quiet (or run it again).
+    entries = await leaderboard_collection.find({"board": board}, {"seconds": 1, "expires_at": 1}).to_list(None)
+    counts = defaultdict(int)
+    for entry in entries:
+        for node in update_nodes(position(entry["seconds"])):
+            counts[node] += 1
+    expires = max((entry["expires_at"] for entry in entries), default=None)
+    operations = [
+        UpdateOne({"_id": node_id(board, node)}, {"$set": {"count": count, "expires_at": expires}}, upsert=True)
+        for node, count in counts.items()
+    ]
+    # Drop nodes no score reaches any more
+    operations.append(DeleteMany({
+        "_id": {"$regex": f"^{re.escape(board)}:", "$nin": [node_id(board, node) for node in counts]},
+    }))
+    await leaderboard_rank_collection.bulk_write(operations, ordered=False)
+    return len(entries)
+
+def ranked(entries: list) -> list:
+    # entries sorted by score descending; ties share a rank ("1, 2, 2, 4")
+    rows, rank, previous = [], 0, None
+    for index, entry in enumerate(entries):
+        if entry["seconds"] != previous:
+            rank, previous = index + 1, entry["seconds"]
+        rows.append({"rank": rank, "user_id": entry["user_id"], "seconds": entry["seconds"]})
+    return rows
+
+async def global_board(board: str, user_id: str, limit: int):
+    projection = {"_id": 0, "user_id": 1, "seconds": 1}
+    top, mine = await asyncio.gather(
+        leaderboard_collection.find({"board": board}, projection).sort([("seconds", -1), ("user_id", 1)]).limit(limit).to_list(limit),
+        leaderboard_collection.find_one({"board": board, "user_id": user_id}, projection),
+    )
+    entries = ranked(top)
+    me = next((entry for entry in entries if entry["user_id"] == user_id), None)
+    if me is None and mine is not None:
+        rank, participants = await rank_of(board, mine["seconds"])
+        me = {"rank": rank, "user_id": user_id, "seconds": mine["seconds"]}
+    else:
+        participants = await board_size(board)
+    return entries, me, participants
+
+async def following_board(board: str, user_id: str, limit: int):
+    # Small by construction (the people one user follows), so it is ranked in memory
+    edges = await follow_collection.find({"follower_id": user_id}, {"followee_id": 1}).to_list(None)
+    members = [edge["followee_id"] for edge in edges] + [user_id]
+    scores = await leaderboard_collection.find(
+        {"board": board, "user_id": {"$in": members}}, {"_id": 0, "user_id": 1, "seconds": 1}
+    ).to_list(None)
+    entries = ranked(sorted(scores, key=lambda entry: (-entry["seconds"], entry["user_id"])))
+    me = next((entry for entry in entries if entry["user_id"] == user_id), None)
+    return entries[:limit], me, len(entries)
+
+async def get_leaderboard(activity: str, period: str, day: date, scope: str, user_id: str, limit: int) -> dict:
+    board = board_key(period, activity, day)
+    if scope == "following":
+        entries, me, participants = await following_board(board, user_id, limit)
+    else:
+        entries, me, participants = await global_board(board, user_id, limit)
+    users = await UserSummaryLoader().want(*(entry["user_id"] for entry in entries), user_id).load()
+    for entry in entries + ([me] if me else []):
+        entry["user"] = users.get(entry["user_id"])
+    start, end = period_bounds(period, day)
+    return {
+        "activity": activity,
+        "period": period,
+        "starts": start.isoformat(),
+        "ends": end.isoformat(),
+        "scope": scope,
+        "participants": participants,
+        "entries": entries,
+        "me": me,
+    }
+
+async def main(boards: list) -> int:
+    # python -m app.leaderboards week:2024-W03:reading [...]
+    if not boards:
+        print("usage: python -m app.leaderboards BOARD [BOARD ...]")
+        return 2
+    await connect()
+    for board in boards:
+        print(f"{board}: rebuilt ranks from {await rebuild_ranks(board)} scores")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(sys.argv[1:])))
@@ -0,0 +1,56 @@
+from bson import ObjectId
+from decouple import config
+from app.cache import TTLCache
+from app.database import user_collection
+from app.repository import USER_SUMMARY_PROJECTION, user_summary
+
+# Author and commenter summaries shared across requests. Names and avatars change rarely, so a
+# short TTL plus dropping the entry on profile updates in this process is enough.
+summary_cache = TTLCache(
+    maxsize=config("USER_SUMMARY_CACHE_SIZE", default=10000, cast=int),
+    ttl=config("USER_SUMMARY_CACHE_TTL", default=60, cast=int),
+)
+
+def forget_summary(user_id: str):
+    summary_cache.pop(user_id)
+
+class UserSummaryLoader:
+    # Collects every user id a response refers to, then resolves the lot with at most one
+    # projected $in query for whatever the cache doesn't already hold
+    def __init__(self):
+        self.wanted = set()
+
+    def want(self, *user_ids):
+        self.wanted.update(user_id for user_id in user_ids if user_id)
+        return self
+
+    def want_activities(self, activities):
+        for activity in activities:
+            self.want(activity["user_id"])
+            comments = activity.get("comments_preview")
+            if comments is None:
+                comments = activity.get("comments", [])
+            self.want(*(comment["user_id"] for comment in comments))
+        return self
+
+    async def load(self) -> dict:
+        summaries, missing = {}, []
+        for user_id in self.wanted:
+            summary = summary_cache.get(user_id)
+            if summary is not None:
+                summaries[user_id] = summary
+            elif ObjectId.is_valid(user_id):
+                missing.append(ObjectId(user_id))
+        if missing:
+            users = await user_collection.find({"_id": {"$in": missing}}, USER_SUMMARY_PROJECTION).to_list(len(missing))
+            for user in users:
+                summary = user_summary(user)
+                summary_cache.set(summary.id, summary)
+                summaries[summary.id] = summary
+        return summaries
+
+async def activity_users(activities) -> dict:
+    return await UserSummaryLoader().want_activities(activities).load()
+
+async def comment_users(comments) -> dict:
+    return await UserSummaryLoader().want(*(comment["user_id"] for comment in comments)).load()
@@ -1,29 +1,87 @@
 import math
 import os
-from fastapi import FastAPI, Depends, File, Form, HTTPException, UploadFile, status
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, File, Form, HTTPException, Query, Request, UploadFile, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta, datetime
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
-from app.schemas import Comment, UserCreate, UserOut, Token, ActivityCreate, ActivityOut, ProgressOut
-from app.crud import add_comment_to_activity, create_user, authenticate_user, create_activity, update_user
-from app.auth import create_access_token, get_current_user
-from app.utils import get_user_by_email, get_user_by_id
-from app.database import user_collection, activity_collection, progress_collection, progress_helper, activity_helper, user_helper
-from decouple import config
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.schemas import Comment, CommentOut, CommentPage, UserCreate, UserOut, Token, ActivityCreate, ActivityOut, ActivityPage, ProgressOut, StatsOut, LeaderboardOut, ClubCreate, ClubOut, ClubPage, ClubTotals, ChallengeCreate, ChallengeOut, ChallengePage, UserSummaryPage, FollowStatus, ImportResult, NotificationPage
+from app.crud import add_comment_to_activity, create_user, authenticate_user, create_activity, update_user, notification
+from app.auth import create_access_token, get_current_user, invalidate_user, principal_cache, require_metrics_token
+from app.database import activity_collection, comment_collection, notification_collection, connect, close
+from app.repository import (
+    ACTIVITY_CARD_PROJECTION, activity_page, comment_page, notification_page, user_summary_page, club_out, club_page,
+    challenge_out, challenge_page,
+    email_exists, user_exists, find_user_profile, find_progress,
+)
+from app.responses import ModelResponse, ImmutableStaticFiles
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, InvalidCursor, fetch_page
+from app.timeline import get_home_timeline, backfill_timeline, remove_author_from_timeline
+from app.follows import add_follow, remove_follow, is_following, get_follow_page
+from app.clubs import (
+    create_club, find_club, join_club, leave_club, get_club, get_club_page, get_member_page, get_club_feed, get_club_totals,
+)
+from app.challenges import (
+    InvalidChallenge, create_challenge, find_challenge, join_challenge, leave_challenge, get_challenge, get_challenge_page,
+    get_joined_page,
+)
+from app.directory import search_users
 import logging
-import requests
-from fastapi.staticfiles import StaticFiles
-import boto3
-import uuid
+import httpx
+from app.storage import UPLOADS_DIR, create_storage
+from app.images import VARIANTS, ImageProcessor, InvalidImage
+from app.study_spots import InvalidBounds, StudySpotCache, TooManyTiles
+from app.stats import get_activity_stats, stats_cache
+from app.leaderboards import get_leaderboard
+from app.metrics import MetricsMiddleware, registry
+from app.importer import LineTooLong, import_activities
+from app.exporter import export_activities
+from app.jobs import JobWorkers, enqueue, job_metrics
+from app.outbox import OutboxSweeper
+from app import tasks  # registers the job handlers
+from app.push import PUSH_KEEPALIVE_SECONDS, PUSH_SOURCE, SlowConsumer, hub, watch_changes
+from app.query_plans import check_query_plans
+from app.loaders import activity_users, comment_users, summary_cache
+from app.versions import ACTIVITIES, PROFILE, PROGRESS, body_etag, etag_response, response_cache, versioned_response
+from decouple import config
+import asyncio
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # 30 minutes
-
-app = FastAPI()
-
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Explain every query shape at startup and log the ones that would scan a collection or sort in memory
+CHECK_QUERY_PLANS = config("CHECK_QUERY_PLANS", default=False, cast=bool)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await connect()
+    if CHECK_QUERY_PLANS:
+        for failure in await check_query_plans():
+            logger.error(f"Blocking query plan: {failure}")
+    app.state.storage = create_storage()
+    app.state.images = ImageProcessor(app.state.storage)
+    app.state.study_spots = StudySpotCache.create()
+    app.state.jobs = JobWorkers(app.state)
+    app.state.jobs.start()
+    app.state.outbox = OutboxSweeper()
+    app.state.outbox.start()
+    change_stream = asyncio.create_task(watch_changes()) if PUSH_SOURCE == "change_stream" else None
+    yield
+    if change_stream:
+        change_stream.cancel()
+    await app.state.outbox.close()
+    await app.state.jobs.close()
+    await app.state.study_spots.close()
+    app.state.images.close()
+    app.state.storage.executor.shutdown(wait=False)
+    close()
+
+app = FastAPI(lifespan=lifespan)
+
+app.mount("/uploads", ImmutableStaticFiles(directory=UPLOADS_DIR), name="uploads")
 
 origins = [
     "http://localhost:3000",
@@ -37,6 +95,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 # Configure logger
 logger = logging.getLogger("uvicorn")
@@ -54,8 +113,8 @@ class User(BaseModel):
     location: str = None
     bio: str = None
     clubs: List[str] = []
-    followers: List[str] = []
-    following: List[str] = []
+    follower_count: int = 0
+    following_count: int = 0
     hashed_password: str
     created_at: str
     updated_at: str
@@ -70,58 +129,35 @@ class Bounds(BaseModel):
 class StudySpotsRequest(BaseModel):
     bounds: Bounds
 
-def fetch_osm_data(query: str):
-    url = "http://overpass-api.de/api/interpreter"
-    response = requests.get(url, params={'data': query})
-    response.raise_for_status()
-    return response.json()
-
 @app.post("/api/study_spots")
-async def study_spots(request: StudySpotsRequest):
-    southwest = request.bounds.southwest
-    northeast = request.bounds.northeast
-
-    # Calculate the center point
-    lat = (southwest[0] + northeast[0]) / 2
-    lon = (southwest[1] + northeast[1]) / 2
-
-    # Calculate the radius as the distance between southwest and northeast corners (approximation)
-    radius = 1000  # default value if you have any other means to calculate radius
-
-    query = f"""
-    [out:json];
-    (
-      node["amenity"="cafe"](around:{radius},{lat},{lon});
-      node["amenity"="library"](around:{radius},{lat},{lon});
-    );
-    out body;
-    """
-    try:
-        logger.debug(f"Fetching OSM data with query: {query}")
-        data = fetch_osm_data(query)
-        logger.debug(f"Received OSM data: {data}")
-        return data
-    except requests.RequestException as e:
-        logger.error(f"RequestException in study_spots: {e}")
+async def study_spots(request: StudySpotsRequest, http_request: Request):
+    try:
+        return await http_request.app.state.study_spots.get_spots(request.bounds.southwest, request.bounds.northeast)
+    except (TooManyTiles, InvalidBounds) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except httpx.HTTPError as e:
+        logger.error(f"HTTPError in study_spots: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error: Unable to fetch data from Overpass API")
     except Exception as e:
         logger.error(f"Exception in study_spots: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
-    
+
 @app.post("/check-email")
 async def check_email(email_check: EmailCheckRequest):
-    existing_user = await get_user_by_email(email_check.email)
-    if (existing_user):
+    if await email_exists(email_check.email):
         raise HTTPException(status_code=400, detail="Email already registered")
     return {"message": "Email is available"}
 
 @app.post("/register", response_model=UserOut)
 async def register_user(user: UserCreate):
-    existing_user = await get_user_by_email(user.email)
-    if (existing_user):
+    if await email_exists(user.email):
         raise HTTPException(status_code=400, detail="Email already registered")
-    new_user = await create_user(user.dict())
-    return new_user
+    try:
+        new_user = await create_user(user.dict())
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return ModelResponse(new_user)
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
@@ -137,16 +173,21 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me", response_model=UserOut)
-async def read_users_me(current_user: UserOut = Depends(get_current_user)):
-    return current_user
+async def read_users_me(request: Request, current_user: UserOut = Depends(get_current_user)):
+    # Already resolved from the principal cache, so a hash of the body is the cheapest validator
+    body = ModelResponse(current_user).body
+    return etag_response(request, body_etag(body), body)
 
 @app.get("/users/{user_id}", response_model=UserOut)
-async def get_user(user_id: str, current_user: UserOut = Depends(get_current_user)):
-    try:
-        user = await get_user_by_id(user_id)
+async def get_user(user_id: str, request: Request, current_user: UserOut = Depends(get_current_user)):
+    async def build():
+        user = await find_user_profile(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
-        return user
+        return ModelResponse(user)
+
+    try:
+        return await versioned_response(request, user_id, PROFILE, build)
     except HTTPException as e:
         logger.error(f"HTTPException in get_user: {e.detail}")
         raise e
@@ -186,13 +227,18 @@ async def update_user_profile(
 
     logger.info(f"Received update request for user: {user_id} with data: {updated_data}")  # Logging for update
 
-    updated_user = await update_user(user_id, updated_data)
+    try:
+        updated_user = await update_user(user_id, updated_data)
+    except DuplicateKeyError:
+        # The unique email index: another account already uses this address
+        raise HTTPException(status_code=400, detail="Email already registered")
     if updated_user:
-        return updated_user
+        return ModelResponse(updated_user)
     raise HTTPException(status_code=400, detail="Unable to update user profile")
 
 @app.post("/activities", response_model=ActivityOut)
 async def upload_activity(
+    request: Request,
     title: str = Form(...),
     description: str = Form(...),
     activity: str = Form(...),
@@ -210,20 +256,11 @@ async def upload_activity(
         start_datetime = datetime.strptime(f"{date} {start_time}", "%Y-%m-%d %H:%M")
         end_time = start_datetime + timedelta(seconds=duration)
 
-        image_urls = []
-        s3 = boto3.client(
-            "s3",
-            aws_access_key_id=config("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=config("AWS_SECRET_ACCESS_KEY"),
-            region_name=config("AWS_DEFAULT_REGION")
-        )
-        BUCKET_NAME = config("S3_BUCKET_NAME")
-
-        for file in files:
-            file_extension = file.filename.split(".")[-1]
-            file_key = f"{uuid.uuid4()}.{file_extension}"
-            s3.upload_fileobj(file.file, BUCKET_NAME, file_key, ExtraArgs={"ContentType": file.content_type})
-            image_urls.append(f"https://{BUCKET_NAME}.s3.amazonaws.com/{file_key}")
+        # Raw files are staged; decoding and resizing happen in a background job once the
+        # activity exists. Their headers are checked first, so a file that isn't an image at
+        # all is turned away here instead.
+        await request.app.state.images.check_uploads(files)
+        staged_images = await request.app.state.storage.stage_uploads(files)
 
         activity_data = {
             "title": title,
@@ -236,110 +273,307 @@ async def upload_activity(
             "private_notes": private_notes,
             "privacy_type": privacy_type,
             "perceived_performance": perceived_performance,
-            "images": image_urls
+            "images": [],
+            "image_variants": []
         }
 
-        new_activity = await create_activity(activity_data, current_user.id)
-        return new_activity
+        new_activity = await create_activity(activity_data, current_user.id, staged_images)
+        return ModelResponse(new_activity)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=f"Unsupported image: {e}")
     except Exception as e:
         logger.error(f"Error in upload_activity: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@app.post("/activities/import", response_model=ImportResult)
+async def import_activity_history(
+    request: Request,
+    format: Optional[str] = Query(None, regex="^(ndjson|csv)$"),
+    current_user: UserOut = Depends(get_current_user)
+):
+    # The body is parsed as it arrives and written in batches, so file size doesn't matter
+    file_format = format or ("csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson")
+    try:
+        return await import_activities(request.stream(), file_format, current_user.id)
+    except LineTooLong as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in import_activity_history: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
 @app.post("/upload-images", response_model=List[str])
-async def upload_images(files: List[UploadFile] = File(...)):
-    try:
-        image_urls = []
-        s3 = boto3.client(
-            "s3",
-            aws_access_key_id=config("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=config("AWS_SECRET_ACCESS_KEY"),
-            region_name=config("AWS_DEFAULT_REGION")
-        )
-        BUCKET_NAME = config("S3_BUCKET_NAME")
-        for file in files:
-            file_extension = file.filename.split(".")[-1]
-            file_key = f"{uuid.uuid4()}.{file_extension}"
-            s3.upload_fileobj(file.file, BUCKET_NAME, file_key, ExtraArgs={"ContentType": file.content_type})
-            image_urls.append(f"https://{BUCKET_NAME}.s3.amazonaws.com/{file_key}")
-        return image_urls
+async def upload_images(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    variant: str = Query("full", regex=f"^({'|'.join(VARIANTS)})$")
+):
+    # Profile and cover photos store a single URL, so the caller picks the size it displays
+    try:
+        image_variants = await request.app.state.images.save_uploads(files)
+        return [variants[variant] for variants in image_variants]
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=f"Unsupported image: {e}")
     except Exception as e:
         logger.error(f"Error uploading file: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
-@app.get("/activities", response_model=List[ActivityOut])
-async def get_activities(current_user: UserOut = Depends(get_current_user)):
+@app.get("/activities", response_model=ActivityPage)
+async def get_activities(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
     try:
-        activities = await activity_collection.find().sort("created_at", -1).to_list(100)
-        return [activity_helper(activity) for activity in activities]
+        activities, next_cursor = await fetch_page(activity_collection, {}, cursor, limit, ACTIVITY_CARD_PROJECTION)
+        return ModelResponse(activity_page(activities, next_cursor, await activity_users(activities)))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in get_activities: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
-@app.post("/activities/{activity_id}/comments", response_model=ActivityOut)
+@app.get("/feed", response_model=ActivityPage)
+async def get_home_feed(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        activities, next_cursor = await get_home_timeline(current_user.id, cursor, limit)
+        return ModelResponse(activity_page(activities, next_cursor, await activity_users(activities)))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_home_feed: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.websocket("/ws/feed")
+async def feed_socket(websocket: WebSocket, token: str = Query(...)):
+    # Browsers can't set headers on a WebSocket, so the bearer token comes in the query string
+    try:
+        current_user = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = await hub.subscribe(current_user.id)
+
+    async def send():
+        while True:
+            message = await subscription.next(PUSH_KEEPALIVE_SECONDS)
+            await websocket.send_text(message if message is not None else '{"type":"keepalive"}')
+
+    async def receive():
+        # Nothing is expected from the client; this only notices when it goes away
+        while True:
+            await websocket.receive_text()
+
+    pumps = [asyncio.create_task(send()), asyncio.create_task(receive())]
+    try:
+        done, _ = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if isinstance(task.exception(), SlowConsumer):
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Client too slow")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in pumps:
+            task.cancel()
+        hub.unsubscribe(subscription)
+
+@app.get("/feed/events")
+async def feed_events(request: Request, current_user: UserOut = Depends(get_current_user)):
+    # Server-sent events variant of /ws/feed for clients that only need one direction
+    subscription = await hub.subscribe(current_user.id)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                message = await subscription.next(PUSH_KEEPALIVE_SECONDS)
+                yield f"data: {message}\n\n" if message is not None else ": keepalive\n\n"
+        except SlowConsumer:
+            yield "event: dropped\ndata: {}\n\n"
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/activities/{activity_id}/comments", response_model=CommentOut)
 async def add_comment(activity_id: str, comment: Comment, current_user: UserOut = Depends(get_current_user)):
     comment_data = comment.dict()
     comment_data["user_id"] = current_user.id
-    updated_activity = await add_comment_to_activity(activity_id, comment_data)
-    if updated_activity:
-        return updated_activity
+    new_comment = await add_comment_to_activity(activity_id, comment_data)
+    if new_comment:
+        return ModelResponse(new_comment)
     raise HTTPException(status_code=400, detail="Unable to add comment")
 
-@app.get("/activities/user/{user_id}", response_model=List[ActivityOut])
-async def get_user_activities(user_id: str, current_user: UserOut = Depends(get_current_user)):
+@app.get("/activities/{activity_id}/comments", response_model=CommentPage)
+async def get_comments(
+    activity_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    if not ObjectId.is_valid(activity_id):
+        raise HTTPException(status_code=404, detail="Activity not found")
+    try:
+        comments, next_cursor = await fetch_page(comment_collection, {"activity_id": ObjectId(activity_id)}, cursor, limit, sort_field="timestamp")
+        return ModelResponse(comment_page(comments, next_cursor, await comment_users(comments)))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_comments: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/notifications", response_model=NotificationPage)
+async def get_notifications(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        notifications, next_cursor = await fetch_page(notification_collection, {"user_id": current_user.id}, cursor, limit)
+        return ModelResponse(notification_page(notifications, next_cursor))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_notifications: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/jobs/metrics", dependencies=[Depends(require_metrics_token)])
+async def get_job_metrics():
+    return await job_metrics()
+
+@registry.collector
+def cache_metrics():
+    caches = {"principal": principal_cache.stats(), "stats": stats_cache.stats(), "responses": response_cache.stats(), "user_summaries": summary_cache.stats()}
+    if hasattr(app.state, "study_spots"):
+        caches["study_spots"] = app.state.study_spots.stats()
+    metrics = {}
+    for field, kind in (("size", "gauge"), ("hits", "counter"), ("misses", "counter"), ("evictions", "counter")):
+        metrics[f"menta_cache_{field}"] = (f"Cache {field}", kind, [({"cache": name}, stats[field]) for name, stats in caches.items()])
+    push = hub.stats()
+    metrics["menta_push_connections"] = ("Open feed push connections", "gauge", [({}, push["connections"])])
+    metrics["menta_push_dropped_total"] = ("Push connections dropped for falling behind", "counter", [({}, push["dropped"])])
+    return metrics
+
+@registry.collector
+async def queue_metrics():
+    jobs = await job_metrics()
+    return {
+        "menta_jobs_depth": ("Jobs by status and kind", "gauge", [
+            ({"status": status, "kind": kind}, count)
+            for status, kinds in jobs["depth"].items() for kind, count in kinds.items()
+        ]),
+        "menta_jobs_total": ("Jobs finished by this process, by kind and outcome", "counter", [
+            ({"kind": kind, "outcome": outcome}, count)
+            for kind, outcomes in jobs["outcomes"].items() for outcome, count in outcomes.items()
+        ]),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    return PlainTextResponse(await registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/activities/user/{user_id}", response_model=ActivityPage)
+async def get_user_activities(
+    user_id: str,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    # Comment previews show their commenters' names and pictures
+    commenters = set()
+
+    async def build():
+        activities, next_cursor = await fetch_page(activity_collection, {"user_id": user_id}, cursor, limit, ACTIVITY_CARD_PROJECTION)
+        users = await activity_users(activities)
+        commenters.update(other for other in users if other != user_id)
+        return ModelResponse(activity_page(activities, next_cursor, users))
+
     try:
-        activities = await activity_collection.find({"user_id": user_id}).sort("created_at", -1).to_list(100)
-        return [activity_helper(activity) for activity in activities]
+        return await versioned_response(request, user_id, ACTIVITIES, build, embeds=commenters)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in get_user_activities: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
+@app.get("/activities/user/{user_id}/export")
+async def export_user_activities(
+    user_id: str,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    current_user: UserOut = Depends(get_current_user)
+):
+    # Exports include private notes, so only the owner can download them
+    if user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="You can only export your own activities")
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_activities(user_id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="activities-{user_id}.{format}"'},
+    )
+
 @app.get("/progress/{user_id}", response_model=List[ProgressOut])
-async def get_user_progress(user_id: str, current_user: UserOut = Depends(get_current_user)):
-    try:
-        progress_entries = await progress_collection.find({"user_id": user_id}).to_list(100)
-
-        if not progress_entries:
-            return []
-
-        activity_summary = {}
-
-        for entry in progress_entries:
-            activity = entry['activity']
-            if activity not in activity_summary:
-                activity_summary[activity] = {
-                    "streak": 0,
-                    "total_time_spent": 0,
-                    "last_completed": None
-                }
-            activity_summary[activity]["streak"] = max(activity_summary[activity]["streak"], entry['streak'])
-            activity_summary[activity]["total_time_spent"] += entry['total_time_spent']
-            if activity_summary[activity]["last_completed"] is None or entry['last_completed'] > activity_summary[activity]["last_completed"]:
-                activity_summary[activity]["last_completed"] = entry['last_completed']
-
-        progress_out_list = []
-        for activity, summary in activity_summary.items():
-            progress_out_list.append(ProgressOut(
-                id=str(uuid.uuid4()),
-                user_id=user_id,
-                activity=activity,
-                streak=summary["streak"],
-                total_time_spent=summary["total_time_spent"],
-                last_completed=summary["last_completed"],
-                created_at=datetime.utcnow(),
-                updated_at=datetime.utcnow()
-            ))
-
-        return progress_out_list
+async def get_user_progress(user_id: str, request: Request, current_user: UserOut = Depends(get_current_user)):
+    async def build():
+        return ModelResponse(await find_progress(user_id))
 
+    try:
+        # Streaks lapse at midnight UTC without any write, so the date is part of the validator
+        return await versioned_response(request, user_id, PROGRESS, build, salt=datetime.utcnow().strftime("%Y-%m-%d"))
     except Exception as e:
         logger.error(f"Error in get_user_progress: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
-@app.get("/activities/latest", response_model=List[ActivityOut])
-async def get_latest_activities(current_user: UserOut = Depends(get_current_user)):
+@app.get("/stats/{user_id}", response_model=StatsOut)
+async def get_user_stats(
+    user_id: str,
+    bucket: str = Query("week", regex="^(week|month|year)$"),
+    start: Optional[str] = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
+    end: Optional[str] = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
+    current_user: UserOut = Depends(get_current_user)
+):
     try:
-        activities = await activity_collection.find({"user_id": current_user.id}).sort("created_at", -1).limit(5).to_list(100)
-        return [activity_helper(activity) for activity in activities]
+        buckets = await get_activity_stats(user_id, bucket, start, end)
+        return {"user_id": user_id, "bucket": bucket, "buckets": buckets}
+    except Exception as e:
+        logger.error(f"Error in get_user_stats: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/leaderboards/{activity}", response_model=LeaderboardOut)
+async def get_activity_leaderboard(
+    activity: str,
+    period: str = Query("week", regex="^(week|month)$"),
+    scope: str = Query("all", regex="^(all|following)$"),
+    date: Optional[str] = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    # date picks the period to show (defaults to the current one, in UTC)
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").date() if date else datetime.utcnow().date()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        return ModelResponse(LeaderboardOut(**await get_leaderboard(activity, period, day, scope, current_user.id, limit)))
+    except Exception as e:
+        logger.error(f"Error in get_activity_leaderboard: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/activities/latest", response_model=ActivityPage)
+async def get_latest_activities(
+    cursor: Optional[str] = None,
+    limit: int = Query(5, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        activities, next_cursor = await fetch_page(activity_collection, {"user_id": current_user.id}, cursor, limit, ACTIVITY_CARD_PROJECTION)
+        return ModelResponse(activity_page(activities, next_cursor, await activity_users(activities)))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in get_latest_activities: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -350,26 +584,24 @@ class FollowRequest(BaseModel):
 @app.post("/follow")
 async def follow_user(request: FollowRequest, current_user: UserOut = Depends(get_current_user)):
     try:
-        target_user = await get_user_by_id(request.target_user_id)
-        if not target_user:
-            raise HTTPException(status_code=404, detail="User not found")
-
         if current_user.id == request.target_user_id:
             raise HTTPException(status_code=400, detail="Cannot follow yourself")
 
-        if current_user.id in target_user["followers"]:
-            raise HTTPException(status_code=400, detail="Already following this user")
-
-        # Update the target user's followers list
-        target_user["followers"].append(current_user.id)
-        await update_user(request.target_user_id, {"followers": target_user["followers"]})
+        if not await user_exists(request.target_user_id):
+            raise HTTPException(status_code=404, detail="User not found")
 
-        # Update the current user's following list
-        current_user.following.append(request.target_user_id)
-        await update_user(current_user.id, {"following": current_user.following})
+        if not await add_follow(current_user.id, request.target_user_id):
+            raise HTTPException(status_code=400, detail="Already following this user")
+        invalidate_user(current_user.id)
+        invalidate_user(request.target_user_id)
+        await backfill_timeline(current_user.id, request.target_user_id)
+        await enqueue("notification", notification(request.target_user_id, "follow", current_user.id))
+        hub.follow(current_user.id, request.target_user_id)
 
         return {"message": "Successfully followed the user"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in follow_user: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
@@ -377,35 +609,266 @@ async def follow_user(request: FollowRequest, current_user: UserOut = Depends(ge
 @app.post("/unfollow")
 async def unfollow_user(request: FollowRequest, current_user: UserOut = Depends(get_current_user)):
     try:
-        target_user = await get_user_by_id(request.target_user_id)
-        if not target_user:
-            raise HTTPException(status_code=404, detail="User not found")
-
         if current_user.id == request.target_user_id:
             raise HTTPException(status_code=400, detail="Cannot unfollow yourself")
 
-        if current_user.id not in target_user["followers"]:
+        if not await remove_follow(current_user.id, request.target_user_id):
             raise HTTPException(status_code=400, detail="Not following this user")
-
-        # Update the target user's followers list
-        target_user["followers"].remove(current_user.id)
-        await update_user(request.target_user_id, {"followers": target_user["followers"]})
-
-        # Update the current user's following list
-        current_user.following.remove(request.target_user_id)
-        await update_user(current_user.id, {"following": current_user.following})
+        invalidate_user(current_user.id)
+        invalidate_user(request.target_user_id)
+        await remove_author_from_timeline(current_user.id, request.target_user_id)
+        hub.unfollow(current_user.id, request.target_user_id)
 
         return {"message": "Successfully unfollowed the user"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in unfollow_user: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/follow/{target_user_id}", response_model=FollowStatus)
+async def get_follow_status(target_user_id: str, current_user: UserOut = Depends(get_current_user)):
+    return {"following": await is_following(current_user.id, target_user_id)}
+
+@app.get("/users/{user_id}/followers", response_model=UserSummaryPage)
+async def get_followers(
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        users, next_cursor = await get_follow_page(user_id, "followers", cursor, limit)
+        return ModelResponse(user_summary_page(users, next_cursor))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_followers: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/users/{user_id}/following", response_model=UserSummaryPage)
+async def get_following(
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        users, next_cursor = await get_follow_page(user_id, "following", cursor, limit)
+        return ModelResponse(user_summary_page(users, next_cursor))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_following: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
     
-@app.get("/users", response_model=List[UserOut])
-async def get_all_users(current_user: UserOut = Depends(get_current_user)):
+@app.post("/clubs", response_model=ClubOut)
+async def create_new_club(club: ClubCreate, current_user: UserOut = Depends(get_current_user)):
+    try:
+        created = await create_club(current_user.id, club.dict())
+        invalidate_user(current_user.id)
+        return ModelResponse(club_out(created, member_count=1, is_member=True))
+    except Exception as e:
+        logger.error(f"Error in create_new_club: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/clubs", response_model=ClubPage)
+async def list_clubs(
+    activity: Optional[str] = Query(None, max_length=100),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        clubs, next_cursor, member_counts, memberships = await get_club_page(current_user.id, activity, cursor, limit)
+        return ModelResponse(club_page(clubs, next_cursor, member_counts, memberships))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in list_clubs: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/clubs/{club_id}", response_model=ClubOut)
+async def get_club_details(club_id: str, current_user: UserOut = Depends(get_current_user)):
+    found = await get_club(club_id, current_user.id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Club not found")
+    club, member_count, is_member = found
+    return ModelResponse(club_out(club, member_count, is_member))
+
+@app.post("/clubs/{club_id}/join")
+async def join_existing_club(club_id: str, current_user: UserOut = Depends(get_current_user)):
+    try:
+        if await find_club(club_id) is None:
+            raise HTTPException(status_code=404, detail="Club not found")
+        if not await join_club(club_id, current_user.id):
+            raise HTTPException(status_code=400, detail="Already a member of this club")
+        invalidate_user(current_user.id)
+        return {"message": "Successfully joined the club"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in join_existing_club: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/clubs/{club_id}/leave")
+async def leave_existing_club(club_id: str, current_user: UserOut = Depends(get_current_user)):
+    try:
+        if not await leave_club(club_id, current_user.id):
+            raise HTTPException(status_code=400, detail="Not a member of this club")
+        invalidate_user(current_user.id)
+        return {"message": "Successfully left the club"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in leave_existing_club: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/clubs/{club_id}/members", response_model=UserSummaryPage)
+async def get_club_members(
+    club_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        users, next_cursor = await get_member_page(club_id, cursor, limit)
+        return ModelResponse(user_summary_page(users, next_cursor))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_club_members: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/clubs/{club_id}/feed", response_model=ActivityPage)
+async def get_club_activity_feed(
+    club_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        activities, next_cursor = await get_club_feed(club_id, cursor, limit)
+        return ModelResponse(activity_page(activities, next_cursor, await activity_users(activities)))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_club_activity_feed: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/clubs/{club_id}/totals", response_model=ClubTotals)
+async def get_club_weekly_totals(
+    club_id: str,
+    date: Optional[str] = Query(None, regex=r"^\d{4}-\d{2}-\d{2}$"),
+    current_user: UserOut = Depends(get_current_user)
+):
+    # date picks the week (defaults to the current one, in UTC)
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d").date() if date else datetime.utcnow().date()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if await find_club(club_id) is None:
+        raise HTTPException(status_code=404, detail="Club not found")
     try:
-        users = await user_collection.find().to_list(100)  # Fetch all users
-        return [user_helper(user) for user in users]
+        return ModelResponse(ClubTotals(**await get_club_totals(club_id, day)))
     except Exception as e:
-        logger.error(f"Error in get_all_users: {e}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
\ No newline at end of file
+        logger.error(f"Error in get_club_weekly_totals: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/challenges", response_model=ChallengeOut)
+async def create_new_challenge(challenge: ChallengeCreate, current_user: UserOut = Depends(get_current_user)):
+    try:
+        created, participant = await create_challenge(current_user.id, challenge.dict())
+        return ModelResponse(challenge_out(created, participant))
+    except InvalidChallenge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in create_new_challenge: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/challenges", response_model=ChallengePage)
+async def list_challenges(
+    activity: Optional[str] = Query(None, max_length=100),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        challenges, next_cursor, participants = await get_challenge_page(current_user.id, activity, cursor, limit)
+        return ModelResponse(challenge_page(challenges, next_cursor, participants))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in list_challenges: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/challenges/joined", response_model=ChallengePage)
+async def list_joined_challenges(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        challenges, next_cursor, participants = await get_joined_page(current_user.id, cursor, limit)
+        return ModelResponse(challenge_page(challenges, next_cursor, participants))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in list_joined_challenges: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/challenges/{challenge_id}", response_model=ChallengeOut)
+async def get_challenge_details(challenge_id: str, current_user: UserOut = Depends(get_current_user)):
+    found = await get_challenge(challenge_id, current_user.id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Challenge not found")
+    return ModelResponse(challenge_out(*found))
+
+@app.post("/challenges/{challenge_id}/join", response_model=ChallengeOut)
+async def join_existing_challenge(challenge_id: str, current_user: UserOut = Depends(get_current_user)):
+    try:
+        challenge = await find_challenge(challenge_id)
+        if challenge is None:
+            raise HTTPException(status_code=404, detail="Challenge not found")
+        participant = await join_challenge(challenge, current_user.id)
+        if participant is None:
+            raise HTTPException(status_code=400, detail="Already taking part in this challenge")
+        return ModelResponse(challenge_out(challenge, participant))
+    except InvalidChallenge as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in join_existing_challenge: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.post("/challenges/{challenge_id}/leave")
+async def leave_existing_challenge(challenge_id: str, current_user: UserOut = Depends(get_current_user)):
+    try:
+        if not await leave_challenge(challenge_id, current_user.id):
+            raise HTTPException(status_code=400, detail="Not taking part in this challenge")
+        return {"message": "Successfully left the challenge"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in leave_existing_challenge: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@app.get("/users", response_model=UserSummaryPage)
+async def search_users_directory(
+    q: Optional[str] = Query(None, max_length=100),
+    interest: Optional[str] = None,
+    location: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: UserOut = Depends(get_current_user)
+):
+    try:
+        users, next_cursor = await search_users(q, interest, location, cursor, limit)
+        return ModelResponse(user_summary_page(users, next_cursor))
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in search_users_directory: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
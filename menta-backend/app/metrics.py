@@ -0,0 +1,238 @@
+import inspect
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from decouple import config
+from pymongo import monitoring
+
+# A small in-process registry rendered in the Prometheus text format. Everything is a
+# dict lookup plus a few additions under a lock, so it can stay on in production.
+
+MONGO_SLOW_MS = config("MONGO_SLOW_MS", default=100, cast=int)
+MONGO_PENDING_COMMANDS = config("MONGO_PENDING_COMMANDS", default=10000, cast=int)
+
+slow_query_logger = logging.getLogger("menta.slow_queries")
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, _labels(self.label_names, labels), value) for labels, value in self.values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        rows = []
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                rows.append((f"{self.name}_bucket", _labels(self.label_names, labels, f'le="{bound}"'), cumulative))
+            rows.append((f"{self.name}_sum", _labels(self.label_names, labels), total))
+            rows.append((f"{self.name}_count", _labels(self.label_names, labels), cumulative))
+        return rows
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # Callables (sync or async) returning {name: (help, kind, [(labels dict, value)])}, read at scrape time
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, function):
+        self.collectors.append(function)
+        return function
+
+    async def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+        for collect in self.collectors:
+            collected = collect()
+            if inspect.isawaitable(collected):
+                collected = await collected
+            for name, (help_text, kind, samples) in collected.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(labels.keys(), labels.values())} {value}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "menta_http_requests_total", "HTTP requests by route template, method and status", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "menta_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")))
+http_in_flight = registry.register(Gauge(
+    "menta_http_requests_in_flight", "HTTP requests currently being served"))
+mongo_latency = registry.register(Histogram(
+    "menta_mongo_command_duration_seconds", "Mongo command latency by collection and operation", ("collection", "operation"),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)))
+mongo_failures = registry.register(Counter(
+    "menta_mongo_command_failures_total", "Failed Mongo commands", ("collection", "operation")))
+mongo_slow = registry.register(Counter(
+    "menta_mongo_slow_commands_total", f"Mongo commands slower than MONGO_SLOW_MS ({MONGO_SLOW_MS}ms)", ("collection", "operation")))
+
+class MetricsMiddleware:
+    # Plain ASGI rather than BaseHTTPMiddleware: no extra task or body buffering per request
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            route = route_label(scope)
+            http_latency.observe(elapsed, scope["method"], route)
+            http_requests.inc(scope["method"], route, str(status[0]))
+
+def route_label(scope) -> str:
+    # The router fills in the matched route on the shared scope; templates keep label cardinality bounded
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    if "endpoint" in scope and scope.get("root_path"):
+        return scope["root_path"] + "/{path}"  # a Mount such as /uploads
+    return "unmatched"
+
+# Commands that aren't reads or writes against a collection
+_IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "endSessions", "saslStart", "saslContinue", "killCursors"}
+
+def filter_of(command_name: str, command) -> dict:
+    if command_name in ("find", "count", "distinct"):
+        return command.get("filter") or command.get("query") or {}
+    if command_name == "findAndModify":
+        return command.get("query") or {}
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline") or []
+        return pipeline[0].get("$match", {}) if pipeline else {}
+    if command_name == "update":
+        return (command.get("updates") or [{}])[0].get("q", {})
+    if command_name == "delete":
+        return (command.get("deletes") or [{}])[0].get("q", {})
+    return {}
+
+def shape(value):
+    # Keeps field names and operators, drops the values: {"user_id": "?", "date": {"$gte": "?"}}
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [shape(item) for item in value]
+    return "?"
+
+class CommandTimer(monitoring.CommandListener):
+    # Called on Motor's worker threads; started events are parked until their reply arrives.
+    # pymongo reports every started command as succeeded or failed, but a listener can still
+    # miss one (e.g. a connection torn down mid-command), so at most MONGO_PENDING_COMMANDS
+    # are kept and the oldest is dropped past that.
+    def __init__(self, max_pending: int = MONGO_PENDING_COMMANDS):
+        self.pending = OrderedDict()
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        # getMore names its collection separately; every other command names it as its own value
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        if not isinstance(collection, str):
+            collection = "?"
+        # Only the filter is kept, not the whole command (an insert's documents, say)
+        started = (collection, filter_of(event.command_name, event.command))
+        with self.lock:
+            self.pending[(event.connection_id, event.request_id)] = started
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+    def _finish(self, event):
+        with self.lock:
+            return self.pending.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        started = self._finish(event)
+        if started is None:
+            return
+        collection, query = started
+        seconds = event.duration_micros / 1_000_000
+        mongo_latency.observe(seconds, collection, event.command_name)
+        if seconds * 1000 >= MONGO_SLOW_MS:
+            mongo_slow.inc(collection, event.command_name)
+            slow_query_logger.warning(
+                f"Slow Mongo {event.command_name} on {collection}: {seconds * 1000:.1f}ms "
+                f"filter={shape(query)}"
+            )
+
+    def failed(self, event):
+        started = self._finish(event)
+        if started is None:
+            return
+        collection, _ = started
+        mongo_latency.observe(event.duration_micros / 1_000_000, collection, event.command_name)
+        mongo_failures.inc(collection, event.command_name)
+
+command_timer = CommandTimer()
@@ -1,6 +1,6 @@
 from bson import ObjectId
 from pydantic import BaseModel, Field, EmailStr
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 class UserModel(BaseModel):
@@ -15,8 +15,8 @@ class UserModel(BaseModel):
     location: Optional[str] = None
     bio: Optional[str] = None
     clubs: Optional[List[str]] = []
-    followers: Optional[List[str]] = []
-    following: Optional[List[str]] = []
+    follower_count: int = 0
+    following_count: int = 0
     created_at: datetime
     updated_at: datetime
 
@@ -43,6 +43,8 @@ class ActivityModel(BaseModel):
     privacy_type: str
     perceived_performance: int
     images: List[str]
+    image_variants: List[Dict[str, str]] = []
+    failed_images: int = 0
     user_id: str
     comments: List[Comment] = []
     created_at: datetime
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from decouple import config
+from pymongo import ReturnDocument
+from app.database import activity_collection
+from app.jobs import enqueue_many
+
+# A new activity is inserted together with the jobs it still needs (its outbox), and each job
+# takes itself off the list once it has run. The jobs are enqueued right after the insert, so
+# normally nothing is left by the time OUTBOX_GRACE_SECONDS pass; if the process died between
+# the insert and the enqueue, or a job ran out of retries, the sweeper enqueues whatever is
+# left again. Activity jobs are idempotent (see app.tasks), so a spare copy is harmless.
+OUTBOX_GRACE_SECONDS = config("OUTBOX_GRACE_SECONDS", default=300, cast=int)
+OUTBOX_SWEEP_SECONDS = config("OUTBOX_SWEEP_SECONDS", default=60, cast=float)
+OUTBOX_MAX_SWEEPS = config("OUTBOX_MAX_SWEEPS", default=5, cast=int)
+OUTBOX_SWEEP_BATCH = config("OUTBOX_SWEEP_BATCH", default=100, cast=int)
+
+logger = logging.getLogger("uvicorn")
+
+def outbox_fields(jobs: list, now) -> dict:
+    # Fields to insert with the activity for its (kind, payload) jobs
+    return {
+        "outbox": [{"kind": kind, "payload": payload} for kind, payload in jobs],
+        "outbox_due_at": now + timedelta(seconds=OUTBOX_GRACE_SECONDS),
+    }
+
+async def mark_done(activity_id, kind: str):
+    activity = await activity_collection.find_one_and_update(
+        {"_id": activity_id, "outbox.kind": kind},
+        {"$pull": {"outbox": {"kind": kind}}},
+        projection={"outbox": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if activity is not None and not activity["outbox"]:
+        await activity_collection.update_one({"_id": activity_id, "outbox": []}, {"$unset": {"outbox": "", "outbox_due_at": "", "outbox_sweeps": ""}})
+
+async def sweep_outbox() -> int:
+    # Re-enqueues the leftover jobs of activities past their due time; returns how many
+    # activities it swept. Claiming an activity pushes its due time forward, so processes
+    # sweeping at the same time never pick the same one.
+    swept = 0
+    while swept < OUTBOX_SWEEP_BATCH:
+        now = datetime.utcnow()
+        activity = await activity_collection.find_one_and_update(
+            {"outbox_due_at": {"$lte": now}},
+            {"$set": {"outbox_due_at": now + timedelta(seconds=OUTBOX_GRACE_SECONDS)}, "$inc": {"outbox_sweeps": 1}},
+            projection={"outbox": 1, "outbox_sweeps": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if activity is None:
+            break
+        swept += 1
+        kinds = [job["kind"] for job in activity.get("outbox", [])]
+        if activity["outbox_sweeps"] > OUTBOX_MAX_SWEEPS:
+            # Keep the list for inspection, but stop retrying jobs that keep failing
+            logger.error(f"Giving up on jobs {kinds} of activity {activity['_id']} after {OUTBOX_MAX_SWEEPS} sweeps")
+            await activity_collection.update_one({"_id": activity["_id"]}, {"$unset": {"outbox_due_at": ""}})
+            continue
+        await enqueue_many([(job["kind"], job["payload"]) for job in activity.get("outbox", [])])
+    return swept
+
+class OutboxSweeper:
+    def __init__(self):
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await sweep_outbox()
+            except Exception as e:
+                logger.error(f"Error sweeping the activity outbox: {e}")
+            await asyncio.sleep(OUTBOX_SWEEP_SECONDS)
@@ -0,0 +1,82 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from decouple import config
+
+DEFAULT_PAGE_SIZE = config("DEFAULT_PAGE_SIZE", default=20, cast=int)
+MAX_PAGE_SIZE = config("MAX_PAGE_SIZE", default=100, cast=int)
+
+class InvalidCursor(ValueError):
+    pass
+
+def _encode(raw: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(raw, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def _decode(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor("Invalid pagination cursor")
+    if not isinstance(raw, dict):
+        raise InvalidCursor("Invalid pagination cursor")
+    return raw
+
+def encode_cursor(created_at: datetime, object_id: ObjectId) -> str:
+    return _encode({"t": created_at.isoformat(), "id": str(object_id)})
+
+def decode_cursor(cursor: str):
+    raw = _decode(cursor)
+    try:
+        return datetime.fromisoformat(raw["t"]), ObjectId(raw["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise InvalidCursor("Invalid pagination cursor")
+
+def encode_key_cursor(key: str, object_id: ObjectId) -> str:
+    # For pages ordered by a string key instead of a date (see app.directory)
+    return _encode({"k": key, "id": str(object_id)})
+
+def decode_key_cursor(cursor: str):
+    raw = _decode(cursor)
+    try:
+        if not isinstance(raw["k"], str):
+            raise TypeError
+        return raw["k"], ObjectId(raw["id"])
+    except (KeyError, TypeError, InvalidId):
+        raise InvalidCursor("Invalid pagination cursor")
+
+def keyset_filter(query: dict, cursor: str = None, sort_field: str = "created_at", tie_field: str = "_id") -> dict:
+    # Everything strictly "older" than the cursor in (sort_field, tie_field) descending order
+    if not cursor:
+        return query
+    value, object_id = decode_cursor(cursor)
+    return {
+        **query,
+        "$or": [
+            {sort_field: {"$lt": value}},
+            {sort_field: value, tie_field: {"$lt": object_id}},
+        ],
+    }
+
+async def fetch_rows(collection, query: dict, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                     projection: dict = None, sort_field: str = "created_at", tie_field: str = "_id"):
+    # One extra row tells the caller whether another page exists without a count query
+    return await collection.find(keyset_filter(query, cursor, sort_field, tie_field), projection) \
+        .sort([(sort_field, -1), (tie_field, -1)]) \
+        .limit(limit + 1) \
+        .to_list(limit + 1)
+
+def cut_page(documents: list, limit: int, sort_field: str = "created_at", tie_field: str = "_id"):
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    last = documents[-1]
+    return documents, encode_cursor(last[sort_field], last[tie_field])
+
+async def fetch_page(collection, query: dict, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE,
+                     projection: dict = None, sort_field: str = "created_at", tie_field: str = "_id"):
+    documents = await fetch_rows(collection, query, cursor, limit, projection, sort_field, tie_field)
+    return cut_page(documents, limit, sort_field, tie_field)
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from decouple import config
+from app.database import activity_collection, comment_collection, follow_collection
+from app.repository import activity_card, comment_out
+from app.loaders import activity_users, comment_users
+
+# "local" publishes from the process that made the write; "change_stream" tails Mongo instead,
+# so every API process sees every write (needs a replica set)
+PUSH_SOURCE = config("PUSH_SOURCE", default="local")
+# Events buffered per connection; a client that falls this far behind is disconnected
+PUSH_QUEUE_SIZE = config("PUSH_QUEUE_SIZE", default=100, cast=int)
+PUSH_KEEPALIVE_SECONDS = config("PUSH_KEEPALIVE_SECONDS", default=25, cast=int)
+
+logger = logging.getLogger("uvicorn")
+
+# Queued in place of the backlog when a subscriber is dropped
+DROPPED = object()
+
+class Subscription:
+    def __init__(self, user_id: str, following: set):
+        self.user_id = user_id
+        self.following = following
+        self.queue = asyncio.Queue(maxsize=PUSH_QUEUE_SIZE)
+
+    async def next(self, timeout: float):
+        # None on timeout (time for a keepalive); raises once the hub has dropped us
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message is DROPPED:
+            raise SlowConsumer()
+        return message
+
+class SlowConsumer(Exception):
+    pass
+
+class PushHub:
+    def __init__(self):
+        # author id -> subscriptions that should see that author's activities and comments on them
+        self.audiences = defaultdict(set)
+        self.dropped = 0
+
+    async def subscribe(self, user_id: str) -> Subscription:
+        edges = await follow_collection.find({"follower_id": user_id}, {"followee_id": 1}).to_list(None)
+        subscription = Subscription(user_id, {edge["followee_id"] for edge in edges} | {user_id})
+        for author_id in subscription.following:
+            self.audiences[author_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for author_id in subscription.following:
+            audience = self.audiences.get(author_id)
+            if audience is not None:
+                audience.discard(subscription)
+                if not audience:
+                    del self.audiences[author_id]
+
+    def follow(self, follower_id: str, followee_id: str):
+        # Keep open connections in step with /follow and /unfollow
+        for subscription in list(self.audiences.get(follower_id, ())):
+            if subscription.user_id == follower_id and followee_id not in subscription.following:
+                subscription.following.add(followee_id)
+                self.audiences[followee_id].add(subscription)
+
+    def unfollow(self, follower_id: str, followee_id: str):
+        for subscription in list(self.audiences.get(followee_id, ())):
+            if subscription.user_id == follower_id:
+                subscription.following.discard(followee_id)
+                self.audiences[followee_id].discard(subscription)
+        if not self.audiences.get(followee_id):
+            self.audiences.pop(followee_id, None)
+
+    def publish(self, author_id: str, message: str):
+        # message is serialized once and shared by every recipient
+        for subscription in list(self.audiences.get(author_id, ())):
+            try:
+                subscription.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.drop(subscription)
+
+    def drop(self, subscription: Subscription):
+        self.unsubscribe(subscription)
+        self.dropped += 1
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(DROPPED)
+
+    def stats(self) -> dict:
+        connections = {subscription for audience in self.audiences.values() for subscription in audience}
+        return {"connections": len(connections), "authors": len(self.audiences), "dropped": self.dropped}
+
+hub = PushHub()
+
+async def activity_event(activity) -> str:
+    card = activity_card(activity, await activity_users([activity]))
+    return json.dumps({"type": "activity", "data": json.loads(card.json())})
+
+async def comment_event(comment) -> str:
+    return json.dumps({"type": "comment", "data": json.loads(comment_out(comment, await comment_users([comment])).json())})
+
+async def publish_activity(activity):
+    # Nobody listening for this author means nothing to render
+    if PUSH_SOURCE == "local" and activity["user_id"] in hub.audiences:
+        hub.publish(activity["user_id"], await activity_event(activity))
+
+async def publish_comment(comment, activity_owner_id: str):
+    # Comments reach whoever can see the activity in their feed, i.e. followers of its owner
+    if PUSH_SOURCE == "local" and activity_owner_id in hub.audiences:
+        hub.publish(activity_owner_id, await comment_event(comment))
+
+async def watch_changes():
+    # Change-stream source: one task per process turns inserts from any process into events
+    async def activities():
+        async with activity_collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            async for change in stream:
+                activity = change["fullDocument"]
+                if activity["user_id"] in hub.audiences:
+                    hub.publish(activity["user_id"], await activity_event(activity))
+
+    async def comments():
+        async with comment_collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            async for change in stream:
+                comment = change["fullDocument"]
+                owner = await activity_collection.find_one({"_id": comment["activity_id"]}, {"user_id": 1})
+                if owner and owner["user_id"] in hub.audiences:
+                    hub.publish(owner["user_id"], await comment_event(comment))
+
+    while True:
+        try:
+            await asyncio.gather(activities(), comments())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Change stream stopped, restarting: {e}")
+            await asyncio.sleep(1)
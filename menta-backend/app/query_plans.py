@@ -0,0 +1,147 @@
+import asyncio
+import sys
+from datetime import datetime
+from bson import ObjectId
+from app.database import (
+    database, connect, user_collection, activity_collection, progress_collection, progress_daily_collection,
+    timeline_collection, comment_collection, follow_collection, job_collection, notification_collection,
+    leaderboard_collection, leaderboard_rank_collection, name_token_collection, club_collection, club_member_collection, club_feed_collection,
+    club_counter_collection, club_contribution_collection, challenge_collection, challenge_participant_collection,
+)
+from app.directory import prefix_range, search_query
+from app.pagination import encode_cursor, keyset_filter
+
+# Every query shape the app issues, as (description, collection, filter, sort). Writes are
+# explained as the find that locates their documents. Run with `python -m app.query_plans`;
+# it exits non-zero if any shape would scan a whole collection or sort its matches in memory.
+
+# Shapes whose in-memory sort is fine: the job claim sorts only the jobs due right now
+BOUNDED_SORTS = {"job claim"}
+
+def query_shapes() -> list:
+    user_id, other_id, oid, now = "u", "v", ObjectId(), datetime.utcnow()
+    cursor = encode_cursor(now, oid)
+    newest = [("created_at", -1), ("_id", -1)]
+
+    def page(query, sort_field="created_at", tie_field="_id"):
+        # First and later pages differ: later pages add the keyset $or
+        return [query, keyset_filter(query, cursor, sort_field, tie_field)]
+
+    shapes = [
+        ("user by email", user_collection, {"email": "a@b.c"}, None),
+        ("user by id", user_collection, {"_id": oid}, None),
+        ("user summaries", user_collection, {"_id": {"$in": [oid]}}, None),
+        ("high-fanout authors", user_collection, {"high_fanout": True}, None),
+        ("progress by user", progress_collection, {"user_id": user_id}, None),
+        ("progress upsert", progress_collection, {"user_id": user_id, "activity": "reading"}, None),
+        ("daily progress upsert", progress_daily_collection, {"user_id": user_id, "activity": "reading", "day": "2024-01-01"}, None),
+        ("timeline cleanup on unfollow", timeline_collection, {"owner_id": user_id, "author_id": other_id}, None),
+        ("follow edge", follow_collection, {"follower_id": user_id, "followee_id": other_id}, None),
+        ("followed among", follow_collection, {"follower_id": user_id, "followee_id": {"$in": [other_id]}}, None),
+        ("follower fan-out", follow_collection, {"followee_id": user_id}, None),
+        ("activities by id", activity_collection, {"_id": {"$in": [oid]}}, None),
+        ("stats range", activity_collection, {"user_id": user_id, "date": {"$gte": "2024-01-01", "$lte": "2024-12-31"}}, None),
+        ("export", activity_collection, {"user_id": user_id}, [("created_at", 1), ("_id", 1)]),
+        ("job claim", job_collection, {"$or": [
+            {"status": "queued", "run_at": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lt": now}},
+        ]}, [("run_at", 1)]),
+        ("leaderboard top", leaderboard_collection, {"board": "week:2024-W01:reading"}, [("seconds", -1), ("user_id", 1)]),
+        ("leaderboard entry", leaderboard_collection, {"board": "week:2024-W01:reading", "user_id": user_id}, None),
+        ("leaderboard following", leaderboard_collection, {"board": "week:2024-W01:reading", "user_id": {"$in": [user_id, other_id]}}, None),
+        ("leaderboard rank counters", leaderboard_rank_collection, {"_id": {"$in": ["week:2024-W01:reading:1"]}}, None),
+        ("club by id", club_collection, {"_id": {"$in": [oid]}}, None),
+        ("club memberships", club_member_collection, {"club_id": {"$in": [user_id]}, "user_id": other_id}, None),
+        ("club counters", club_counter_collection, {"club_id": {"$in": [user_id]}, "bucket": "total"}, None),
+        ("club contributions", club_contribution_collection, {"club_id": user_id, "week": "2024-W01"}, [("seconds", -1), ("user_id", 1)]),
+        ("club feed cleanup on leave", club_feed_collection, {"club_id": user_id, "author_id": other_id}, None),
+        ("open challenges for an activity", challenge_participant_collection, {
+            "user_id": user_id, "activity_key": {"$in": ["reading", "*"]}, "ends": {"$gte": "2024-01-01"},
+            "starts": {"$lte": "2024-01-01"}, "$or": [{"completed_at": None}, {"completed_by": oid}],
+        }, None),
+        ("challenge completion notice", notification_collection, {
+            "user_id": user_id, "kind": "challenge", "challenge_id": other_id, "activity_id": oid,
+        }, None),
+        ("challenge participations", challenge_participant_collection, {"challenge_id": {"$in": [user_id]}, "user_id": other_id}, None),
+        ("activity outbox sweep", activity_collection, {"outbox_due_at": {"$lte": now}}, None),
+        ("job depth", job_collection, {"status": {"$in": ["queued", "running", "failed"]}}, None),
+    ]
+    for query in page({}):
+        shapes.append(("all activities", activity_collection, query, newest))
+    for query in page({"user_id": user_id}):
+        shapes.append(("activities by user", activity_collection, query, newest))
+    for query in page({"user_id": {"$in": [user_id, other_id]}}):
+        shapes.append(("high-fanout pull", activity_collection, query, newest))
+    for query in page({"owner_id": user_id}, tie_field="activity_id"):
+        shapes.append(("home timeline", timeline_collection, query, [("created_at", -1), ("activity_id", -1)]))
+    for query in page({"activity_id": oid}, sort_field="timestamp"):
+        shapes.append(("comments", comment_collection, query, [("timestamp", -1), ("_id", -1)]))
+    for query in page({"followee_id": user_id}) + page({"follower_id": user_id}):
+        shapes.append(("follow page", follow_collection, query, newest))
+    for query in page({}) + page({"activity_key": "reading"}):
+        shapes.append(("clubs", club_collection, query, newest))
+    for query in page({"club_id": user_id}):
+        shapes.append(("club members", club_member_collection, query, newest))
+    for query in page({"club_id": user_id}, tie_field="activity_id"):
+        shapes.append(("club feed", club_feed_collection, query, [("created_at", -1), ("activity_id", -1)]))
+    for query in page({}) + page({"activity_key": "reading"}):
+        shapes.append(("challenges", challenge_collection, query, newest))
+    for query in page({"user_id": user_id}):
+        shapes.append(("joined challenges", challenge_participant_collection, query, newest))
+    for query in page({"user_id": user_id}):
+        shapes.append(("notifications", notification_collection, query, newest))
+    for arguments in ({"interest": "reading"}, {"location": "nyc"}, {}):
+        for query in page(search_query(**arguments)):
+            shapes.append((f"user listing {arguments}", user_collection, query, newest))
+    name_order = [("token", 1), ("user_id", 1)]
+    shapes += [
+        ("name search", name_token_collection, {"token": prefix_range("ad")}, name_order),
+        ("name search next page", name_token_collection, {"token": prefix_range("ad"), "$or": [
+            {"token": {"$gt": "ada"}}, {"token": "ada", "user_id": {"$gt": oid}},
+        ]}, name_order),
+        ("name search candidates", user_collection, {**search_query("ada love", "reading"), "_id": {"$in": [oid]}}, None),
+        ("name token cleanup", name_token_collection, {"user_id": oid, "token": {"$nin": ["ada"]}}, None),
+    ]
+    return shapes
+
+def blocking_stages(plan) -> list:
+    # COLLSCAN and in-memory SORT stages of the winning plan (and nested plans), ignoring the
+    # rejected alternatives
+    if isinstance(plan, dict):
+        found = [plan["stage"]] if plan.get("stage") in ("COLLSCAN", "SORT") else []
+        for key, value in plan.items():
+            if key != "rejectedPlans":
+                found.extend(blocking_stages(value))
+        return found
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in blocking_stages(item)]
+    return []
+
+async def explain(collection, query: dict, sort) -> dict:
+    command = {"find": collection.name, "filter": query}
+    if sort:
+        command["sort"] = dict(sort)
+    return await database.command("explain", command, verbosity="queryPlanner")
+
+async def check_query_plans() -> list:
+    # Returns a description of every shape whose winning plan scans a collection or sorts in memory
+    failures = []
+    for description, collection, query, sort in query_shapes():
+        result = await explain(collection, query, sort)
+        stages = set(blocking_stages(result.get("queryPlanner", {}).get("winningPlan", {})))
+        if description in BOUNDED_SORTS:
+            stages.discard("SORT")
+        for stage in sorted(stages):
+            failures.append(f"{stage} {description}: {collection.name} {query} sort={sort}")
+    return failures
+
+async def main() -> int:
+    await connect()
+    failures = await check_query_plans()
+    for failure in failures:
+        print(failure)
+    print(f"{len(query_shapes())} query shapes checked, {len(failures)} collection scans or in-memory sorts")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,229 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+from app.database import user_collection, progress_collection, COMMENT_PREVIEW_SIZE
+from app.versions import ACTIVITIES, PROFILE, version_increments
+from app.schemas import (
+    UserOut, UserSummary, UserSummaryPage, ActivityOut, ActivityPage, CommentPreview, CommentOut, CommentPage, ProgressOut,
+    NotificationOut, NotificationPage, ClubOut, ClubPage, ChallengeOut, ChallengePage, ChallengeProgress,
+)
+
+# Per-use-case projections: Mongo only sends what the response is built from. Converters
+# below build response models with construct(), so each document is read exactly once and
+# never round-trips through an intermediate dict and a second validation.
+
+USER_PROFILE_PROJECTION = {
+    "first_name": 1, "last_name": 1, "email": 1, "dob": 1, "interests": 1, "profile_picture": 1,
+    "cover_photo": 1, "location": 1, "bio": 1, "clubs": 1, "follower_count": 1, "following_count": 1,
+}
+USER_SUMMARY_PROJECTION = {"first_name": 1, "last_name": 1, "profile_picture": 1, "created_at": 1}
+USER_CREDENTIALS_PROJECTION = {"email": 1, "hashed_password": 1}
+
+ACTIVITY_CARD_PROJECTION = {
+    "title": 1, "description": 1, "activity": 1, "date": 1, "start_time": 1, "end_time": 1, "duration": 1,
+    "private_notes": 1, "privacy_type": 1, "perceived_performance": 1, "images": 1, "image_variants": 1, "failed_images": 1, "user_id": 1,
+    "created_at": 1, "updated_at": 1, "comments_preview": 1, "comment_count": 1,
+    # Legacy documents still embed every comment; only the tail is ever rendered
+    "comments": {"$slice": -COMMENT_PREVIEW_SIZE},
+}
+
+def user_profile(user) -> UserOut:
+    return UserOut.construct(
+        id=str(user["_id"]),
+        first_name=user["first_name"],
+        last_name=user["last_name"],
+        email=user["email"],
+        dob=user.get("dob"),
+        interests=user.get("interests", []),
+        profile_picture=user.get("profile_picture"),
+        cover_photo=user.get("cover_photo"),
+        location=user.get("location"),
+        bio=user.get("bio"),
+        clubs=user.get("clubs", []),
+        follower_count=user.get("follower_count", 0),
+        following_count=user.get("following_count", 0),
+    )
+
+def user_summary(user) -> UserSummary:
+    return UserSummary.construct(
+        id=str(user["_id"]),
+        first_name=user["first_name"],
+        last_name=user["last_name"],
+        profile_picture=user.get("profile_picture"),
+    )
+
+def activity_card(activity, users=None) -> ActivityOut:
+    # users maps user ids to summaries (see app.loaders); authors are embedded when given
+    comments = activity.get("comments_preview")
+    if comments is None:
+        comments = activity.get("comments", [])[-COMMENT_PREVIEW_SIZE:]
+    return ActivityOut.construct(
+        id=str(activity["_id"]),
+        title=activity["title"],
+        description=activity.get("description"),
+        activity=activity["activity"],
+        date=activity["date"],
+        start_time=activity["start_time"],
+        end_time=activity["end_time"],
+        duration=activity["duration"],
+        private_notes=activity.get("private_notes"),
+        privacy_type=activity["privacy_type"],
+        perceived_performance=activity.get("perceived_performance"),
+        images=activity.get("images", []),
+        image_variants=activity.get("image_variants", []),
+        failed_images=activity.get("failed_images", 0),
+        user_id=activity["user_id"],
+        author=users.get(activity["user_id"]) if users else None,
+        comments=[
+            CommentPreview.construct(
+                user_id=comment["user_id"],
+                author=users.get(comment["user_id"]) if users else None,
+                text=comment["text"],
+                timestamp=comment["timestamp"],
+            )
+            for comment in comments
+        ],
+        comment_count=activity.get("comment_count", len(comments)),
+        created_at=activity["created_at"],
+        updated_at=activity["updated_at"],
+    )
+
+def comment_out(comment, users=None) -> CommentOut:
+    return CommentOut.construct(
+        id=str(comment["_id"]),
+        activity_id=str(comment["activity_id"]),
+        user_id=comment["user_id"],
+        author=users.get(comment["user_id"]) if users else None,
+        text=comment["text"],
+        timestamp=comment["timestamp"],
+    )
+
+def progress_out(progress) -> ProgressOut:
+    # A streak only counts while its last day is today or yesterday
+    yesterday = (datetime.utcnow() - timedelta(days=1)).strftime("%Y-%m-%d")
+    last_day = progress.get("last_day")
+    return ProgressOut.construct(
+        id=str(progress["_id"]),
+        user_id=progress["user_id"],
+        activity=progress["activity"],
+        streak=progress["streak"] if last_day is None or last_day >= yesterday else 0,
+        last_completed=progress["last_completed"],
+        total_time_spent=progress.get("time_spent_seconds", progress.get("total_time_spent", 0) * 60) // 60,  # in minutes
+        sessions=progress.get("sessions", 0),
+        created_at=progress["created_at"],
+        updated_at=progress["updated_at"],
+    )
+
+def notification_out(notification) -> NotificationOut:
+    return NotificationOut.construct(
+        id=str(notification["_id"]),
+        kind=notification["kind"],
+        actor_id=notification["actor_id"],
+        activity_id=str(notification["activity_id"]) if notification.get("activity_id") else None,
+        challenge_id=notification.get("challenge_id"),
+        read=notification.get("read", False),
+        created_at=notification["created_at"],
+    )
+
+def club_out(club, member_count: int = 0, is_member: bool = False) -> ClubOut:
+    return ClubOut.construct(
+        id=str(club["_id"]),
+        name=club["name"],
+        description=club.get("description"),
+        activity=club.get("activity"),
+        location=club.get("location"),
+        owner_id=club["owner_id"],
+        created_at=club["created_at"],
+        member_count=member_count,
+        is_member=is_member,
+    )
+
+# Which progress field each challenge goal is measured by
+CHALLENGE_GOALS = {"total_seconds": "seconds", "sessions": "sessions", "streak_days": "best_streak"}
+
+def challenge_progress(participant) -> ChallengeProgress:
+    return ChallengeProgress.construct(
+        value=participant[CHALLENGE_GOALS[participant["goal"]]],
+        seconds=participant["seconds"],
+        sessions=participant["sessions"],
+        streak=participant["streak"],
+        best_streak=participant["best_streak"],
+        joined_at=participant["created_at"],
+        completed_at=participant.get("completed_at"),
+    )
+
+def challenge_out(challenge, participant=None) -> ChallengeOut:
+    return ChallengeOut.construct(
+        id=str(challenge["_id"]),
+        title=challenge["title"],
+        description=challenge.get("description"),
+        activity=challenge.get("activity"),
+        goal=challenge["goal"],
+        target=challenge["target"],
+        starts=challenge["starts"],
+        ends=challenge["ends"],
+        creator_id=challenge["creator_id"],
+        created_at=challenge["created_at"],
+        participant_count=challenge.get("participant_count", 0),
+        completion_count=challenge.get("completion_count", 0),
+        progress=challenge_progress(participant) if participant else None,
+    )
+
+def activity_page(activities, next_cursor, users=None) -> ActivityPage:
+    return ActivityPage.construct(items=[activity_card(activity, users) for activity in activities], next_cursor=next_cursor)
+
+def user_summary_page(users, next_cursor) -> UserSummaryPage:
+    return UserSummaryPage.construct(items=[user_summary(user) for user in users], next_cursor=next_cursor)
+
+def club_page(clubs, next_cursor, member_counts: dict, memberships: set) -> ClubPage:
+    return ClubPage.construct(
+        items=[club_out(club, member_counts.get(str(club["_id"]), 0), str(club["_id"]) in memberships) for club in clubs],
+        next_cursor=next_cursor,
+    )
+
+def challenge_page(challenges, next_cursor, participants: dict) -> ChallengePage:
+    return ChallengePage.construct(
+        items=[challenge_out(challenge, participants.get(str(challenge["_id"]))) for challenge in challenges],
+        next_cursor=next_cursor,
+    )
+
+def comment_page(comments, next_cursor, users=None) -> CommentPage:
+    return CommentPage.construct(items=[comment_out(comment, users) for comment in comments], next_cursor=next_cursor)
+
+def notification_page(notifications, next_cursor) -> NotificationPage:
+    return NotificationPage.construct(items=[notification_out(item) for item in notifications], next_cursor=next_cursor)
+
+async def find_user_profile(user_id: str):
+    if not ObjectId.is_valid(user_id):
+        return None
+    user = await user_collection.find_one({"_id": ObjectId(user_id)}, USER_PROFILE_PROJECTION)
+    return user_profile(user) if user else None
+
+async def find_user_profile_by_email(email: str):
+    user = await user_collection.find_one({"email": email}, USER_PROFILE_PROJECTION)
+    return user_profile(user) if user else None
+
+async def find_user_credentials(email: str):
+    return await user_collection.find_one({"email": email}, USER_CREDENTIALS_PROJECTION)
+
+async def email_exists(email: str) -> bool:
+    return await user_collection.find_one({"email": email}, {"_id": 1}) is not None
+
+async def user_exists(user_id: str) -> bool:
+    if not ObjectId.is_valid(user_id):
+        return False
+    return await user_collection.find_one({"_id": ObjectId(user_id)}, {"_id": 1}) is not None
+
+async def update_user_profile(user_id: str, updated_data: dict):
+    # Activity cards embed the author's name and picture, so their validators move as well
+    user = await user_collection.find_one_and_update(
+        {"_id": ObjectId(user_id)},
+        {"$set": updated_data, "$inc": version_increments(PROFILE, ACTIVITIES)},
+        projection=USER_PROFILE_PROJECTION,
+        return_document=ReturnDocument.AFTER,
+    )
+    return user_profile(user) if user else None
+
+async def find_progress(user_id: str) -> list:
+    entries = await progress_collection.find({"user_id": user_id}).to_list(None)
+    return [progress_out(entry) for entry in entries]
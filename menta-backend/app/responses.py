@@ -0,0 +1,20 @@
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from app.storage import IMMUTABLE_CACHE_CONTROL
+
+class ModelResponse(Response):
+    # Renders response models built by app.repository straight to JSON. Returning a model
+    # through FastAPI's response_model would dump it to a dict and validate it a second time.
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        if isinstance(content, list):
+            return ("[" + ",".join(item.json() for item in content) + "]").encode("utf-8")
+        return content.json().encode("utf-8")
+
+class ImmutableStaticFiles(StaticFiles):
+    # Uploaded files are written once under a fresh key, so browsers and CDNs never need to revalidate
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
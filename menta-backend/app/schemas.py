@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 class UserCreate(BaseModel):
@@ -14,8 +14,6 @@ class UserCreate(BaseModel):
     location: Optional[str]
     bio: Optional[str]
     clubs: Optional[List[str]] = []
-    followers: Optional[List[str]] = []
-    following: Optional[List[str]] = []
 
 class UserOut(BaseModel):
     id: str
@@ -29,8 +27,21 @@ class UserOut(BaseModel):
     location: Optional[str]
     bio: Optional[str]
     clubs: Optional[List[str]] = []
-    followers: Optional[List[str]] = []
-    following: Optional[List[str]] = []
+    follower_count: int = 0
+    following_count: int = 0
+
+class UserSummary(BaseModel):
+    id: str
+    first_name: str
+    last_name: str
+    profile_picture: Optional[str]
+
+class UserSummaryPage(BaseModel):
+    items: List[UserSummary]
+    next_cursor: Optional[str] = None
+
+class FollowStatus(BaseModel):
+    following: bool
 
 class Token(BaseModel):
     access_token: str
@@ -44,6 +55,21 @@ class Comment(BaseModel):
     text: str
     timestamp: datetime
 
+class CommentPreview(Comment):
+    author: Optional[UserSummary] = None
+
+class CommentOut(BaseModel):
+    id: str
+    activity_id: str
+    user_id: str
+    author: Optional[UserSummary] = None
+    text: str
+    timestamp: datetime
+
+class CommentPage(BaseModel):
+    items: List[CommentOut]
+    next_cursor: Optional[str] = None
+
 class ActivityCreate(BaseModel):
     title: str
     description: Optional[str]
@@ -70,11 +96,19 @@ class ActivityOut(BaseModel):
     privacy_type: str
     perceived_performance: Optional[int]
     images: Optional[List[str]] = []
+    image_variants: List[Dict[str, str]] = []  # {"thumbnail", "feed", "full"} per entry of images
+    failed_images: int = 0  # uploads that turned out not to decode
     user_id: str
-    comments: Optional[List[Comment]] = []
+    author: Optional[UserSummary] = None
+    comments: Optional[List[CommentPreview]] = []  # latest few comments only
+    comment_count: int = 0
     created_at: datetime
     updated_at: datetime
 
+class ActivityPage(BaseModel):
+    items: List[ActivityOut]
+    next_cursor: Optional[str] = None
+
 class Progress(BaseModel):
     user_id: str
     activity: str
@@ -91,5 +125,131 @@ class ProgressOut(BaseModel):
     streak: int
     last_completed: datetime
     total_time_spent: int  # in minutes
+    sessions: int = 0
     created_at: datetime
     updated_at: datetime
+
+class StatsBucket(BaseModel):
+    activity: str
+    period: str
+    time_spent_seconds: int
+    sessions: int
+    avg_perceived_performance: Optional[float]
+    longest_session_seconds: int
+
+class ClubCreate(BaseModel):
+    name: str
+    description: Optional[str] = None
+    activity: Optional[str] = None  # only sessions of this type count towards the club; any type when empty
+    location: Optional[str] = None
+
+class ClubOut(BaseModel):
+    id: str
+    name: str
+    description: Optional[str] = None
+    activity: Optional[str] = None
+    location: Optional[str] = None
+    owner_id: str
+    created_at: datetime
+    member_count: int = 0
+    is_member: bool = False
+
+class ClubPage(BaseModel):
+    items: List[ClubOut]
+    next_cursor: Optional[str] = None
+
+class ClubContributor(BaseModel):
+    user_id: str
+    seconds: int
+    user: Optional[UserSummary] = None
+
+class ClubTotals(BaseModel):
+    club_id: str
+    members: int
+    starts: str  # the week's Monday
+    ends: str  # exclusive
+    seconds: int
+    sessions: int
+    top_contributors: List[ClubContributor]
+
+class ChallengeCreate(BaseModel):
+    title: str
+    description: Optional[str] = None
+    activity: Optional[str] = None  # any activity type counts when empty
+    goal: str  # "total_seconds", "sessions" or "streak_days"
+    target: int  # in the goal's unit: seconds, sessions or consecutive days
+    starts: str  # YYYY-MM-DD, inclusive
+    ends: str  # YYYY-MM-DD, inclusive
+
+class ChallengeProgress(BaseModel):
+    value: int  # towards the target, in the goal's unit
+    seconds: int
+    sessions: int
+    streak: int
+    best_streak: int
+    joined_at: datetime
+    completed_at: Optional[datetime] = None
+
+class ChallengeOut(BaseModel):
+    id: str
+    title: str
+    description: Optional[str] = None
+    activity: Optional[str] = None
+    goal: str
+    target: int
+    starts: str
+    ends: str
+    creator_id: str
+    created_at: datetime
+    participant_count: int = 0
+    completion_count: int = 0
+    progress: Optional[ChallengeProgress] = None  # the caller's, if they joined
+
+class ChallengePage(BaseModel):
+    items: List[ChallengeOut]
+    next_cursor: Optional[str] = None
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: str
+    seconds: int
+    user: Optional[UserSummary] = None
+
+class LeaderboardOut(BaseModel):
+    activity: str
+    period: str  # "week" or "month"
+    starts: str
+    ends: str  # exclusive
+    scope: str  # "all" or "following"
+    participants: int
+    entries: List[LeaderboardEntry]
+    me: Optional[LeaderboardEntry] = None  # absent until the caller logs time in this period
+
+class StatsOut(BaseModel):
+    user_id: str
+    bucket: str
+    buckets: List[StatsBucket]
+
+class NotificationOut(BaseModel):
+    id: str
+    kind: str  # "comment", "follow" or "challenge"
+    actor_id: str
+    activity_id: Optional[str] = None
+    challenge_id: Optional[str] = None
+    read: bool = False
+    created_at: datetime
+
+class NotificationPage(BaseModel):
+    items: List[NotificationOut]
+    next_cursor: Optional[str] = None
+
+class ImportRowError(BaseModel):
+    row: int
+    error: str
+
+class ImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[ImportRowError]
+    seconds: float
+    rows_per_second: float
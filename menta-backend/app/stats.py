@@ -0,0 +1,70 @@
+from decouple import config
+from app.cache import TTLCache
+from app.database import activity_collection
+from app.versions import ACTIVITIES, resource_version
+
+# ISO week, calendar month or year of the activity's own date
+BUCKET_FORMATS = {
+    "week": "%G-W%V",
+    "month": "%Y-%m",
+    "year": "%Y",
+}
+
+# Per user: {"version": n, "views": {(bucket, start, end): result}}, where n is the user's
+# versions.activities when the views were computed. Every activity write bumps that version
+# (see app.versions), in whichever process it happens, so a stale entry stops matching at once.
+stats_cache = TTLCache(
+    maxsize=config("STATS_CACHE_SIZE", default=5000, cast=int),
+    ttl=config("STATS_CACHE_TTL", default=3600, cast=int),
+)
+MAX_VIEWS_PER_USER = 32
+
+def stats_pipeline(user_id: str, bucket: str, start: str = None, end: str = None) -> list:
+    match = {"user_id": user_id}
+    if start or end:
+        match["date"] = {}
+        if start:
+            match["date"]["$gte"] = start
+        if end:
+            match["date"]["$lte"] = end
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "activity": "$activity",
+                "period": {"$dateToString": {
+                    "format": BUCKET_FORMATS[bucket],
+                    "date": {"$dateFromString": {"dateString": "$date", "format": "%Y-%m-%d"}},
+                }},
+            },
+            "time_spent_seconds": {"$sum": "$duration"},
+            "sessions": {"$sum": 1},
+            "avg_perceived_performance": {"$avg": "$perceived_performance"},
+            "longest_session_seconds": {"$max": "$duration"},
+        }},
+        {"$sort": {"_id.period": 1, "_id.activity": 1}},
+        {"$project": {
+            "_id": 0,
+            "activity": "$_id.activity",
+            "period": "$_id.period",
+            "time_spent_seconds": 1,
+            "sessions": 1,
+            "avg_perceived_performance": 1,
+            "longest_session_seconds": 1,
+        }},
+    ]
+
+async def get_activity_stats(user_id: str, bucket: str, start: str = None, end: str = None) -> list:
+    key = (bucket, start, end)
+    # Read before the pipeline: a write that lands while it runs bumps the version past this one
+    version = await resource_version(user_id, ACTIVITIES)
+    cached = stats_cache.get(user_id)
+    current = cached is not None and cached["version"] == version
+    if current and key in cached["views"]:
+        return cached["views"][key]
+    buckets = await activity_collection.aggregate(stats_pipeline(user_id, bucket, start, end)).to_list(None)
+    if version is not None:
+        views = cached["views"] if current and len(cached["views"]) < MAX_VIEWS_PER_USER else {}
+        views[key] = buckets
+        stats_cache.set(user_id, {"version": version, "views": views})
+    return buckets
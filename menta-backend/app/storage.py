@@ -0,0 +1,129 @@
+import asyncio
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from decouple import config
+
+STORAGE_BACKEND = config("STORAGE_BACKEND", default="s3")
+STORAGE_WORKERS = config("STORAGE_WORKERS", default=8, cast=int)
+MULTIPART_THRESHOLD_MB = config("MULTIPART_THRESHOLD_MB", default=8, cast=int)
+MULTIPART_CHUNKSIZE_MB = config("MULTIPART_CHUNKSIZE_MB", default=8, cast=int)
+UPLOADS_DIR = config("UPLOADS_DIR", default="uploads")
+# Raw uploads wait here, outside the public mount, until a background job has processed them
+STAGING_DIR = config("STAGING_DIR", default="staging")
+PUBLIC_BASE_URL = config("PUBLIC_BASE_URL", default="http://127.0.0.1:8000")
+COPY_CHUNK_SIZE = 1024 * 1024
+# Keys are never reused, so whatever sits behind a URL can be cached forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class Storage:
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix="storage")
+
+    def _put(self, fileobj, key: str, content_type: str) -> str:
+        raise NotImplementedError
+
+    async def save(self, fileobj, key: str, content_type: str) -> str:
+        return await self._run(self._put, fileobj, key, content_type)
+
+    def _stage(self, fileobj, key: str):
+        raise NotImplementedError
+
+    def _load_staged(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    def _discard_staged(self, key: str):
+        raise NotImplementedError
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def stage_uploads(self, files) -> list:
+        keys = [str(uuid.uuid4()) for _ in files]
+        await asyncio.gather(*(self._run(self._stage, file.file, key) for file, key in zip(files, keys)))
+        return keys
+
+    async def load_staged(self, key: str) -> bytes:
+        return await self._run(self._load_staged, key)
+
+    async def discard_staged(self, key: str):
+        await self._run(self._discard_staged, key)
+
+class S3Storage(Storage):
+    def __init__(self):
+        super().__init__()
+        self.bucket_name = config("S3_BUCKET_NAME")
+        self.endpoint_url = config("S3_ENDPOINT_URL", default=None)
+        self.client = boto3.client(
+            "s3",
+            aws_access_key_id=config("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=config("AWS_SECRET_ACCESS_KEY"),
+            region_name=config("AWS_DEFAULT_REGION"),
+            endpoint_url=self.endpoint_url,
+        )
+        # upload_fileobj reads the spooled upload in chunks and switches to multipart above the threshold
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD_MB * 1024 * 1024,
+            multipart_chunksize=MULTIPART_CHUNKSIZE_MB * 1024 * 1024,
+            use_threads=True,
+        )
+
+    def _put(self, fileobj, key: str, content_type: str) -> str:
+        self.client.upload_fileobj(
+            fileobj, self.bucket_name, key,
+            ExtraArgs={"ContentType": content_type, "CacheControl": IMMUTABLE_CACHE_CONTROL},
+            Config=self.transfer_config,
+        )
+        if self.endpoint_url:
+            return f"{self.endpoint_url}/{self.bucket_name}/{key}"
+        return f"https://{self.bucket_name}.s3.amazonaws.com/{key}"
+
+    def _stage(self, fileobj, key: str):
+        self.client.upload_fileobj(fileobj, self.bucket_name, f"staging/{key}", Config=self.transfer_config)
+
+    def _load_staged(self, key: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket_name, Key=f"staging/{key}")["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                raise FileNotFoundError(key)
+            raise
+
+    def _discard_staged(self, key: str):
+        self.client.delete_object(Bucket=self.bucket_name, Key=f"staging/{key}")
+
+class LocalStorage(Storage):
+    def __init__(self):
+        super().__init__()
+        os.makedirs(UPLOADS_DIR, exist_ok=True)
+        os.makedirs(STAGING_DIR, exist_ok=True)
+
+    def _put(self, fileobj, key: str, content_type: str) -> str:
+        with open(os.path.join(UPLOADS_DIR, key), "wb") as destination:
+            shutil.copyfileobj(fileobj, destination, COPY_CHUNK_SIZE)
+        return f"{PUBLIC_BASE_URL}/uploads/{key}"
+
+    def _stage(self, fileobj, key: str):
+        with open(os.path.join(STAGING_DIR, key), "wb") as destination:
+            shutil.copyfileobj(fileobj, destination, COPY_CHUNK_SIZE)
+
+    def _load_staged(self, key: str) -> bytes:
+        with open(os.path.join(STAGING_DIR, key), "rb") as source:
+            return source.read()
+
+    def _discard_staged(self, key: str):
+        try:
+            os.remove(os.path.join(STAGING_DIR, key))
+        except FileNotFoundError:
+            pass
+
+def create_storage() -> Storage:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage()
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
@@ -0,0 +1,146 @@
+import asyncio
+import math
+import time
+import httpx
+from decouple import config
+from app.cache import TTLCache
+
+OVERPASS_URL = config("OVERPASS_URL", default="http://overpass-api.de/api/interpreter")
+OVERPASS_TIMEOUT = config("OVERPASS_TIMEOUT", default=25, cast=float)
+OVERPASS_MAX_CONNECTIONS = config("OVERPASS_MAX_CONNECTIONS", default=8, cast=int)
+# Zoom 14 tiles are roughly 2.4km wide at the equator
+TILE_ZOOM = config("STUDY_SPOT_TILE_ZOOM", default=14, cast=int)
+TILE_CACHE_SIZE = config("STUDY_SPOT_TILE_CACHE_SIZE", default=5000, cast=int)
+TILE_TTL = config("STUDY_SPOT_TILE_TTL", default=6 * 3600, cast=int)
+MAX_TILES = config("STUDY_SPOT_MAX_TILES", default=16, cast=int)
+
+class TooManyTiles(ValueError):
+    pass
+
+class InvalidBounds(ValueError):
+    pass
+
+def tile_for(lat: float, lon: float, zoom: int = TILE_ZOOM):
+    n = 2 ** zoom
+    lat = max(min(lat, 85.0511), -85.0511)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tile_bbox(x: int, y: int, zoom: int = TILE_ZOOM):
+    # (south, west, north, east), the order Overpass expects
+    n = 2 ** zoom
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+def crosses_antimeridian(southwest, northeast) -> bool:
+    return southwest[1] > northeast[1]
+
+def tiles_for_bounds(southwest, northeast, zoom: int = TILE_ZOOM):
+    if southwest[0] > northeast[0]:
+        raise InvalidBounds("southwest must not be north of northeast")
+    west_x, north_y = tile_for(northeast[0], southwest[1], zoom)
+    east_x, south_y = tile_for(southwest[0], northeast[1], zoom)
+    if crosses_antimeridian(southwest, northeast):
+        # West edge past the east edge: the box wraps around 180°, so take it as two column ranges
+        columns = list(range(west_x, 2 ** zoom)) + list(range(0, east_x + 1))
+    else:
+        columns = list(range(west_x, east_x + 1))
+    if len(columns) * (south_y - north_y + 1) > MAX_TILES:
+        raise TooManyTiles("Map area is too large, zoom in to see study spots")
+    return [(x, y) for x in columns for y in range(north_y, south_y + 1)]
+
+def in_bounds(element, southwest, northeast) -> bool:
+    if not southwest[0] <= element["lat"] <= northeast[0]:
+        return False
+    if crosses_antimeridian(southwest, northeast):
+        return element["lon"] >= southwest[1] or element["lon"] <= northeast[1]
+    return southwest[1] <= element["lon"] <= northeast[1]
+
+def tile_query(x: int, y: int) -> str:
+    south, west, north, east = tile_bbox(x, y)
+    bbox = f"{south},{west},{north},{east}"
+    return f"""
+    [out:json];
+    (
+      node["amenity"="cafe"]({bbox});
+      node["amenity"="library"]({bbox});
+    );
+    out body;
+    """
+
+class StudySpotCache:
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.tiles = TTLCache(maxsize=TILE_CACHE_SIZE, ttl=TILE_TTL)
+        self._inflight = {}
+        self.coalesced = 0
+        self.upstream_calls = 0
+        self.upstream_errors = 0
+        self.upstream_seconds = 0.0
+        self.upstream_max_seconds = 0.0
+
+    @classmethod
+    def create(cls):
+        client = httpx.AsyncClient(
+            timeout=OVERPASS_TIMEOUT,
+            limits=httpx.Limits(max_connections=OVERPASS_MAX_CONNECTIONS, max_keepalive_connections=OVERPASS_MAX_CONNECTIONS),
+        )
+        return cls(client)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _fetch_tile(self, tile) -> list:
+        started = time.perf_counter()
+        self.upstream_calls += 1
+        try:
+            response = await self.client.get(OVERPASS_URL, params={"data": tile_query(*tile)})
+            response.raise_for_status()
+            elements = response.json().get("elements", [])
+        except Exception:
+            self.upstream_errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.upstream_seconds += elapsed
+            self.upstream_max_seconds = max(self.upstream_max_seconds, elapsed)
+        self.tiles.set(tile, elements)
+        return elements
+
+    async def get_tile(self, tile) -> list:
+        elements = self.tiles.get(tile)
+        if elements is not None:
+            return elements
+        # Concurrent misses for the same tile share a single upstream request
+        task = self._inflight.get(tile)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_tile(tile))
+            self._inflight[tile] = task
+            task.add_done_callback(lambda _: self._inflight.pop(tile, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def get_spots(self, southwest, northeast) -> dict:
+        tiles = tiles_for_bounds(southwest, northeast)
+        results = await asyncio.gather(*(self.get_tile(tile) for tile in tiles))
+        elements = {}
+        for tile_elements in results:
+            for element in tile_elements:
+                if in_bounds(element, southwest, northeast):
+                    elements[element["id"]] = element
+        return {"elements": list(elements.values())}
+
+    def stats(self) -> dict:
+        return {
+            **self.tiles.stats(),
+            "coalesced": self.coalesced,
+            "upstream_calls": self.upstream_calls,
+            "upstream_errors": self.upstream_errors,
+            "upstream_avg_seconds": self.upstream_seconds / self.upstream_calls if self.upstream_calls else 0.0,
+            "upstream_max_seconds": self.upstream_max_seconds,
+        }
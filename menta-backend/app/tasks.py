@@ -0,0 +1,90 @@
+import logging
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from app.database import activity_collection, notification_collection
+from app.jobs import job_handler
+from app.outbox import mark_done
+from app.crud import update_progress
+from app.timeline import fan_out_activity
+from app.images import InvalidImage
+from app.leaderboards import add_activities
+from app.clubs import record_club_activity
+from app.challenges import evaluate_activity
+from app.versions import ACTIVITIES, PROGRESS, bump_versions
+
+logger = logging.getLogger("uvicorn")
+
+# Handlers for the deferred side effects enqueued by app.crud and the routes. Any of them may
+# run more than once for the same job (see app.jobs). Fan-out, feeds and notifications are
+# unique by key; the counting effects are keyed by the activity's _id through app.idempotency,
+# in the same write that counts it, so a rerun or a second worker after a lost lease counts
+# nothing twice. Jobs enqueued before activity _ids were in every payload run unguarded.
+
+def activity_job(kind: str):
+    # Registers a handler for one of the jobs create_activity writes into the activity's
+    # outbox; once it has run, it comes off that list (see app.outbox)
+    def register(function):
+        async def run(payload, state):
+            await function(payload, state)
+            await mark_done(payload.get("activity_id", payload.get("_id")), kind)
+        return job_handler(kind)(run)
+    return register
+
+@activity_job("fan_out")
+async def fan_out(payload, state):
+    # Timeline entries are unique per (owner, activity), so a rerun inserts nothing new
+    await fan_out_activity(payload)
+
+@activity_job("progress")
+async def apply_progress(payload, state):
+    await update_progress(payload["user_id"], payload["activity"], payload["date"], payload["duration"], payload.get("_id"))
+    # Bumping again on a rerun only costs clients one extra refetch
+    await bump_versions(payload["user_id"], PROGRESS)
+
+@activity_job("leaderboard")
+async def apply_leaderboard(payload, state):
+    await add_activities(payload["user_id"], [payload], payload.get("_id"))
+
+@activity_job("club_activity")
+async def apply_club_activity(payload, state):
+    await record_club_activity(payload)
+
+@activity_job("challenges")
+async def apply_challenges(payload, state):
+    await evaluate_activity(payload)
+
+@activity_job("image_variants")
+async def render_activity_images(payload, state):
+    image_variants, failed = [], 0
+    for key in payload["staged_keys"]:
+        try:
+            image_variants.append(await state.images.save_staged(key))
+        except FileNotFoundError:
+            # Already processed by an earlier run that died before the update
+            continue
+        except InvalidImage as e:
+            # POST /activities only checks headers, so a file that is broken further in ends up
+            # here; the activity keeps the images that did render and counts the rest as failed
+            logger.error(f"Staged upload {key} of activity {payload['activity_id']} is not a usable image: {e}")
+            failed += 1
+    if image_variants or failed:
+        activity = await activity_collection.find_one_and_update(
+            {"_id": payload["activity_id"]},
+            {"$set": {
+                "images": [variants["full"] for variants in image_variants],
+                "image_variants": image_variants,
+                "failed_images": failed,
+            }},
+            projection={"user_id": 1},
+        )
+        if activity:
+            await bump_versions(activity["user_id"], ACTIVITIES)
+    for key in payload["staged_keys"]:
+        await state.storage.discard_staged(key)
+
+@job_handler("notification")
+async def create_notification(payload, state):
+    try:
+        await notification_collection.insert_one({**payload, "created_at": datetime.utcnow()})
+    except DuplicateKeyError:
+        pass
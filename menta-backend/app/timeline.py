@@ -0,0 +1,106 @@
+import time
+from bson import ObjectId
+from decouple import config
+from pymongo.errors import BulkWriteError
+from app.database import user_collection, activity_collection, timeline_collection
+from app.pagination import DEFAULT_PAGE_SIZE, fetch_rows, cut_page
+from app.follows import following_among, iter_follower_ids
+from app.repository import ACTIVITY_CARD_PROJECTION
+
+# Authors with more followers than this are merged into readers' feeds at read time
+FANOUT_MAX_FOLLOWERS = config("FANOUT_MAX_FOLLOWERS", default=5000, cast=int)
+FANOUT_BATCH_SIZE = config("FANOUT_BATCH_SIZE", default=1000, cast=int)
+TIMELINE_BACKFILL_SIZE = config("TIMELINE_BACKFILL_SIZE", default=50, cast=int)
+HIGH_FANOUT_REFRESH_SECONDS = config("HIGH_FANOUT_REFRESH_SECONDS", default=60, cast=int)
+
+_high_fanout_authors = set()
+_high_fanout_loaded_at = 0.0
+
+def timeline_entry(owner_id: str, activity) -> dict:
+    return {
+        "owner_id": owner_id,
+        "activity_id": activity["_id"],
+        "author_id": activity["user_id"],
+        "created_at": activity["created_at"],
+    }
+
+async def _insert_entries(entries: list):
+    if not entries:
+        return
+    try:
+        await timeline_collection.insert_many(entries, ordered=False)
+    except BulkWriteError as e:
+        # Duplicate (owner_id, activity_id) pairs mean the entry is already there
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+
+async def fan_out_activity(activity):
+    author_id = activity["user_id"]
+    author = await user_collection.find_one({"_id": ObjectId(author_id)}, {"follower_count": 1, "high_fanout": 1})
+    high_fanout = author is not None and author.get("follower_count", 0) > FANOUT_MAX_FOLLOWERS
+    if author and author.get("high_fanout", False) != high_fanout:
+        if not high_fanout:
+            # Followers stop pulling this author's posts on read, so the recent ones go into their
+            # timelines first; a rerun after a crash here finds the flag still set and does it again
+            await backfill_followers(author_id)
+        await user_collection.update_one({"_id": author["_id"]}, {"$set": {"high_fanout": high_fanout}})
+        if high_fanout:
+            _high_fanout_authors.add(author_id)
+        else:
+            _high_fanout_authors.discard(author_id)
+
+    # The author always sees their own post; followers of high-fanout authors pull it on read
+    await _insert_entries([timeline_entry(author_id, activity)])
+    if high_fanout:
+        return
+    async for batch in iter_follower_ids(author_id, FANOUT_BATCH_SIZE):
+        await _insert_entries([timeline_entry(follower_id, activity) for follower_id in batch])
+
+async def recent_activities(author_id: str) -> list:
+    return await activity_collection.find({"user_id": author_id}, {"user_id": 1, "created_at": 1}) \
+        .sort([("created_at", -1), ("_id", -1)]) \
+        .limit(TIMELINE_BACKFILL_SIZE) \
+        .to_list(TIMELINE_BACKFILL_SIZE)
+
+async def backfill_timeline(owner_id: str, author_id: str):
+    await _insert_entries([timeline_entry(owner_id, activity) for activity in await recent_activities(author_id)])
+
+async def backfill_followers(author_id: str):
+    # The same backfill as a new follow gets, for every follower at once
+    activities = await recent_activities(author_id)
+    async for batch in iter_follower_ids(author_id, FANOUT_BATCH_SIZE):
+        await _insert_entries([timeline_entry(follower_id, activity) for follower_id in batch for activity in activities])
+
+async def remove_author_from_timeline(owner_id: str, author_id: str):
+    await timeline_collection.delete_many({"owner_id": owner_id, "author_id": author_id})
+
+async def get_high_fanout_authors() -> set:
+    global _high_fanout_authors, _high_fanout_loaded_at
+    if time.monotonic() - _high_fanout_loaded_at > HIGH_FANOUT_REFRESH_SECONDS:
+        authors = await user_collection.find({"high_fanout": True}, {"_id": 1}).to_list(None)
+        _high_fanout_authors = {str(author["_id"]) for author in authors}
+        _high_fanout_loaded_at = time.monotonic()
+    return _high_fanout_authors
+
+async def get_home_timeline(user_id: str, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    rows = await fetch_rows(timeline_collection, {"owner_id": user_id}, cursor, limit,
+                            {"activity_id": 1, "created_at": 1}, tie_field="activity_id")
+
+    high_fanout_authors = await get_high_fanout_authors()
+    pulled_authors = await following_among(user_id, high_fanout_authors) if high_fanout_authors else []
+    if pulled_authors:
+        pulled = await fetch_rows(activity_collection, {"user_id": {"$in": pulled_authors}}, cursor, limit,
+                                  {"created_at": 1})
+        merged = {row["activity_id"]: row for row in rows}
+        for activity in pulled:
+            merged.setdefault(activity["_id"], {"activity_id": activity["_id"], "created_at": activity["created_at"]})
+        rows = sorted(merged.values(), key=lambda row: (row["created_at"], row["activity_id"]), reverse=True)
+
+    rows, next_cursor = cut_page(rows, limit, tie_field="activity_id")
+    return await load_activities([row["activity_id"] for row in rows]), next_cursor
+
+async def load_activities(activity_ids: list) -> list:
+    # Cards for feed rows, in row order; rows whose activity has since been deleted are skipped
+    activities = await activity_collection.find({"_id": {"$in": activity_ids}}, ACTIVITY_CARD_PROJECTION).to_list(len(activity_ids))
+    by_id = {activity["_id"]: activity for activity in activities}
+    return [by_id[activity_id] for activity_id in activity_ids if activity_id in by_id]
@@ -0,0 +1,100 @@
+import hashlib
+from bson import ObjectId
+from decouple import config
+from fastapi import Request
+from fastapi.responses import Response
+from app.cache import TTLCache
+from app.database import user_collection
+
+# Each user document carries versions.<resource> counters that every write touching that
+# resource increments. They live in Mongo rather than in memory so that every process (and
+# the job workers) agree on them, and reading one is a primary-key lookup of a single field.
+PROFILE, ACTIVITIES, PROGRESS = "profile", "activities", "progress"
+
+# Rendered bodies per (user, resource): {"version": n, "views": {tag: {"etag", "body", "embeds"}}}
+response_cache = TTLCache(
+    maxsize=config("RESPONSE_CACHE_SIZE", default=5000, cast=int),
+    ttl=config("RESPONSE_CACHE_TTL", default=30, cast=int),
+)
+MAX_VIEWS_PER_RESOURCE = 16
+
+def version_increments(*resources) -> dict:
+    # For writes that already update the user document: merge into their $inc
+    return {f"versions.{resource}": 1 for resource in resources}
+
+def forget(user_id: str, *resources):
+    for resource in resources:
+        response_cache.pop((user_id, resource))
+
+async def bump_versions(user_id: str, *resources):
+    forget(user_id, *resources)
+    if ObjectId.is_valid(user_id):
+        await user_collection.update_one({"_id": ObjectId(user_id)}, {"$inc": version_increments(*resources)})
+
+async def resource_version(user_id: str, resource: str):
+    # None when there is no such user
+    if not ObjectId.is_valid(user_id):
+        return None
+    user = await user_collection.find_one({"_id": ObjectId(user_id)}, {f"versions.{resource}": 1})
+    if user is None:
+        return None
+    return user.get("versions", {}).get(resource, 0)
+
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    return header is not None and (header.strip() == "*" or etag in (tag.strip() for tag in header.split(",")))
+
+def body_etag(body: bytes) -> str:
+    return f'W/"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+def etag_response(request: Request, etag: str, body: bytes = None) -> Response:
+    # no-cache: clients may store the body but must revalidate, which is the cheap path here
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if body is None or not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+async def embedded_digest(user_ids) -> str:
+    # Digest of the profile versions of the other users a body embeds (e.g. commenters)
+    ids = sorted(ObjectId(user_id) for user_id in user_ids if ObjectId.is_valid(user_id))
+    if not ids:
+        return ""
+    users = await user_collection.find({"_id": {"$in": ids}}, {"versions.profile": 1}).to_list(len(ids))
+    versions = sorted(f'{user["_id"]}:{user.get("versions", {}).get(PROFILE, 0)}' for user in users)
+    return hashlib.blake2b(",".join(versions).encode(), digest_size=6).hexdigest()
+
+async def versioned_response(request: Request, user_id: str, resource: str, build, salt: str = "", embeds: set = None):
+    # build() renders the response (a ModelResponse) and only runs on a cache miss.
+    # salt covers anything besides the version that changes the body (e.g. today's date).
+    # embeds is a set build() fills with the ids of the other users whose profiles the body
+    # shows; their profile versions join the validator, so their renames reach it too.
+    version = await resource_version(user_id, resource)
+    if version is None:
+        return await build()
+    tag = f'{resource}-{user_id}-{version}-{hashlib.blake2b((request.url.query + salt).encode(), digest_size=6).hexdigest()}'
+    key = (user_id, resource)
+    cached = response_cache.get(key)
+    if cached is not None and cached["version"] != version:
+        cached = None
+    view = cached["views"].get(tag) if cached is not None else None
+
+    if embeds is None:
+        etag = f'W/"{tag}"'
+        if not_modified(request, etag):
+            return etag_response(request, etag)
+        if view is not None:
+            return etag_response(request, etag, view["body"])
+    elif view is not None:
+        # Without a rendered view there is no knowing whom the body embeds, so only a view can answer
+        etag = f'W/"{tag}-{await embedded_digest(view["embeds"])}"'
+        if etag == view["etag"]:
+            return etag_response(request, etag, view["body"])
+
+    response = await build()
+    if embeds is not None:
+        etag = f'W/"{tag}-{await embedded_digest(embeds)}"'
+    if response.status_code == 200:
+        views = cached["views"] if cached is not None and len(cached["views"]) < MAX_VIEWS_PER_RESOURCE else {}
+        views[tag] = {"etag": etag, "body": response.body, "embeds": frozenset(embeds or ())}
+        response_cache.set(key, {"version": version, "views": views})
+    return etag_response(request, etag, response.body)
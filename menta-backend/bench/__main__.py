@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Usage, from menta-backend/:
+#   python -m bench run [--mongo-url mongodb://localhost:27017 --reset] [--users 500 ...]
+#   python -m bench run --mongo-url mongodb://localhost:27017 --reset --scenarios leaderboards
+#   python -m bench compare bench/results/<old>.json bench/results/<new>.json
+
+# The in-memory stand-in scans every document on each write (unique and TTL checks), so seeding
+# is quadratic there; board-size results only mean something against a real mongod
+STAND_IN_LEADERBOARD_USERS = 200
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def sample_image() -> bytes:
+    # A phone-sized JPEG, so uploads exercise staging and the derivative jobs realistically
+    from PIL import Image
+    image = Image.radial_gradient("L").resize((2400, 1800)).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+async def run(args) -> dict:
+    from bench.harness import Recorder, running_app
+    from bench.scenarios import SCENARIOS
+    from bench.seed import seed, seed_leaderboards
+    from app.auth import create_access_token
+    from app.database import client as mongo_client
+
+    if args.mongo_url:
+        await mongo_client.drop_database("menta")
+
+    async with running_app() as client:
+        started = time.perf_counter()
+        world = await seed(args.users, args.follow_degree, args.activities, args.comments, args.seed)
+        if "leaderboards" in args.scenarios:
+            world["counts"].update(await seed_leaderboards(world["user_ids"], args.leaderboard_users, seed_value=args.seed))
+        seed_seconds = time.perf_counter() - started
+        world["tokens"] = {
+            user_id: create_access_token({"sub": email}, timedelta(hours=2))
+            for user_id, email in zip(world["user_ids"], world["emails"])
+        }
+        world["image"] = sample_image()
+        world["stand_in"] = args.mongo_url is None
+
+        results = {}
+        for name in args.scenarios:
+            recorder = Recorder()
+            await SCENARIOS[name](client, world, recorder, args.concurrency, args.iterations)
+            results[name] = recorder.summary()
+            print(f"{name}: {results[name]['seconds']}s", file=sys.stderr)
+
+    return {
+        "commit": current_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "stand_in": args.mongo_url is None,
+        "config": {
+            "users": args.users, "follow_degree": args.follow_degree, "activities_per_user": args.activities,
+            "comments_per_activity": args.comments, "concurrency": args.concurrency, "iterations": args.iterations,
+            "seed": args.seed, "leaderboard_users": args.leaderboard_users,
+        },
+        "seeded": world["counts"],
+        "seed_seconds": round(seed_seconds, 3),
+        "scenarios": results,
+    }
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> bool:
+    # Prints per-route percentile changes; True if any p95 got slower by more than threshold
+    regressed = False
+    for scenario, result in candidate["scenarios"].items():
+        old_routes = baseline["scenarios"].get(scenario, {}).get("routes", {})
+        for route, stats in result["routes"].items():
+            old = old_routes.get(route)
+            if old is None:
+                print(f"{scenario} {route}: new")
+                continue
+            changes = []
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                change = (stats[key] - old[key]) / old[key] if old[key] else 0.0
+                changes.append(f"{key[:3]} {old[key]:.1f} -> {stats[key]:.1f} ({change:+.0%})")
+                if key == "p95_ms" and change > threshold:
+                    regressed = True
+            print(f"{scenario} {route}: " + ", ".join(changes))
+    return regressed
+
+def main():
+    from bench.scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Offline load test for the Menta API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="seed a synthetic population and run scenarios")
+    run_parser.add_argument("--mongo-url", help="real mongod to use instead of the in-memory stand-in")
+    run_parser.add_argument("--reset", action="store_true", help="allow dropping the menta database at --mongo-url")
+    run_parser.add_argument("--users", type=int, default=200)
+    run_parser.add_argument("--follow-degree", type=int, default=20)
+    run_parser.add_argument("--activities", type=int, default=10, help="activities per user")
+    run_parser.add_argument("--comments", type=int, default=2, help="comments per activity")
+    run_parser.add_argument("--leaderboard-users", type=int, default=1000000,
+                            help="synthetic entrants per leaderboard on top of --users (needs --mongo-url beyond a few hundred)")
+    run_parser.add_argument("--concurrency", type=int, default=20)
+    run_parser.add_argument("--iterations", type=int, default=10)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--scenarios", type=lambda value: value.split(","), default=list(SCENARIOS))
+    run_parser.add_argument("--output", help="defaults to bench/results/<commit>.json")
+
+    compare_parser = commands.add_parser("compare", help="diff two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="allowed p95 slowdown before failing")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        with open(args.baseline) as baseline, open(args.candidate) as candidate:
+            sys.exit(1 if compare(json.load(baseline), json.load(candidate), args.threshold) else 0)
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if args.mongo_url and not args.reset:
+        parser.error("--mongo-url wipes the menta database there; pass --reset to confirm")
+
+    if args.mongo_url is None and args.leaderboard_users > STAND_IN_LEADERBOARD_USERS:
+        print(f"--leaderboard-users capped at {STAND_IN_LEADERBOARD_USERS} without --mongo-url", file=sys.stderr)
+        args.leaderboard_users = STAND_IN_LEADERBOARD_USERS
+
+    from bench.harness import configure_environment
+    configure_environment(args.mongo_url)
+    result = asyncio.run(run(args))
+
+    output = args.output or os.path.join(os.path.dirname(__file__), "results", f"{result['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as destination:
+        json.dump(result, destination, indent=2)
+    print(output)
+
+if __name__ == "__main__":
+    main()
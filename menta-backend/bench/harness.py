@@ -0,0 +1,78 @@
+import os
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+def configure_environment(mongo_url: str = None):
+    # Must run before anything under app/ is imported: settings are read at import time
+    scratch = tempfile.mkdtemp(prefix="menta-bench-")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    os.environ["MONGO_DETAILS"] = mongo_url or "mongodb://stand-in"
+    # The local backend stands in for S3: same Storage interface, files under a scratch dir
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["UPLOADS_DIR"] = os.path.join(scratch, "uploads")
+    os.environ["STAGING_DIR"] = os.path.join(scratch, "staging")
+    os.makedirs(os.environ["UPLOADS_DIR"], exist_ok=True)
+    if mongo_url is None:
+        import motor.motor_asyncio
+        from mongomock_motor import AsyncMongoMockClient
+
+        class StandInClient(AsyncMongoMockClient):
+            # Accepts (and ignores) the pool/TLS options app.database passes to Motor
+            def __init__(self, *args, **kwargs):
+                super().__init__()
+
+        motor.motor_asyncio.AsyncIOMotorClient = StandInClient
+    return scratch
+
+@asynccontextmanager
+async def running_app():
+    # The app runs in-process behind an ASGI transport, with its real lifespan
+    import httpx
+    from app.main import app
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+
+    async def request(self, client, method: str, route: str, url: str, **kwargs):
+        # route is the template ("/activities/{id}/comments") so samples group per endpoint
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.samples[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+    async def call(self, route: str, awaitable):
+        # For work below the HTTP layer, such as a job handler run directly
+        started = time.perf_counter()
+        result = await awaitable
+        self.samples[route].append(time.perf_counter() - started)
+        return result
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            routes[route] = {
+                "count": len(ordered),
+                "errors": self.errors[route],
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+                "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+                "throughput_rps": round(len(ordered) / elapsed, 1),
+            }
+        return {"seconds": round(elapsed, 3), "routes": routes}
@@ -0,0 +1,99 @@
+import asyncio
+import io
+import random
+from bench.seed import PASSWORD
+
+# Each scenario runs `concurrency` virtual users in parallel, each doing `iterations` rounds
+
+async def run_users(concurrency: int, iterations: int, round_):
+    async def virtual_user(worker: int):
+        rng = random.Random(worker)
+        for iteration in range(iterations):
+            await round_(rng, worker, iteration)
+    await asyncio.gather(*(virtual_user(worker) for worker in range(concurrency)))
+
+def auth(world, user_id: str) -> dict:
+    return {"Authorization": f"Bearer {world['tokens'][user_id]}"}
+
+async def login_storm(client, world, recorder, concurrency, iterations):
+    # Real bcrypt at BCRYPT_ROUNDS: this is the hashing pool under contention
+    async def round_(rng, worker, iteration):
+        email = rng.choice(world["emails"])
+        await recorder.request(client, "POST", "/token", "/token", data={"username": email, "password": PASSWORD})
+    await run_users(concurrency, iterations, round_)
+
+async def feed_scroll(client, world, recorder, concurrency, iterations, pages: int = 5):
+    async def round_(rng, worker, iteration):
+        headers = auth(world, rng.choice(world["user_ids"]))
+        cursor = None
+        for _ in range(pages):
+            params = {"cursor": cursor} if cursor else {}
+            response = await recorder.request(client, "GET", "/feed", "/feed", params=params, headers=headers)
+            cursor = response.json().get("next_cursor") if response.status_code == 200 else None
+            if not cursor:
+                break
+    await run_users(concurrency, iterations, round_)
+
+async def activity_upload(client, world, recorder, concurrency, iterations, images: int = 2):
+    form = {
+        "title": "Bench upload", "description": "Uploaded by the benchmark", "activity": "reading",
+        "date": "2024-06-01", "start_time": "08:30", "duration": "1800", "private_notes": "Benchmark run",
+        "privacy_type": "public", "perceived_performance": "4",
+    }
+
+    async def round_(rng, worker, iteration):
+        headers = auth(world, rng.choice(world["user_ids"]))
+        files = [("files", (f"photo{n}.jpg", io.BytesIO(world["image"]), "image/jpeg")) for n in range(images)]
+        await recorder.request(client, "POST", "/activities", "/activities", data=form, files=files, headers=headers)
+    await run_users(concurrency, iterations, round_)
+
+async def comment_burst(client, world, recorder, concurrency, iterations):
+    # Everyone piles onto the same few activities, then reads the thread back
+    hot = world["activity_ids"][:3]
+
+    async def round_(rng, worker, iteration):
+        headers = auth(world, rng.choice(world["user_ids"]))
+        activity_id = rng.choice(hot)
+        route = "/activities/{activity_id}/comments"
+        await recorder.request(client, "POST", route, f"/activities/{activity_id}/comments",
+                               json={"user_id": "", "text": f"Burst {worker}-{iteration}", "timestamp": "2024-01-01T00:00:00"},
+                               headers=headers)
+        await recorder.request(client, "GET", route, f"/activities/{activity_id}/comments", headers=headers)
+    await run_users(concurrency, iterations, round_)
+
+async def progress_dashboard(client, world, recorder, concurrency, iterations):
+    async def round_(rng, worker, iteration):
+        user_id = rng.choice(world["user_ids"])
+        headers = auth(world, user_id)
+        await recorder.request(client, "GET", "/progress/{user_id}", f"/progress/{user_id}", headers=headers)
+        await recorder.request(client, "GET", "/activities/user/{user_id}", f"/activities/user/{user_id}", headers=headers)
+        # The in-memory stand-in has no $dateFromString, so stats only run against a real mongod
+        if not world["stand_in"]:
+            await recorder.request(client, "GET", "/stats/{user_id}", f"/stats/{user_id}", params={"bucket": "week"}, headers=headers)
+    await run_users(concurrency, iterations, round_)
+
+async def leaderboards(client, world, recorder, concurrency, iterations, activity: str = "reading"):
+    # Reads of both scopes and periods, plus the job-side update that runs for every new activity.
+    # Ranks for users outside the top N go through the rank counters, whatever the board size.
+    from datetime import datetime
+    from app.leaderboards import add_activities
+    route = "/leaderboards/{activity}"
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+
+    async def round_(rng, worker, iteration):
+        user_id = rng.choice(world["user_ids"])
+        headers = auth(world, user_id)
+        for params in ({}, {"scope": "following"}, {"period": "month"}):
+            await recorder.request(client, "GET", route, f"/leaderboards/{activity}", params=params, headers=headers)
+        session = {"activity": activity, "date": today, "duration": rng.randint(10, 120) * 60}
+        await recorder.call("leaderboard job", add_activities(user_id, [session]))
+    await run_users(concurrency, iterations, round_)
+
+SCENARIOS = {
+    "login_storm": login_storm,
+    "feed_scroll": feed_scroll,
+    "activity_upload": activity_upload,
+    "comment_burst": comment_burst,
+    "progress_dashboard": progress_dashboard,
+    "leaderboards": leaderboards,
+}
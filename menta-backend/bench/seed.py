@@ -0,0 +1,153 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+ACTIVITY_TYPES = ["reading", "coding", "studying", "writing", "chess", "language"]
+PASSWORD = "bench-password"
+
+async def seed(users: int, follow_degree: int, activities_per_user: int, comments_per_activity: int, seed_value: int = 1) -> dict:
+    # Writes straight to the collections in bulk; going through the API would benchmark the seeding
+    from app.auth import pwd_context
+    from app.crud import prepare_activity
+    from app.importer import progress_operations
+    from app.database import (
+        user_collection, activity_collection, comment_collection, follow_collection,
+        timeline_collection, progress_collection, progress_daily_collection, name_token_collection,
+    )
+    from app.directory import name_token_entries, search_fields
+    from app.database import TIMELINE_TTL_DAYS
+    from app.timeline import timeline_entry
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow().replace(microsecond=0)
+    # One hash for everybody: bcrypt at the real cost would dominate seeding time
+    hashed_password = pwd_context.hash(PASSWORD)
+
+    user_docs = []
+    for n in range(users):
+        first_name, last_name = f"Bench{n}", rng.choice(["Lovelace", "Turing", "Hopper", "Knuth", "Noether"])
+        user_docs.append({
+            "_id": ObjectId(),
+            "first_name": first_name,
+            "last_name": last_name,
+            "email": f"bench{n}@example.com",
+            "hashed_password": hashed_password,
+            "interests": rng.sample(ACTIVITY_TYPES, 2),
+            "created_at": now - timedelta(days=users - n),
+            "updated_at": now,
+            "follower_count": 0,
+            "following_count": 0,
+            **search_fields(first_name, last_name, "Bench City"),
+        })
+    user_ids = [str(user["_id"]) for user in user_docs]
+    by_id = {str(user["_id"]): user for user in user_docs}
+
+    followers = {user_id: [] for user_id in user_ids}
+    edges = []
+    for index, follower_id in enumerate(user_ids):
+        # Sample among the other users: positions at or past our own shift up by one
+        for pick in rng.sample(range(users - 1), min(follow_degree, users - 1)):
+            followee_id = user_ids[pick + (pick >= index)]
+            edges.append({"follower_id": follower_id, "followee_id": followee_id, "created_at": now})
+            followers[followee_id].append(follower_id)
+            by_id[followee_id]["follower_count"] += 1
+            by_id[follower_id]["following_count"] += 1
+    await user_collection.insert_many(user_docs)
+    await name_token_collection.insert_many([
+        entry for user in user_docs for entry in name_token_entries(user["_id"], user["name_tokens"])
+    ])
+    if edges:
+        await follow_collection.insert_many(edges)
+
+    activities, comments, entries = [], [], []
+    daily, summary = [], []
+    for user_id in user_ids:
+        own = []
+        for n in range(activities_per_user):
+            # Kept inside the timeline TTL window, or the seeded feeds would expire on arrival
+            created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * (TIMELINE_TTL_DAYS - 2)))
+            activity = prepare_activity({
+                "_id": ObjectId(),
+                "title": f"Session {n}",
+                "description": "Synthetic benchmark activity",
+                "activity": rng.choice(ACTIVITY_TYPES),
+                "date": created_at.strftime("%Y-%m-%d"),
+                "start_time": "09:00",
+                "duration": rng.randint(10, 180) * 60,
+                "private_notes": None,
+                "privacy_type": "public",
+                "perceived_performance": rng.randint(1, 5),
+                "images": [],
+            }, user_id, created_at)
+            activity["comments_preview"] = []
+            activity["comment_count"] = comments_per_activity
+            for c in range(comments_per_activity):
+                comment = {
+                    "_id": ObjectId(),
+                    "activity_id": activity["_id"],
+                    "user_id": rng.choice(user_ids),
+                    "text": f"Comment {c}",
+                    "timestamp": created_at + timedelta(minutes=c + 1),
+                }
+                comments.append(comment)
+                activity["comments_preview"].append({key: comment[key] for key in ("user_id", "text", "timestamp")})
+            activity["comments_preview"] = activity["comments_preview"][-3:]
+            own.append(activity)
+            entries.extend(timeline_entry(owner_id, activity) for owner_id in [user_id] + followers[user_id])
+        activities.extend(own)
+        user_daily, user_summary = progress_operations(user_id, own, now)
+        daily.extend(user_daily)
+        summary.extend(user_summary)
+    if activities:
+        await activity_collection.insert_many(activities)
+        await progress_daily_collection.bulk_write(daily, ordered=False)
+        await progress_collection.bulk_write(summary, ordered=True)
+    if comments:
+        await comment_collection.insert_many(comments)
+    if entries:
+        await timeline_collection.insert_many(entries, ordered=False)
+
+    return {
+        "user_ids": user_ids,
+        "emails": [user["email"] for user in user_docs],
+        "activity_ids": [str(activity["_id"]) for activity in activities],
+        "counts": {
+            "users": len(user_docs),
+            "follows": len(edges),
+            "activities": len(activities),
+            "comments": len(comments),
+            "timeline_entries": len(entries),
+        },
+    }
+
+async def seed_leaderboards(user_ids: list, extra_users: int, activity: str = "reading", seed_value: int = 1) -> dict:
+    # This week's and this month's boards for one activity: every seeded user plus extra_users
+    # synthetic entrants, so rank queries can be measured at scale without that many accounts.
+    # Rank counters are built in one pass from the score histogram rather than per entry.
+    from app.database import leaderboard_collection, leaderboard_rank_collection
+    from app.leaderboards import PERIODS, board_key, expires_at, node_id, position, update_nodes
+
+    rng = random.Random(seed_value)
+    today = datetime.utcnow().date()
+    entrants = user_ids + [str(ObjectId()) for _ in range(extra_users)]
+    counts = {}
+    for period in PERIODS:
+        board, expires = board_key(period, activity, today), expires_at(period, today)
+        # Most people log a little, a few log a lot
+        scores = [int(rng.paretovariate(1.5) * 1200) for _ in entrants]
+        await leaderboard_collection.insert_many(
+            ({"board": board, "user_id": user_id, "seconds": seconds, "expires_at": expires} for user_id, seconds in zip(entrants, scores)),
+            ordered=False,
+        )
+        tree = Counter()
+        for index, users in Counter(position(seconds) for seconds in scores).items():
+            for node in update_nodes(index):
+                tree[node] += users
+        await leaderboard_rank_collection.insert_many(
+            ({"_id": node_id(board, node), "count": users, "expires_at": expires} for node, users in tree.items()),
+            ordered=False,
+        )
+        counts[f"leaderboard_{period}_entries"] = len(entrants)
+        counts[f"leaderboard_{period}_rank_counters"] = len(tree)
+    return counts
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+# app.database and friends read their settings at import time, so the environment and the
+# Mongo client are set up before anything from app is imported
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("MONGO_DETAILS", "mongodb://localhost")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("STORAGE_BACKEND", "local")
+os.environ.setdefault("UPLOADS_DIR", tempfile.mkdtemp())
+os.environ.setdefault("STAGING_DIR", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import motor.motor_asyncio
+import mongomock_motor
+
+class MockClient(mongomock_motor.AsyncMongoMockClient):
+    # An in-memory Mongo; it takes none of the pool and TLS options app.database passes
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+
+motor.motor_asyncio.AsyncIOMotorClient = MockClient
+
+import pytest
+from fastapi.testclient import TestClient
+from app.auth import principal_cache
+from app.database import client as mongo_client, ensure_indexes
+from app.loaders import summary_cache
+from app.stats import stats_cache
+from app.versions import response_cache
+
+async def reset_database():
+    await mongo_client.drop_database("menta")
+    await ensure_indexes()
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    asyncio.run(reset_database())
+    for cache in (principal_cache, summary_cache, stats_cache, response_cache):
+        cache.clear()
+
+@pytest.fixture
+def client():
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def register(client):
+    # register(email) -> (the new user's JSON, auth headers for them)
+    def register(email: str):
+        response = client.post("/register", json={
+            "first_name": "Test", "last_name": "User", "email": email, "password": "password",
+            "dob": "2000-01-01", "interests": ["reading"],
+        })
+        assert response.status_code == 200, response.text
+        token = client.post("/token", data={"username": email, "password": "password"}).json()["access_token"]
+        return response.json(), {"Authorization": f"Bearer {token}"}
+    return register
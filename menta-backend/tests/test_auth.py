@@ -0,0 +1,53 @@
+import asyncio
+from app import auth
+from app.auth import get_current_user, invalidate_user, principal_cache
+from app.cache import TTLCache
+from app.database import user_collection
+
+def current_user(token: str):
+    return asyncio.run(get_current_user(token))
+
+def rename(email: str, first_name: str):
+    asyncio.run(user_collection.update_one({"email": email}, {"$set": {"first_name": first_name}}))
+
+def token_of(headers: dict) -> str:
+    return headers["Authorization"].split()[1]
+
+def test_invalidating_a_user_drops_their_cached_principals(client, register):
+    user, headers = register("cached@example.com")
+    token = token_of(headers)
+    assert current_user(token).first_name == "Test"
+    rename("cached@example.com", "Renamed")
+    # Still the cached principal until the user is invalidated
+    assert current_user(token).first_name == "Test"
+    invalidate_user(user["id"])
+    assert current_user(token).first_name == "Renamed"
+    assert len(principal_cache) == 1
+
+def test_invalidation_marks_stay_bounded(client, register, monkeypatch):
+    monkeypatch.setattr(auth, "_invalidated", TTLCache(maxsize=3, ttl=60))
+    user, headers = register("bounded@example.com")
+    token = token_of(headers)
+    current_user(token)
+    rename("bounded@example.com", "Renamed")
+    invalidate_user(user["id"])
+    # Marks for other users fill the cache; the overflow clears principals rather than the mark alone
+    for n in range(10):
+        invalidate_user(f"someone-{n}")
+        assert len(auth._invalidated) <= 3
+    assert current_user(token).first_name == "Renamed"
+
+def test_marks_expire_with_the_principals_they_guard(client, register, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now[0])
+    monkeypatch.setattr(auth, "_invalidated", TTLCache(maxsize=10, ttl=principal_cache.ttl))
+    user, headers = register("expiring@example.com")
+    token = token_of(headers)
+    current_user(token)
+    invalidate_user(user["id"])
+    now[0] += principal_cache.ttl + 1
+    assert auth._invalidated.get(user["id"]) is None
+    # The principal cached before the mark expired along with it, so nothing stale is left
+    assert principal_cache.get(token) is None
+    rename("expiring@example.com", "Renamed")
+    assert current_user(token).first_name == "Renamed"
@@ -0,0 +1,114 @@
+import asyncio
+from datetime import date, timedelta
+from bson import ObjectId
+from app.challenges import create_challenge, evaluate_activity, join_challenge
+from app.database import challenge_collection, challenge_participant_collection, notification_collection
+
+TODAY = date.today()
+
+def day(offset: int) -> str:
+    return (TODAY + timedelta(days=offset)).isoformat()
+
+def activity(user_id: str, offset: int, duration: int = 600, kind: str = "reading") -> dict:
+    return {"_id": ObjectId(), "user_id": user_id, "activity": kind, "date": day(offset), "duration": duration}
+
+def challenge_data(goal: str, target: int, activity_type="Reading", starts: int = -10, ends: int = 10) -> dict:
+    return {"title": f"{goal} {target}", "activity": activity_type, "goal": goal, "target": target, "starts": day(starts), "ends": day(ends)}
+
+async def participation(challenge, user_id: str):
+    return await challenge_participant_collection.find_one({"challenge_id": str(challenge["_id"]), "user_id": user_id})
+
+def test_streak_goals_restart_after_a_gap():
+    user_id = str(ObjectId())
+
+    async def scenario():
+        challenge, _ = await create_challenge(user_id, challenge_data("streak_days", 3))
+        steps = []
+        # Two days in a row, a second session the same day, a missed day, then three in a row
+        for offset in (-6, -5, -5, -3, -2):
+            completed = await evaluate_activity(activity(user_id, offset))
+            participant = await participation(challenge, user_id)
+            steps.append((participant["streak"], participant["best_streak"], completed))
+        # A back-dated session inside the current run neither breaks nor extends it
+        await evaluate_activity(activity(user_id, -8))
+        back_dated = await participation(challenge, user_id)
+        finishing = activity(user_id, -1)
+        completed = await evaluate_activity(finishing)
+        return challenge, steps, back_dated, finishing, completed, await participation(challenge, user_id)
+
+    challenge, steps, back_dated, finishing, completed, participant = asyncio.run(scenario())
+    assert steps == [(1, 1, []), (2, 2, []), (2, 2, []), (1, 2, []), (2, 2, [])]
+    assert (back_dated["streak"], back_dated["best_streak"], back_dated["completed_at"]) == (2, 2, None)
+    assert completed == [str(challenge["_id"])]
+    assert participant["streak"] == 3 and participant["best_streak"] == 3 and participant["completed_by"] == finishing["_id"]
+    assert participant["sessions"] == 7
+
+def test_session_goals_complete_once_and_stop_counting():
+    user_id = str(ObjectId())
+
+    async def scenario():
+        challenge, _ = await create_challenge(user_id, challenge_data("sessions", 2))
+        results = [await evaluate_activity(activity(user_id, offset)) for offset in (-2, -1, 0)]
+        return challenge, results, await participation(challenge, user_id), await challenge_collection.find_one({"_id": challenge["_id"]})
+
+    challenge, results, participant, stored = asyncio.run(scenario())
+    assert results == [[], [str(challenge["_id"])], []]
+    # A completed participation is no longer matched, so later sessions don't move it
+    assert participant["sessions"] == 2 and participant["seconds"] == 1200
+    assert stored["completion_count"] == 1
+
+def test_activities_outside_the_window_do_not_count():
+    user_id = str(ObjectId())
+
+    async def scenario():
+        challenge, _ = await create_challenge(user_id, challenge_data("total_seconds", 1000, starts=-2, ends=2))
+        for offset in (-3, 3):
+            await evaluate_activity(activity(user_id, offset, duration=5000))
+        before = await participation(challenge, user_id)
+        # The first and last day are inside the window
+        for offset in (-2, 2):
+            await evaluate_activity(activity(user_id, offset, duration=400))
+        return before, await participation(challenge, user_id)
+
+    before, after = asyncio.run(scenario())
+    assert before["seconds"] == 0 and before["sessions"] == 0
+    assert after["seconds"] == 800 and after["sessions"] == 2 and after["completed_at"] is None
+
+def test_only_matching_activity_types_count():
+    user_id, other_id = str(ObjectId()), str(ObjectId())
+
+    async def scenario():
+        reading, _ = await create_challenge(user_id, challenge_data("sessions", 5, activity_type="Reading"))
+        anything, _ = await create_challenge(user_id, challenge_data("sessions", 5, activity_type=None))
+        # Someone else's reading session counts for neither of this user's participations
+        await join_challenge(reading, other_id)
+        for kind in ("chess", " reading ", "READING"):
+            await evaluate_activity(activity(user_id, 0, kind=kind))
+        await evaluate_activity(activity(other_id, 0, kind="chess"))
+        return (
+            await participation(reading, user_id), await participation(anything, user_id), await participation(reading, other_id),
+        )
+
+    reading, anything, other = asyncio.run(scenario())
+    assert reading["activity_key"] == "reading" and reading["sessions"] == 2
+    assert anything["activity_key"] == "*" and anything["sessions"] == 3
+    assert other["sessions"] == 0
+
+def test_replaying_the_completing_activity_records_it_once():
+    user_id = str(ObjectId())
+
+    async def scenario():
+        challenge, _ = await create_challenge(user_id, challenge_data("total_seconds", 600))
+        finishing = activity(user_id, 0)
+        results = [await evaluate_activity(dict(finishing)) for _ in range(3)]
+        return (
+            challenge, finishing, results, await participation(challenge, user_id),
+            await challenge_collection.find_one({"_id": challenge["_id"]}),
+            await notification_collection.find({"kind": "challenge"}).to_list(None),
+        )
+
+    challenge, finishing, results, participant, stored, notices = asyncio.run(scenario())
+    assert results == [[str(challenge["_id"])]] * 3
+    assert participant["seconds"] == 600 and participant["sessions"] == 1
+    assert stored["completion_count"] == 1
+    assert len(notices) == 1 and notices[0]["activity_id"] == finishing["_id"] and notices[0]["challenge_id"] == str(challenge["_id"])
@@ -0,0 +1,85 @@
+import asyncio
+import itertools
+from datetime import date
+from bson import ObjectId
+from app import clubs
+from app.clubs import (
+    TOTAL, add_counts, create_club, get_club, get_club_totals, join_club, leave_club, read_counts, record_club_activity,
+    week_bucket,
+)
+from app.crud import utcnow
+from app.database import club_counter_collection, club_member_collection, user_collection
+
+async def new_user(name: str) -> str:
+    result = await user_collection.insert_one({"first_name": name, "last_name": "Reader", "email": f"{name.lower()}@example.com", "clubs": []})
+    return str(result.inserted_id)
+
+def test_counts_spread_over_shards_and_sum_back(monkeypatch):
+    shards = itertools.cycle(range(4))
+    monkeypatch.setattr(clubs.random, "randrange", lambda n: next(shards))
+
+    async def scenario():
+        for seconds in (60, 120, 180, 240, 300, 360):
+            await add_counts("club-a", "2024-W03", seconds=seconds, sessions=1)
+        await add_counts("club-b", "2024-W03", seconds=1000, sessions=1)
+        await add_counts("club-a", TOTAL, members=1)
+        return (
+            await club_counter_collection.count_documents({"club_id": "club-a", "bucket": "2024-W03"}),
+            await read_counts(["club-a", "club-b", "club-c"], "2024-W03"),
+            await read_counts(["club-a"], TOTAL),
+        )
+
+    shard_count, weekly, members = asyncio.run(scenario())
+    assert shard_count == 4
+    assert weekly["club-a"] == {"seconds": 1260, "sessions": 6}
+    assert weekly["club-b"] == {"seconds": 1000, "sessions": 1}
+    assert "club-c" not in weekly
+    assert members["club-a"] == {"members": 1}
+
+def test_member_counts_follow_joins_and_leaves():
+    async def scenario():
+        owner, reader = await new_user("Owner"), await new_user("Member")
+        club = await create_club(owner, {"name": "Readers", "activity": "Reading"})
+        club_id = str(club["_id"])
+        joined, joined_again = await join_club(club_id, reader), await join_club(club_id, reader)
+        after_join = await get_club(club_id, reader)
+        left, left_again = await leave_club(club_id, reader), await leave_club(club_id, reader)
+        after_leave = await get_club(club_id, reader)
+        edge = await club_member_collection.find_one({"club_id": club_id, "user_id": owner})
+        return club, joined, joined_again, after_join, left, left_again, after_leave, edge, await user_collection.find_one({"_id": ObjectId(reader)})
+
+    club, joined, joined_again, after_join, left, left_again, after_leave, edge, reader = asyncio.run(scenario())
+    assert (joined, joined_again, left, left_again) == (True, False, True, False)
+    assert after_join[1:] == (2, True) and after_leave[1:] == (1, False)
+    assert reader["clubs"] == []
+    # Timestamps are stored at BSON precision, so the in-memory club matches what is read back
+    assert club["created_at"].microsecond % 1000 == 0 and edge["created_at"].microsecond % 1000 == 0
+
+def test_weekly_totals_only_count_matching_sessions():
+    today = date.today()
+
+    def activity(user_id: str, kind: str, duration: int):
+        return {
+            "_id": ObjectId(), "user_id": user_id, "activity": kind, "date": today.isoformat(),
+            "duration": duration, "created_at": utcnow(),
+        }
+
+    async def scenario():
+        owner, reader = await new_user("Owner"), await new_user("Member")
+        readers = await create_club(owner, {"name": "Readers", "activity": "Reading"})
+        anything = await create_club(owner, {"name": "Anything", "activity": None})
+        await join_club(str(readers["_id"]), reader)
+        for entry in (activity(owner, "reading", 600), activity(reader, "Reading ", 1200), activity(owner, "running", 300)):
+            await record_club_activity(entry)
+        return (
+            await get_club_totals(str(readers["_id"]), today),
+            await get_club_totals(str(anything["_id"]), today),
+            await read_counts([str(readers["_id"])], week_bucket(today)),
+            reader,
+        )
+
+    readers, anything, weekly, reader = asyncio.run(scenario())
+    assert readers["members"] == 2 and readers["seconds"] == 1800 and readers["sessions"] == 2
+    assert [contributor["user_id"] for contributor in readers["top_contributors"]][0] == reader
+    assert anything["members"] == 1 and anything["seconds"] == 900 and anything["sessions"] == 2
+    assert list(weekly.values())[0]["seconds"] == 1800
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app.crud import add_comment_to_activity, migrate_embedded_comments
+from app.database import activity_collection, comment_collection
+
+def legacy_activity(user_id: str, comments: int) -> dict:
+    start = datetime(2023, 5, 1, 12)
+    return {
+        "_id": ObjectId(), "user_id": user_id, "title": "Reading", "description": "", "activity": "reading",
+        "date": "2023-05-01", "start_time": "12:00", "end_time": "13:00", "duration": 3600, "privacy_type": "public",
+        "created_at": start, "updated_at": start,
+        "comments": [
+            {"user_id": user_id, "text": f"comment {n}", "timestamp": start + timedelta(minutes=n)} for n in range(comments)
+        ],
+    }
+
+def test_embedded_comments_move_to_the_comments_collection(client, register):
+    user, headers = register("legacy@example.com")
+    activity = legacy_activity(user["id"], 5)
+    quiet = legacy_activity(user["id"], 0)
+
+    async def scenario():
+        await activity_collection.insert_many([activity, quiet])
+        # A comment added after the switch, before the backfill ran
+        await add_comment_to_activity(str(activity["_id"]), {"user_id": user["id"], "text": "new"})
+        # A previous run copied the comments, then died before updating the activity
+        await comment_collection.insert_one({"activity_id": activity["_id"], "user_id": user["id"], "text": "comment 0",
+                                             "timestamp": activity["comments"][0]["timestamp"], "migrated": True})
+        await migrate_embedded_comments()
+        await migrate_embedded_comments()
+        return await activity_collection.find_one({"_id": activity["_id"]}), await activity_collection.find_one({"_id": quiet["_id"]})
+
+    stored, stored_quiet = asyncio.run(scenario())
+    assert "comments" not in stored and "comments" not in stored_quiet
+    assert stored["comment_count"] == 6 and stored_quiet["comment_count"] == 0
+    assert [comment["text"] for comment in stored["comments_preview"]] == ["comment 3", "comment 4", "new"]
+
+    page = client.get(f"/activities/{activity['_id']}/comments", params={"limit": 10}, headers=headers).json()
+    assert [comment["text"] for comment in page["items"]] == ["new"] + [f"comment {n}" for n in range(4, -1, -1)]
+    card = client.get(f"/activities/user/{user['id']}", headers=headers).json()["items"]
+    assert next(item for item in card if item["id"] == str(activity["_id"]))["comment_count"] == 6
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from app import directory
+from app.crud import create_user, update_user
+from app.database import name_token_collection, user_collection
+from app.directory import backfill_search_fields, search_fields, search_users
+from app.pagination import encode_cursor
+from app.query_plans import blocking_stages
+
+NAMES = [
+    ("Ada", "Lovelace", ["coding"]), ("Lola", "Lovegood", ["reading"]), ("Grace", "Hopper", ["coding"]),
+    ("Lorenzo", "Love", ["reading"]), ("Zoë", "Lopez", ["coding"]), ("Alan", "Turing", ["chess"]),
+]
+
+def create_users(client) -> dict:
+    ids = {}
+    for n, (first_name, last_name, interests) in enumerate(NAMES):
+        user = client.portal.call(create_user, {
+            "first_name": first_name, "last_name": last_name, "email": f"user{n}@example.com", "password": "password",
+            "dob": "2000-01-01", "interests": interests,
+        })
+        ids[user.id] = first_name
+    return ids
+
+def walk(q: str = None, limit: int = 2, **filters) -> list:
+    async def pages():
+        seen, cursor = [], None
+        while True:
+            users, cursor = await search_users(q, cursor=cursor, limit=limit, **filters)
+            assert len(users) <= limit
+            seen += [user["first_name"] for user in users]
+            if cursor is None:
+                return seen
+    return asyncio.run(pages())
+
+@pytest.mark.parametrize("batch", [1, 2, 200])
+def test_name_search_pages_in_token_order_without_repeats(client, monkeypatch, batch):
+    monkeypatch.setattr(directory, "SEARCH_SCAN_BATCH", batch)
+    create_users(client)
+    # Lola matches "lo" twice (lola, lovegood) and is listed once, under "lola"
+    assert walk("lo") == ["Lola", "Zoë", "Lorenzo", "Ada"]
+    assert walk("LOVE", limit=1) == walk("love", limit=10)
+    assert walk("love", limit=10) == ["Lorenzo", "Lola", "Ada"]
+
+def test_name_search_combines_tokens_and_filters(client, monkeypatch):
+    monkeypatch.setattr(directory, "SEARCH_SCAN_BATCH", 2)
+    create_users(client)
+    assert walk("lo a") == ["Ada"]
+    assert walk("lo", interest="coding") == ["Zoë", "Ada"]
+    assert walk("zoe lop") == ["Zoë"]
+    assert walk("nobody") == []
+
+def test_renames_move_the_search_entries(client):
+    ids = create_users(client)
+    ada = next(user_id for user_id, name in ids.items() if name == "Ada")
+    client.portal.call(update_user, ada, {"first_name": "Augusta", "last_name": "King"})
+    assert walk("lovel") == [] and walk("augus") == ["Augusta"]
+    entries = asyncio.run(name_token_collection.find({"user_id": ObjectId(ada)}).to_list(None))
+    assert sorted(entry["token"] for entry in entries) == ["augusta", "king"]
+
+def test_backfill_indexes_existing_users(client):
+    async def scenario():
+        await user_collection.insert_one({"first_name": "Old", "last_name": "Timer", "email": "old@example.com"})
+        await user_collection.insert_one({"first_name": "Older", "last_name": "Hand", "email": "older@example.com", **search_fields("Older", "Hand")})
+        await backfill_search_fields()
+        await backfill_search_fields()
+        return await name_token_collection.count_documents({})
+
+    assert asyncio.run(scenario()) == 4
+    assert walk("tim") == ["Old"] and walk("han") == ["Older"]
+
+def test_search_cursors_are_checked(client, register):
+    _, headers = register("search@example.com")
+    assert client.get("/users", params={"q": "te", "cursor": "not-a-cursor"}, headers=headers).status_code == 400
+    # A listing cursor is not a name search cursor
+    cursor = encode_cursor(datetime(2024, 1, 1), ObjectId())
+    assert client.get("/users", params={"q": "te", "cursor": cursor}, headers=headers).status_code == 400
+    page = client.get("/users", params={"q": "te"}, headers=headers).json()
+    assert [user["first_name"] for user in page["items"]] == ["Test"] and page["next_cursor"] is None
+
+def test_in_memory_sorts_are_flagged():
+    plan = {"stage": "FETCH", "inputStage": {"stage": "SORT", "inputStage": {"stage": "IXSCAN"}},
+            "rejectedPlans": [{"stage": "COLLSCAN"}]}
+    assert blocking_stages(plan) == ["SORT"]
+    assert blocking_stages({"stage": "OR", "inputStages": [{"stage": "COLLSCAN"}, {"stage": "IXSCAN"}]}) == ["COLLSCAN"]
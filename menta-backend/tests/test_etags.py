@@ -0,0 +1,98 @@
+from app.crud import create_activity, add_comment_to_activity
+from app.versions import response_cache
+
+ACTIVITY = {
+    "title": "Reading", "description": "", "activity": "reading", "date": "2024-01-01", "start_time": "10:00",
+    "duration": 1800, "private_notes": "", "privacy_type": "public", "perceived_performance": 3, "images": [],
+}
+
+def revalidate(client, url: str, headers: dict, etag: str):
+    return client.get(url, headers={**headers, "If-None-Match": etag})
+
+def test_activity_list_revalidates_until_a_write(client, register):
+    author, _ = register("author@example.com")
+    _, headers = register("reader@example.com")
+    url = f"/activities/user/{author['id']}"
+    first = client.get(url, headers=headers)
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and first.headers["cache-control"] == "private, no-cache"
+
+    unchanged = revalidate(client, url, headers, etag)
+    assert unchanged.status_code == 304 and unchanged.content == b"" and unchanged.headers["etag"] == etag
+    # Another view of the same resource has its own validator
+    assert revalidate(client, url + "?limit=5", headers, etag).status_code == 200
+
+    activity = client.portal.call(create_activity, dict(ACTIVITY), author["id"])
+    changed = revalidate(client, url, headers, etag)
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert changed.json()["items"][0]["id"] == activity.id
+
+    etag = changed.headers["etag"]
+    client.portal.call(add_comment_to_activity, activity.id, {"user_id": author["id"], "text": "Nice"})
+    commented = revalidate(client, url, headers, etag)
+    assert commented.status_code == 200 and commented.json()["items"][0]["comment_count"] == 1
+
+def test_cached_bodies_are_not_served_across_versions(client, register):
+    author, headers = register("cache@example.com")
+    url = f"/activities/user/{author['id']}"
+    assert client.get(url, headers=headers).json()["items"] == []
+    assert len(response_cache) == 1
+    client.portal.call(create_activity, dict(ACTIVITY), author["id"])
+    # No If-None-Match: the cached body of the old version must not come back either
+    assert len(client.get(url, headers=headers).json()["items"]) == 1
+
+def test_profile_revalidation(client, register):
+    user, headers = register("profile@example.com")
+    _, follower_headers = register("follower@example.com")
+    url = f"/users/{user['id']}"
+    first = client.get(url, headers=headers)
+    assert revalidate(client, url, headers, first.headers["etag"]).status_code == 304
+
+    client.post("/follow", json={"target_user_id": user["id"]}, headers=follower_headers)
+    followed = revalidate(client, url, headers, first.headers["etag"])
+    assert followed.status_code == 200 and followed.json()["follower_count"] == 1
+    assert client.get("/users/000000000000000000000000", headers=headers).status_code == 404
+
+    me = client.get("/users/me", headers=headers)
+    assert revalidate(client, "/users/me", headers, me.headers["etag"]).status_code == 304
+
+def test_renaming_a_user_refreshes_their_activity_cards(client, register):
+    author, headers = register("rename@example.com")
+    client.portal.call(create_activity, dict(ACTIVITY), author["id"])
+    url = f"/activities/user/{author['id']}"
+    before = client.get(url, headers=headers)
+    assert before.json()["items"][0]["author"]["first_name"] == author["first_name"]
+
+    form = {
+        "first_name": "Renamed", "last_name": author["last_name"], "email": author["email"], "dob": "2000-01-01",
+        "interests": "reading", "profile_picture": "/uploads/new.jpg",
+    }
+    assert client.put(f"/users/{author['id']}", data=form, headers=headers).status_code == 200
+    after = revalidate(client, url, headers, before.headers["etag"])
+    assert after.status_code == 200 and after.headers["etag"] != before.headers["etag"]
+    assert after.json()["items"][0]["author"]["first_name"] == "Renamed"
+    assert after.json()["items"][0]["author"]["profile_picture"] == "/uploads/new.jpg"
+
+def test_renaming_a_commenter_refreshes_the_cards_they_commented_on(client, register):
+    author, headers = register("owner@example.com")
+    commenter, commenter_headers = register("commenter@example.com")
+    activity = client.portal.call(create_activity, dict(ACTIVITY), author["id"])
+    client.portal.call(add_comment_to_activity, activity.id, {"user_id": commenter["id"], "text": "Nice"})
+    url = f"/activities/user/{author['id']}"
+    before = client.get(url, headers=headers)
+    assert before.json()["items"][0]["comments"][0]["author"]["first_name"] == commenter["first_name"]
+    assert revalidate(client, url, headers, before.headers["etag"]).status_code == 304
+
+    form = {
+        "first_name": "Renamed", "last_name": commenter["last_name"], "email": commenter["email"], "dob": "2000-01-01",
+        "interests": "reading",
+    }
+    assert client.put(f"/users/{commenter['id']}", data=form, headers=commenter_headers).status_code == 200
+    after = revalidate(client, url, headers, before.headers["etag"])
+    assert after.status_code == 200 and after.headers["etag"] != before.headers["etag"]
+    assert after.json()["items"][0]["comments"][0]["author"]["first_name"] == "Renamed"
+    assert revalidate(client, url, headers, after.headers["etag"]).status_code == 304
+
+    # Without the rendered view, the body is rebuilt and still matches the client's copy
+    response_cache.clear()
+    assert revalidate(client, url, headers, after.headers["etag"]).status_code == 304
@@ -0,0 +1,76 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from bson import ObjectId
+from app import exporter
+from app.database import activity_collection
+from app.exporter import export_activities
+
+ROWS = [
+    {
+        "title": "Morning pages", "description": "Journal, then a chapter", "activity": "reading", "date": "2023-01-02",
+        "start_time": "07:00", "duration": 45, "private_notes": "slow start", "privacy_type": "private",
+        "perceived_performance": 4, "images": ["/uploads/a.jpg", "/uploads/b.jpg"],
+    },
+    {
+        "title": "Chess \"puzzles\"", "description": "Tactics", "activity": "chess", "date": "2023-01-03",
+        "start_time": "19:30", "duration": 30, "private_notes": None, "privacy_type": "public",
+        "perceived_performance": None, "images": [],
+    },
+]
+
+def export(client, user: dict, headers: dict, file_format: str) -> str:
+    response = client.get(f"/activities/user/{user['id']}/export", params={"format": file_format}, headers=headers)
+    assert response.status_code == 200
+    return response.text
+
+def comparable(rows: list) -> list:
+    # What survives a round trip: everything but the ids and the import time
+    return [{key: value for key, value in row.items() if key not in ("id", "updated_at")} for row in rows]
+
+def csv_rows(text: str) -> list:
+    return list(csv.DictReader(io.StringIO(text)))
+
+def test_exports_round_trip_through_the_importer(client, register):
+    user, headers = register("source@example.com")
+    body = "\n".join(json.dumps(row) for row in ROWS).encode()
+    assert client.post("/activities/import", content=body, headers=headers).json()["imported"] == 2
+
+    exported = export(client, user, headers, "ndjson")
+    original = [json.loads(line) for line in exported.splitlines()]
+    assert [row["title"] for row in original] == ["Morning pages", "Chess \"puzzles\""]
+    assert original[0]["images"] == ROWS[0]["images"] and original[0]["comment_count"] == 0
+
+    for file_format in ("ndjson", "csv"):
+        copy, copy_headers = register(f"copy-{file_format}@example.com")
+        content = export(client, user, headers, file_format).encode()
+        result = client.post("/activities/import", content=content, params={"format": file_format}, headers=copy_headers).json()
+        assert result["imported"] == 2 and result["failed"] == 0
+        assert comparable([json.loads(line) for line in export(client, copy, copy_headers, "ndjson").splitlines()]) == comparable(original)
+        assert comparable(csv_rows(export(client, copy, copy_headers, "csv"))) == comparable(csv_rows(export(client, user, headers, "csv")))
+
+def test_export_pages_through_batch_boundaries_in_order(client, register, monkeypatch):
+    user, headers = register("batches@example.com")
+    monkeypatch.setattr(exporter, "EXPORT_BATCH_SIZE", 2)
+    created_at = datetime(2023, 1, 1)
+    # Three sessions share a created_at, so the _id tie-break decides their order
+    ids = sorted(ObjectId() for _ in range(7))
+    documents = [
+        {"_id": _id, "user_id": user["id"], "title": f"Session {n}", "activity": "reading", "date": "2023-01-01",
+         "start_time": "10:00", "duration": 10, "privacy_type": "public",
+         "created_at": created_at + timedelta(days=max(n - 2, 0)), "updated_at": created_at}
+        for n, _id in enumerate(ids)
+    ]
+
+    async def scenario():
+        await activity_collection.insert_many(list(reversed(documents)))
+        await activity_collection.insert_one({**documents[0], "_id": ObjectId(), "user_id": "someone-else"})
+        return [json.loads(line) async for line in export_activities(user["id"], "ndjson")]
+
+    rows = asyncio.run(scenario())
+    assert [row["id"] for row in rows] == [str(_id) for _id in ids]
+
+    lines = export(client, user, headers, "csv").splitlines()
+    assert lines[0].startswith("id,title,") and len(lines) == 8
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import date
+from bson import ObjectId
+import pytest
+from app import clubs, idempotency
+from app.clubs import create_club, get_club_totals, record_club_activity
+from app.crud import utcnow
+from app.database import challenge_collection, club_contribution_collection, club_counter_collection, effect_collection, user_collection
+from app.idempotency import apply_once
+
+def test_a_rerun_is_recognised_however_many_effects_came_since(monkeypatch):
+    monkeypatch.setattr(idempotency, "PENDING_EFFECTS_LIMIT", 2)
+    challenge_id = ObjectId()
+
+    async def complete(effect_id):
+        applied, _ = await apply_once(challenge_collection, {"_id": challenge_id}, {"$inc": {"completion_count": 1}}, effect_id)
+        return applied
+
+    async def scenario():
+        await challenge_collection.insert_one({"_id": challenge_id, "completion_count": 0})
+        first = ObjectId()
+        applied = [await complete(first)]
+        applied += [await complete(ObjectId()) for _ in range(100)]
+        # The job that completed first is retried after a hundred other completions
+        applied.append(await complete(first))
+        return applied, await challenge_collection.find_one({"_id": challenge_id})
+
+    applied, challenge = asyncio.run(scenario())
+    assert applied == [True] * 101 + [False]
+    assert challenge["completion_count"] == 101
+    # Finished effects don't stay on the document
+    assert challenge["pending_effects"] == []
+
+def test_a_rerun_after_a_crash_before_the_receipt_is_closed(monkeypatch):
+    target = ObjectId()
+    close_receipt = idempotency.close_receipt
+
+    async def dies(*args):
+        raise RuntimeError("worker died")
+
+    async def scenario():
+        effect_id = ObjectId()
+        update = {"$inc": {"completion_count": 1}}
+        monkeypatch.setattr(idempotency, "close_receipt", dies)
+        with pytest.raises(RuntimeError):
+            await apply_once(challenge_collection, {"_id": target}, update, effect_id, upsert=True)
+        monkeypatch.setattr(idempotency, "close_receipt", close_receipt)
+        rerun = await apply_once(challenge_collection, {"_id": target}, update, effect_id, upsert=True)
+        again = await apply_once(challenge_collection, {"_id": target}, update, effect_id, upsert=True)
+        return rerun, again, await challenge_collection.find_one({"_id": target}), await effect_collection.find().to_list(None)
+
+    rerun, again, stored, receipts = asyncio.run(scenario())
+    assert rerun == (False, None) and again == (False, None)
+    assert stored["completion_count"] == 1 and stored["pending_effects"] == []
+    assert len(receipts) == 1 and receipts[0]["done"]
+
+@pytest.mark.parametrize("crash_on", ["contribution", "totals"])
+def test_club_totals_are_repaired_by_a_rerun(monkeypatch, crash_on):
+    today = date.today()
+    user_id = ObjectId()
+    activity = {
+        "_id": ObjectId(), "user_id": str(user_id), "activity": "reading", "date": today.isoformat(),
+        "duration": 900, "created_at": utcnow(),
+    }
+    crashing = club_contribution_collection if crash_on == "contribution" else club_counter_collection
+    apply = idempotency.apply_once
+
+    async def crash_after_write(collection, *args, **kwargs):
+        result = await apply(collection, *args, **kwargs)
+        if collection is crashing:
+            raise RuntimeError("worker died")
+        return result
+
+    async def scenario():
+        await user_collection.insert_one({"_id": user_id, "first_name": "Test", "last_name": "User", "clubs": []})
+        club = await create_club(str(user_id), {"name": "Readers", "activity": "Reading"})
+        monkeypatch.setattr(clubs, "apply_once", crash_after_write)
+        with pytest.raises(RuntimeError):
+            await record_club_activity(dict(activity))
+        monkeypatch.setattr(clubs, "apply_once", apply)
+        await record_club_activity(dict(activity))
+        await record_club_activity(dict(activity))
+        return await get_club_totals(str(club["_id"]), today)
+
+    totals = asyncio.run(scenario())
+    assert totals["seconds"] == 900 and totals["sessions"] == 1
+    assert totals["top_contributors"][0]["seconds"] == 900
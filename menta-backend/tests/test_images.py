@@ -0,0 +1,98 @@
+import io
+import os
+import asyncio
+import random
+import pytest
+from PIL import Image
+from app import images
+from app.images import VARIANTS, InvalidImage, render_variants
+
+FORM = {
+    "title": "Reading", "description": "An hour of reading", "activity": "reading", "date": "2024-01-01", "start_time": "10:00",
+    "duration": "1800", "private_notes": "notes", "privacy_type": "public", "perceived_performance": "3",
+}
+
+def jpeg(width: int = 800, height: int = 600) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "JPEG")
+    return buffer.getvalue()
+
+def noisy_jpeg() -> bytes:
+    # Large enough that its scan data runs well past a small header read
+    rng = random.Random(3)
+    buffer = io.BytesIO()
+    Image.frombytes("RGB", (400, 400), bytes(rng.randrange(256) for _ in range(400 * 400 * 3))).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("data", [b"not an image", jpeg()[:400]])
+def test_undecodable_files_are_invalid_images(data):
+    with pytest.raises(InvalidImage):
+        render_variants(data)
+
+def test_variants_are_downscaled_jpegs():
+    rendered = render_variants(jpeg(3200, 1600))
+    for name, size in VARIANTS.items():
+        assert max(Image.open(io.BytesIO(rendered[name])).size) == size
+
+@pytest.mark.parametrize("data", [b"not an image", jpeg()[:400]])
+def test_activity_upload_rejects_undecodable_files(client, register, data):
+    _, headers = register("images@example.com")
+    files = [("files", ("good.jpg", jpeg(), "image/jpeg")), ("files", ("bad.jpg", data, "image/jpeg"))]
+    staged = set(os.listdir(os.environ["STAGING_DIR"]))
+    response = client.post("/activities", data=FORM, files=files, headers=headers)
+    assert response.status_code == 400, response.text
+    assert set(os.listdir(os.environ["STAGING_DIR"])) == staged
+
+class RecordingUpload:
+    def __init__(self, data: bytes):
+        self.file, self.reads = io.BytesIO(data), []
+
+    async def read(self, size: int = -1) -> bytes:
+        self.reads.append(size)
+        return self.file.read(size)
+
+    async def seek(self, offset: int):
+        self.file.seek(offset)
+
+def test_upload_checks_only_read_the_header(monkeypatch):
+    monkeypatch.setattr(images, "IMAGE_HEADER_BYTES", 4096)
+    data = noisy_jpeg()
+    assert len(data) > 10 * 4096
+    broken, whole = RecordingUpload(data[: len(data) // 2]), RecordingUpload(jpeg())
+    asyncio.run(images.ImageProcessor.check_uploads(None, [broken, whole]))
+    # A header that parses is enough for a large file; the rest is left to the image job
+    assert broken.reads == [4097] and broken.file.tell() == 0
+    with pytest.raises(InvalidImage):
+        asyncio.run(images.ImageProcessor.check_uploads(None, [RecordingUpload(b"GIF89a" + bytes(5000))]))
+
+def test_activity_upload_accepts_images(client, register):
+    _, headers = register("images@example.com")
+    response = client.post("/activities", data=FORM, files=[("files", ("good.jpg", jpeg(), "image/jpeg"))], headers=headers)
+    assert response.status_code == 200, response.text
+
+def test_damaged_staged_file_is_counted_and_the_rest_render(caplog):
+    from types import SimpleNamespace
+    from bson import ObjectId
+    from app.database import activity_collection
+    from app.images import ImageProcessor
+    from app.storage import create_storage
+    from app.tasks import render_activity_images
+
+    storage = create_storage()
+    state = SimpleNamespace(storage=storage, images=ImageProcessor(storage))
+    activity_id = ObjectId()
+
+    async def scenario():
+        await activity_collection.insert_one({"_id": activity_id, "user_id": str(ObjectId()), "images": []})
+        damaged = noisy_jpeg()
+        keys = await storage.stage_uploads([SimpleNamespace(file=io.BytesIO(jpeg())), SimpleNamespace(file=io.BytesIO(damaged[: len(damaged) // 2]))])
+        await render_activity_images({"activity_id": activity_id, "staged_keys": keys}, state)
+        return keys, await activity_collection.find_one({"_id": activity_id})
+
+    try:
+        keys, activity = asyncio.run(scenario())
+    finally:
+        state.images.close()
+    assert len(activity["image_variants"]) == 1 and activity["failed_images"] == 1
+    assert f"Staged upload {keys[1]}" in caplog.text
+    assert not set(keys) & set(os.listdir(os.environ["STAGING_DIR"]))
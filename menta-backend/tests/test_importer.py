@@ -0,0 +1,113 @@
+import asyncio
+import json
+from datetime import date, datetime, timedelta
+from app import importer
+from app.crud import create_activity
+from app.database import activity_collection, leaderboard_collection, progress_collection, progress_daily_collection
+
+TODAY = date.today()
+
+def row(day: date, start_time: str = "07:30", duration: int = 1800, activity: str = "reading", **fields) -> dict:
+    return {
+        "title": "Reading", "description": "", "activity": activity, "date": day.isoformat(), "start_time": start_time,
+        "duration": duration, "private_notes": "", "privacy_type": "public", "perceived_performance": 3, **fields,
+    }
+
+def ndjson(*lines) -> bytes:
+    return "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines).encode()
+
+def import_body(client, headers: dict, body: bytes, **params):
+    return client.post("/activities/import", content=body, params=params, headers=headers)
+
+def test_imported_sessions_are_dated_by_when_they_happened(client, register):
+    user, headers = register("importer@example.com")
+    client.portal.call(create_activity, row(TODAY), user["id"])
+    response = import_body(client, headers, ndjson(row(date(2021, 3, 4), "06:15"), row(date(2022, 8, 9), "21:40")))
+    assert response.json()["imported"] == 2
+
+    async def stored():
+        return await activity_collection.find({"user_id": user["id"]}, {"date": 1, "created_at": 1, "updated_at": 1}).to_list(None)
+
+    by_date = {activity["date"]: activity for activity in asyncio.run(stored())}
+    assert by_date["2021-03-04"]["created_at"] == datetime(2021, 3, 4, 6, 15)
+    assert by_date["2022-08-09"]["created_at"] == datetime(2022, 8, 9, 21, 40)
+    assert by_date["2021-03-04"]["updated_at"] > datetime(2021, 3, 5)
+    # The history lands behind the user's newest post, oldest last
+    items = client.get(f"/activities/user/{user['id']}", headers=headers).json()["items"]
+    assert [item["date"] for item in items] == [TODAY.isoformat(), "2022-08-09", "2021-03-04"]
+    assert client.get("/activities", headers=headers).json()["items"][0]["date"] == TODAY.isoformat()
+
+def test_rows_are_written_in_batches(client, register, monkeypatch):
+    user, headers = register("batches@example.com")
+    monkeypatch.setattr(importer, "IMPORT_BATCH_SIZE", 2)
+    batches = []
+    flush_batch = importer.flush_batch
+
+    async def counting_flush(user_id, documents):
+        batches.append(len(documents))
+        await flush_batch(user_id, documents)
+
+    monkeypatch.setattr(importer, "flush_batch", counting_flush)
+    result = import_body(client, headers, ndjson(*(row(TODAY - timedelta(days=n)) for n in range(5)))).json()
+    assert result["imported"] == 5 and result["failed"] == 0
+    assert batches == [2, 2, 1]
+
+def test_bad_rows_are_reported_and_the_rest_imported(client, register, monkeypatch):
+    user, headers = register("errors@example.com")
+    monkeypatch.setattr(importer, "IMPORT_MAX_REPORTED_ERRORS", 4)
+    body = ndjson(
+        row(TODAY),
+        "{not json",
+        {"title": "Missing fields"},
+        row(TODAY, start_time="7pm"),
+        row(date(2024, 1, 1)) | {"date": "2024-02-30"},
+        "",
+        row(TODAY, duration="long"),
+        row(TODAY),
+    ) + b"\n\xff\xfe\n"
+    result = import_body(client, headers, body).json()
+    assert result["imported"] == 2 and result["failed"] == 6
+    assert [error["row"] for error in result["errors"]] == [2, 3, 4, 5]
+    assert result["errors"][0]["error"].startswith("Invalid JSON")
+    assert "activity: field required" in result["errors"][1]["error"]
+
+def test_csv_rows_and_overlong_lines(client, register, monkeypatch):
+    user, headers = register("csv@example.com")
+    body = (
+        "title,description,activity,date,start_time,duration,private_notes,privacy_type,perceived_performance,images\r\n"
+        f"Reading,,reading,{TODAY.isoformat()},08:00,600,,public,4,/uploads/a.jpg;/uploads/b.jpg\r\n"
+        f"Chess,\"Openings, mostly\",chess,{TODAY.isoformat()},09:00,900,,private,,\r\n"
+    ).encode()
+    response = client.post("/activities/import", content=body, headers={**headers, "Content-Type": "text/csv"})
+    assert response.json()["imported"] == 2
+
+    async def stored():
+        return {activity["activity"]: activity for activity in await activity_collection.find({"user_id": user["id"]}).to_list(None)}
+
+    activities = asyncio.run(stored())
+    assert activities["reading"]["images"] == ["/uploads/a.jpg", "/uploads/b.jpg"]
+    assert activities["chess"]["description"] == "Openings, mostly" and activities["chess"]["perceived_performance"] is None
+
+    monkeypatch.setattr(importer, "IMPORT_MAX_LINE_BYTES", 100)
+    assert import_body(client, headers, b"x" * 500).status_code == 413
+
+def test_progress_and_leaderboards_follow_an_import(client, register):
+    user, headers = register("progress@example.com")
+    # Out of order, with two sessions on one day
+    days = [TODAY - timedelta(days=1), TODAY - timedelta(days=3), TODAY - timedelta(days=2), TODAY - timedelta(days=1)]
+    response = import_body(client, headers, ndjson(*(row(day, duration=600) for day in days), row(TODAY, activity="chess")))
+    assert response.json()["imported"] == 5
+
+    async def stored():
+        return (
+            await progress_collection.find_one({"user_id": user["id"], "activity": "reading"}),
+            await progress_daily_collection.find_one({"user_id": user["id"], "activity": "reading", "day": days[0].isoformat()}),
+            await progress_collection.count_documents({"user_id": user["id"]}),
+            await leaderboard_collection.count_documents({"user_id": user["id"]}),
+        )
+
+    summary, daily, activities, boards = asyncio.run(stored())
+    assert summary["time_spent_seconds"] == 2400 and summary["sessions"] == 4
+    assert summary["streak"] == 3 and summary["last_day"] == days[0].isoformat()
+    assert daily["time_spent_seconds"] == 1200 and daily["sessions"] == 2
+    assert activities == 2 and boards >= 2
@@ -0,0 +1,141 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from bson import ObjectId
+from app import challenges, jobs, tasks
+from app.challenges import create_challenge
+from app.clubs import create_club, get_club_totals
+from app.crud import utcnow
+from app.database import (
+    challenge_collection, challenge_participant_collection, job_collection, leaderboard_collection,
+    notification_collection, progress_collection, progress_daily_collection, user_collection,
+)
+from app.jobs import claim_job, complete_job, enqueue, job_handler, run_job
+from app.leaderboards import board_key, board_size, rank_of
+
+def test_a_leased_job_is_not_claimed_twice_until_the_lease_runs_out():
+    async def scenario():
+        await enqueue("lease_test", {})
+        first = await claim_job("worker-a")
+        while_leased = await claim_job("worker-b")
+        # worker-a stalls past its lease
+        await job_collection.update_one({"_id": first["_id"]}, {"$set": {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+        second = await claim_job("worker-b")
+        # The stalled worker finishing late must not overwrite the rerun's claim
+        await complete_job(first)
+        stored = await job_collection.find_one({"_id": first["_id"]})
+        await complete_job(second)
+        return first, while_leased, second, stored, await job_collection.find_one({"_id": first["_id"]})
+
+    first, while_leased, second, stored, finished = asyncio.run(scenario())
+    assert first["worker"] == "worker-a" and first["attempts"] == 1
+    assert while_leased is None
+    assert second["_id"] == first["_id"] and second["worker"] == "worker-b" and second["attempts"] == 2
+    assert stored["status"] == "running" and stored["worker"] == "worker-b"
+    assert finished["status"] == "done"
+
+def test_failures_back_off_then_give_up(monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 3)
+    attempts = []
+
+    @job_handler("always_fails")
+    async def always_fails(payload, state):
+        attempts.append(payload)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        await enqueue("always_fails", {"n": 1})
+        delays = []
+        for _ in range(3):
+            # Make the retry due now instead of waiting out the backoff
+            await job_collection.update_many({"status": "queued"}, {"$set": {"run_at": datetime.utcnow() - timedelta(seconds=1)}})
+            job = await claim_job("worker")
+            before = datetime.utcnow()
+            await run_job(job, None)
+            stored = await job_collection.find_one({"_id": job["_id"]})
+            if stored["status"] == "queued":
+                delays.append((stored["run_at"] - before).total_seconds())
+        return delays, stored
+
+    delays, stored = asyncio.run(scenario())
+    assert len(attempts) == 3
+    assert stored["status"] == "failed" and stored["attempts"] == 3
+    assert stored["last_error"] == "RuntimeError: boom"
+    base = jobs.JOB_RETRY_BASE_SECONDS
+    assert base * 0.9 <= delays[0] <= base * 1.1 and base * 1.9 <= delays[1] <= base * 2.1
+
+def test_rerunning_activity_jobs_counts_the_activity_once():
+    today = date.today()
+    user_id = ObjectId()
+    activity = {
+        "_id": ObjectId(), "user_id": str(user_id), "activity": "reading", "date": today.isoformat(),
+        "duration": 1800, "created_at": utcnow(),
+    }
+
+    async def scenario():
+        await user_collection.insert_one({"_id": user_id, "first_name": "Test", "last_name": "User", "clubs": []})
+        club = await create_club(str(user_id), {"name": "Readers", "activity": "Reading"})
+        challenge, _ = await create_challenge(str(user_id), {
+            "title": "Read an hour", "activity": "reading", "goal": "total_seconds", "target": 1800,
+            "starts": today.isoformat(), "ends": (today + timedelta(days=7)).isoformat(),
+        })
+        for _ in range(2):
+            for kind in ("progress", "leaderboard", "club_activity", "challenges"):
+                await jobs.handlers[kind](dict(activity), None)
+        return club, challenge
+
+    club, challenge = asyncio.run(scenario())
+
+    async def results():
+        board = board_key("week", "reading", today)
+        return (
+            await progress_collection.find_one({"user_id": str(user_id)}),
+            await progress_daily_collection.find_one({"user_id": str(user_id)}),
+            await leaderboard_collection.find_one({"board": board}),
+            await board_size(board),
+            await rank_of(board, 1800),
+            await get_club_totals(str(club["_id"]), today),
+            await challenge_participant_collection.find_one({"challenge_id": str(challenge["_id"])}),
+            await challenge_collection.find_one({"_id": challenge["_id"]}),
+            await notification_collection.count_documents({"kind": "challenge"}),
+        )
+
+    progress, daily, entry, size, rank, totals, participant, stored_challenge, notices = asyncio.run(results())
+    assert progress["time_spent_seconds"] == 1800 and progress["sessions"] == 1
+    assert daily["time_spent_seconds"] == 1800 and daily["sessions"] == 1
+    assert entry["seconds"] == 1800 and size == 1 and rank == (1, 1)
+    assert totals["seconds"] == 1800 and totals["sessions"] == 1
+    assert totals["top_contributors"][0]["seconds"] == 1800
+    assert participant["seconds"] == 1800 and participant["completed_by"] == activity["_id"]
+    assert stored_challenge["completion_count"] == 1 and notices == 1
+
+def test_a_rerun_finishes_a_completion_the_first_run_stopped_short_of(monkeypatch):
+    today = date.today()
+    user_id = str(ObjectId())
+    activity = {"_id": ObjectId(), "user_id": user_id, "activity": "reading", "date": today.isoformat(), "duration": 600}
+    record_completion = challenges.record_completion
+
+    async def dies(*args):
+        raise RuntimeError("worker died")
+
+    async def scenario():
+        challenge, _ = await create_challenge(user_id, {
+            "title": "Ten minutes", "activity": None, "goal": "sessions", "target": 1,
+            "starts": today.isoformat(), "ends": today.isoformat(),
+        })
+        # The first run completes the participation, then dies before recording the completion
+        monkeypatch.setattr(challenges, "record_completion", dies)
+        try:
+            await tasks.apply_challenges(dict(activity), None)
+        except RuntimeError:
+            pass
+        monkeypatch.setattr(challenges, "record_completion", record_completion)
+        await tasks.apply_challenges(dict(activity), None)
+        # Any further rerun still reports the completion, and still records it only once
+        completed = await challenges.evaluate_activity(dict(activity))
+        participant = await challenge_participant_collection.find_one({"challenge_id": str(challenge["_id"])})
+        return challenge, completed, participant, await challenge_collection.find_one({"_id": challenge["_id"]})
+
+    challenge, completed, participant, stored = asyncio.run(scenario())
+    assert completed == [str(challenge["_id"])]
+    assert participant["sessions"] == 1
+    assert stored["completion_count"] == 1
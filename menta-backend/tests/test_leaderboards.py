@@ -0,0 +1,68 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+from app.database import leaderboard_rank_collection
+from app.leaderboards import add_score, board_size, node_id, rank_of, rebuild_ranks, RANK_SCORE_LIMIT
+
+BOARD = "week:2024-W03:reading"
+EXPIRES = datetime.utcnow() + timedelta(days=30)
+
+def brute_force_rank(scores: dict, seconds: int) -> int:
+    return 1 + sum(1 for other in scores.values() if other > seconds)
+
+def test_ranks_match_a_sorted_board():
+    rng = random.Random(7)
+    scores = {}
+
+    async def scenario():
+        for _ in range(200):
+            user_id, seconds = f"user-{rng.randrange(40)}", rng.choice([0, 60, 600, 1800, rng.randrange(1, 100000)])
+            scores[user_id] = scores.get(user_id, 0) + seconds
+            await add_score(BOARD, user_id, seconds, EXPIRES)
+        probes = sorted(set(scores.values())) + [0, 1, 10 ** 9]
+        return await board_size(BOARD), {seconds: await rank_of(BOARD, seconds) for seconds in probes}
+
+    size, ranks = asyncio.run(scenario())
+    assert size == len(scores)
+    for seconds, (rank, participants) in ranks.items():
+        assert rank == brute_force_rank(scores, seconds) and participants == len(scores)
+
+def test_ties_share_a_rank_and_scores_past_the_limit_rank_first():
+    async def scenario():
+        for user_id, seconds in (("a", 600), ("b", 600), ("c", 300), ("d", RANK_SCORE_LIMIT * 2)):
+            await add_score(BOARD, user_id, seconds, EXPIRES)
+        return [await rank_of(BOARD, seconds) for seconds in (RANK_SCORE_LIMIT * 2, 600, 300, 0)]
+
+    assert asyncio.run(scenario()) == [(1, 4), (2, 4), (4, 4), (5, 4)]
+
+def test_rebuild_repairs_drifted_counters():
+    async def scenario():
+        for user_id, seconds in (("a", 1800), ("b", 600), ("c", 600)):
+            await add_score(BOARD, user_id, seconds, EXPIRES)
+        healthy = [await rank_of(BOARD, seconds) for seconds in (1800, 600, 300)]
+        # A crash between a score write and its counter write leaves the counters behind
+        await leaderboard_rank_collection.update_many({}, {"$inc": {"count": 3}})
+        await leaderboard_rank_collection.insert_one({"_id": node_id(BOARD, 5), "count": 2})
+        other = node_id("week:2024-W03:running", RANK_SCORE_LIMIT)
+        await leaderboard_rank_collection.insert_one({"_id": other, "count": 1})
+        drifted = await board_size(BOARD)
+        rebuilt = await rebuild_ranks(BOARD)
+        return (
+            healthy, drifted, rebuilt, [await rank_of(BOARD, seconds) for seconds in (1800, 600, 300)],
+            await leaderboard_rank_collection.find_one({"_id": node_id(BOARD, 5)}),
+            await leaderboard_rank_collection.find_one({"_id": other}),
+        )
+
+    healthy, drifted, rebuilt, repaired, stray, other = asyncio.run(scenario())
+    assert healthy == [(1, 3), (2, 3), (4, 3)] and drifted == 6
+    assert rebuilt == 3 and repaired == healthy
+    # Nodes no score reaches are dropped; other boards are left alone
+    assert stray is None and other["count"] == 1
+
+def test_rebuilding_an_empty_board_clears_it():
+    async def scenario():
+        await leaderboard_rank_collection.insert_one({"_id": node_id(BOARD, RANK_SCORE_LIMIT), "count": 2})
+        await rebuild_ranks(BOARD)
+        return await board_size(BOARD)
+
+    assert asyncio.run(scenario()) == 0
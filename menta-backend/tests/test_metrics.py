@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+from app import auth
+from app.metrics import CommandTimer, mongo_latency
+
+def started(request_id: int, collection: str = "activities"):
+    return SimpleNamespace(command_name="find", command={"find": collection, "filter": {"user_id": "u"}}, connection_id=("db", 27017), request_id=request_id)
+
+def test_metrics_need_the_metrics_token(client, register, monkeypatch):
+    _, headers = register("metrics@example.com")
+    for path in ("/metrics", "/jobs/metrics"):
+        monkeypatch.setattr(auth, "METRICS_TOKEN", "")
+        assert client.get(path).status_code == 404
+        monkeypatch.setattr(auth, "METRICS_TOKEN", "scrape-secret")
+        assert client.get(path).status_code == 401
+        # A user session is not enough
+        assert client.get(path, headers=headers).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer wrong"}).status_code == 401
+        assert client.get(path, headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
+    body = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).text
+    assert "menta_http_requests_total" in body
+
+def test_command_timer_keeps_a_bounded_number_of_unfinished_commands():
+    timer = CommandTimer(max_pending=3)
+    for request_id in range(10):
+        timer.started(started(request_id))
+    assert list(timer.pending) == [(("db", 27017), request_id) for request_id in (7, 8, 9)]
+    # A reply for a command that was dropped is ignored; one that is still parked is timed
+    before = mongo_latency.values.get(("timer_test", "find"), [[0], 0])[1]
+    timer.started(started(10, "timer_test"))
+    timer.succeeded(SimpleNamespace(command_name="find", connection_id=("db", 27017), request_id=0, duration_micros=1000))
+    timer.succeeded(SimpleNamespace(command_name="find", connection_id=("db", 27017), request_id=10, duration_micros=1000))
+    assert mongo_latency.values[("timer_test", "find")][1] == before + 0.001
+    assert len(timer.pending) == 2
@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from app import crud, outbox
+from app.database import activity_collection, job_collection, progress_collection, user_collection
+from app.jobs import claim_job, run_job
+from app.outbox import sweep_outbox
+
+ACTIVITY = {
+    "title": "Reading", "description": "", "activity": "reading", "date": "2024-01-01", "start_time": "10:00",
+    "duration": 1800, "private_notes": "", "privacy_type": "public", "perceived_performance": 3, "images": [],
+}
+
+async def run_queued_jobs():
+    while (job := await claim_job("worker")) is not None:
+        await run_job(job, None)
+
+async def new_user() -> str:
+    user_id = ObjectId()
+    await user_collection.insert_one({"_id": user_id, "first_name": "Test", "last_name": "User", "clubs": []})
+    return str(user_id)
+
+async def make_due(activity_id):
+    await activity_collection.update_one({"_id": activity_id}, {"$set": {"outbox_due_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+def test_jobs_are_inserted_with_the_activity_and_cleared_as_they_run():
+    async def scenario():
+        created = await crud.create_activity(dict(ACTIVITY), await new_user())
+        inserted = await activity_collection.find_one({"_id": ObjectId(created.id)})
+        await run_queued_jobs()
+        return inserted, await activity_collection.find_one({"_id": ObjectId(created.id)})
+
+    inserted, finished = asyncio.run(scenario())
+    assert {job["kind"] for job in inserted["outbox"]} == {"fan_out", "progress", "leaderboard", "club_activity", "challenges"}
+    assert inserted["outbox_due_at"] > datetime.utcnow()
+    assert "outbox" not in finished and "outbox_due_at" not in finished
+
+def test_jobs_lost_before_the_enqueue_are_swept_up(monkeypatch):
+    async def crash(jobs):
+        raise ConnectionError("process died")
+
+    async def scenario():
+        user_id = await new_user()
+        monkeypatch.setattr(crud, "enqueue_many", crash)
+        with pytest.raises(ConnectionError):
+            await crud.create_activity(dict(ACTIVITY), user_id)
+        activity = await activity_collection.find_one({"user_id": user_id})
+        queued_before = await job_collection.count_documents({})
+        # Not due yet: the jobs may still be on their way
+        early = await sweep_outbox()
+        await make_due(activity["_id"])
+        swept = await sweep_outbox()
+        queued_after = await job_collection.count_documents({})
+        await run_queued_jobs()
+        return (
+            queued_before, early, swept, queued_after,
+            await progress_collection.find_one({"user_id": user_id}),
+            await activity_collection.find_one({"_id": activity["_id"]}),
+        )
+
+    queued_before, early, swept, queued_after, progress, activity = asyncio.run(scenario())
+    assert (queued_before, early, swept, queued_after) == (0, 0, 1, 5)
+    assert progress["sessions"] == 1
+    assert "outbox" not in activity
+
+def test_sweeping_gives_up_after_the_limit(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_SWEEPS", 2)
+
+    async def scenario():
+        activity_id = ObjectId()
+        await activity_collection.insert_one({
+            "_id": activity_id, "outbox": [{"kind": "no_such_job", "payload": {}}], "outbox_due_at": datetime.utcnow(),
+        })
+        for _ in range(3):
+            await make_due(activity_id)
+            await sweep_outbox()
+        return await job_collection.count_documents({"kind": "no_such_job"}), await activity_collection.find_one({"_id": activity_id})
+
+    queued, activity = asyncio.run(scenario())
+    assert queued == 2
+    assert "outbox_due_at" not in activity and activity["outbox"] == [{"kind": "no_such_job", "payload": {}}]
@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from app.database import activity_collection
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor, fetch_page
+
+ACTIVITY = {
+    "user_id": "u1", "activity": "reading", "date": "2024-01-01", "start_time": "10:00", "end_time": "10:30",
+    "duration": 1800, "privacy_type": "public", "updated_at": datetime(2024, 1, 1),
+}
+
+def insert_activities(created_ats: list) -> list:
+    documents = [{**ACTIVITY, "_id": ObjectId(), "title": f"t{n}", "created_at": created_at} for n, created_at in enumerate(created_ats)]
+    asyncio.run(activity_collection.insert_many(documents))
+    return documents
+
+def walk(limit: int, query: dict = None) -> list:
+    async def pages():
+        seen, cursor = [], None
+        while True:
+            documents, cursor = await fetch_page(activity_collection, query or {}, cursor, limit)
+            seen += documents
+            if cursor is None:
+                return seen
+    return asyncio.run(pages())
+
+def test_cursor_round_trip():
+    created_at, object_id = datetime(2024, 1, 2, 3, 4, 5, 678000), ObjectId()
+    assert decode_cursor(encode_cursor(created_at, object_id)) == (created_at, object_id)
+
+@pytest.mark.parametrize("cursor", ["zzz", "", encode_cursor(datetime(2024, 1, 1), ObjectId())[:-4]])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+def test_pages_visit_every_row_once_in_order():
+    start = datetime(2024, 1, 1)
+    # Ties on created_at are broken by _id, including across page boundaries
+    documents = insert_activities([start + timedelta(seconds=n // 3) for n in range(10)])
+    seen = walk(limit=3)
+    expected = sorted(documents, key=lambda document: (document["created_at"], document["_id"]), reverse=True)
+    assert [document["_id"] for document in seen] == [document["_id"] for document in expected]
+
+def test_newer_rows_do_not_shift_later_pages():
+    start = datetime(2024, 1, 1)
+    insert_activities([start + timedelta(minutes=n) for n in range(6)])
+
+    async def first_two_pages():
+        first, cursor = await fetch_page(activity_collection, {}, None, 3)
+        await activity_collection.insert_one({**ACTIVITY, "title": "new", "created_at": start + timedelta(days=1)})
+        second, _ = await fetch_page(activity_collection, {}, cursor, 3)
+        return first, second
+
+    first, second = asyncio.run(first_two_pages())
+    titles = [document["title"] for document in first + second]
+    assert titles == ["t5", "t4", "t3", "t2", "t1", "t0"]
+
+def test_activities_route_pages_and_rejects_bad_cursors(client, register):
+    _, headers = register("pages@example.com")
+    insert_activities([datetime(2024, 1, 1) + timedelta(minutes=n) for n in range(5)])
+    response = client.get("/activities?limit=2", headers=headers).json()
+    titles = [item["title"] for item in response["items"]]
+    while response["next_cursor"]:
+        response = client.get(f"/activities?limit=2&cursor={response['next_cursor']}", headers=headers).json()
+        titles += [item["title"] for item in response["items"]]
+    assert titles == ["t4", "t3", "t2", "t1", "t0"]
+    assert client.get("/activities?cursor=zzz", headers=headers).status_code == 400
@@ -0,0 +1,35 @@
+import asyncio
+from bson import ObjectId
+from app import stats
+from app.database import activity_collection, user_collection
+from app.versions import ACTIVITIES, bump_versions
+
+def test_cached_stats_follow_the_activities_version(monkeypatch):
+    runs = []
+
+    def pipeline(user_id, bucket, start=None, end=None):
+        # A stand-in for the real pipeline, whose $dateFromString the in-memory Mongo lacks
+        runs.append(bucket)
+        return [{"$match": {"user_id": user_id}}, {"$group": {"_id": None, "time_spent_seconds": {"$sum": "$duration"}}}]
+
+    monkeypatch.setattr(stats, "stats_pipeline", pipeline)
+    user_id = str(ObjectId())
+
+    async def scenario():
+        await user_collection.insert_one({"_id": ObjectId(user_id), "versions": {ACTIVITIES: 0}})
+        await activity_collection.insert_one({"user_id": user_id, "activity": "reading", "date": "2024-01-01", "duration": 60})
+        first = await stats.get_activity_stats(user_id, "month")
+        cached = await stats.get_activity_stats(user_id, "month")
+        # A write made by another process: only the version in Mongo moves, nothing local is dropped
+        await activity_collection.insert_one({"user_id": user_id, "activity": "reading", "date": "2024-01-02", "duration": 30})
+        await user_collection.update_one({"_id": ObjectId(user_id)}, {"$inc": {f"versions.{ACTIVITIES}": 1}})
+        after_write = await stats.get_activity_stats(user_id, "month")
+        await activity_collection.insert_one({"user_id": user_id, "activity": "reading", "date": "2024-01-03", "duration": 10})
+        await bump_versions(user_id, ACTIVITIES)
+        return first, cached, after_write, await stats.get_activity_stats(user_id, "month")
+
+    first, cached, after_write, after_bump = asyncio.run(scenario())
+    assert cached == first and first[0]["time_spent_seconds"] == 60
+    assert after_write[0]["time_spent_seconds"] == 90
+    assert after_bump[0]["time_spent_seconds"] == 100
+    assert len(runs) == 3
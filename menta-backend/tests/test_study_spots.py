@@ -0,0 +1,81 @@
+import asyncio
+import httpx
+import pytest
+from app.study_spots import InvalidBounds, StudySpotCache, tile_for, tiles_for_bounds
+
+ELEMENTS = [
+    {"id": 1, "lat": 40.713, "lon": -74.006, "tags": {}},
+    {"id": 2, "lat": 41.5, "lon": -74.006, "tags": {}},
+    {"id": 3, "lat": 0.001, "lon": 179.999, "tags": {}},
+    {"id": 4, "lat": 0.001, "lon": -179.999, "tags": {}},
+    {"id": 5, "lat": 0.001, "lon": 0.5, "tags": {}},
+]
+
+def overpass(calls: list):
+    async def handler(request):
+        calls.append(request)
+        # Slow enough that concurrent misses for a tile overlap
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"elements": ELEMENTS})
+    return StudySpotCache(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+def test_concurrent_misses_share_one_request_per_tile_and_are_cached():
+    calls = []
+    spots = overpass(calls)
+    southwest, northeast = [40.710, -74.010], [40.716, -74.002]
+    tiles = tiles_for_bounds(southwest, northeast)
+
+    async def scenario():
+        burst = await asyncio.gather(*(spots.get_spots(southwest, northeast) for _ in range(5)))
+        after_burst = len(calls)
+        again = await spots.get_spots(southwest, northeast)
+        await spots.close()
+        return burst, after_burst, again
+
+    burst, after_burst, again = asyncio.run(scenario())
+    assert after_burst == len(tiles)
+    assert len(calls) == len(tiles)
+    assert spots.coalesced == 4 * len(tiles)
+    assert spots.stats()["hits"] == len(tiles)
+    # Only what lies inside the requested bounds comes back
+    assert all([element["id"] for element in result["elements"]] == [1] for result in burst + [again])
+
+def test_failed_fetch_is_not_cached():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        return httpx.Response(503 if len(calls) == 1 else 200, json={"elements": ELEMENTS})
+
+    spots = StudySpotCache(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    southwest, northeast = [40.712, -74.007], [40.714, -74.005]
+
+    async def scenario():
+        with pytest.raises(httpx.HTTPStatusError):
+            await spots.get_spots(southwest, northeast)
+        result = await spots.get_spots(southwest, northeast)
+        await spots.close()
+        return result
+
+    assert [element["id"] for element in asyncio.run(scenario())["elements"]] == [1]
+    assert spots.upstream_errors == 1
+
+def test_bounds_across_the_antimeridian_are_split():
+    southwest, northeast = [-0.01, 179.99], [0.01, -179.99]
+    columns = {x for x, _ in tiles_for_bounds(southwest, northeast)}
+    assert columns == {tile_for(0, 179.99)[0], tile_for(0, -179.99)[0]}
+
+    spots = overpass([])
+
+    async def scenario():
+        result = await spots.get_spots(southwest, northeast)
+        await spots.close()
+        return result
+
+    assert sorted(element["id"] for element in asyncio.run(scenario())["elements"]) == [3, 4]
+
+def test_inverted_latitudes_are_rejected(client):
+    with pytest.raises(InvalidBounds):
+        tiles_for_bounds([41.0, -74.0], [40.0, -73.9])
+    response = client.post("/api/study_spots", json={"bounds": {"southwest": [41.0, -74.0], "northeast": [40.0, -73.9]}})
+    assert response.status_code == 400
@@ -0,0 +1,42 @@
+from bson import ObjectId
+from app import timeline
+from app.crud import create_activity
+from app.database import activity_collection, timeline_collection
+from app.follows import add_follow, remove_follow
+from app.timeline import fan_out_activity, get_home_timeline
+
+ACTIVITY = {
+    "title": "Reading", "description": "", "activity": "reading", "date": "2024-01-01", "start_time": "10:00",
+    "duration": 1800, "private_notes": "", "privacy_type": "public", "perceived_performance": 3, "images": [],
+}
+
+async def post(author_id: str):
+    card = await create_activity(dict(ACTIVITY), author_id)
+    activity = await activity_collection.find_one({"_id": ObjectId(card.id)})
+    await fan_out_activity(activity)
+    return activity["_id"]
+
+async def feed(user_id: str) -> list:
+    activities, _ = await get_home_timeline(user_id)
+    return [activity["_id"] for activity in activities]
+
+def test_posts_from_a_high_fanout_spell_stay_in_feeds_after_it_ends(client, register, monkeypatch):
+    monkeypatch.setattr(timeline, "FANOUT_MAX_FOLLOWERS", 1)
+    monkeypatch.setattr(timeline, "_high_fanout_authors", set())
+    monkeypatch.setattr(timeline, "_high_fanout_loaded_at", 0.0)
+    author, _ = register("author@example.com")
+    reader, _ = register("reader@example.com")
+    other, _ = register("other@example.com")
+    for follower in (reader, other):
+        client.portal.call(add_follow, follower["id"], author["id"])
+
+    # Two followers: high fanout, so the post is pulled on read rather than pushed
+    pulled = client.portal.call(post, author["id"])
+    assert client.portal.call(timeline_collection.count_documents, {"owner_id": reader["id"], "activity_id": pulled}) == 0
+    assert client.portal.call(feed, reader["id"]) == [pulled]
+
+    client.portal.call(remove_follow, other["id"], author["id"])
+    pushed = client.portal.call(post, author["id"])
+    assert client.portal.call(timeline.get_high_fanout_authors) == set()
+    assert client.portal.call(feed, reader["id"]) == [pushed, pulled]
+    assert client.portal.call(feed, other["id"]) == []
@@ -0,0 +1,15 @@
+def profile_form(user: dict, **changes) -> dict:
+    return {
+        "first_name": user["first_name"], "last_name": user["last_name"], "email": user["email"],
+        "dob": "2000-01-01", "interests": "reading", **changes,
+    }
+
+def test_profile_update_to_a_taken_email_is_rejected(client, register):
+    register("taken@example.com")
+    user, headers = register("mine@example.com")
+    response = client.put(f"/users/{user['id']}", data=profile_form(user, email="taken@example.com"), headers=headers)
+    assert response.status_code == 400 and response.json()["detail"] == "Email already registered"
+    assert client.get(f"/users/{user['id']}", headers=headers).json()["email"] == "mine@example.com"
+
+    renamed = client.put(f"/users/{user['id']}", data=profile_form(user, first_name="Renamed"), headers=headers)
+    assert renamed.status_code == 200 and renamed.json()["first_name"] == "Renamed"
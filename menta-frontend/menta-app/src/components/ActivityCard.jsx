@@ -16,11 +16,13 @@ const ActivityCard = ({ activity }) => {
     duration = 0, // in seconds
     activity: activityName = '', // Rename the variable locally
     images = [], // These should be URLs
+    image_variants = [], // Resized copies of each image: thumbnail, feed, full
     comments = [],
+    author = null, // Embedded by the API so the card needs no extra user lookups
     private_notes = '' // Private notes
   } = activity;
 
-  const [user, setUser] = useState({ profile_picture: '', first_name: '', last_name: '' });
+  const [user, setUser] = useState(author || { profile_picture: '', first_name: '', last_name: '' });
   const [userNotFound, setUserNotFound] = useState(false);
   const { getToken, user: authUser } = useAuth();
   const [isModalOpen, setIsModalOpen] = useState(false);
@@ -30,7 +32,12 @@ const ActivityCard = ({ activity }) => {
   const [showCommentSection, setShowCommentSection] = useState(false);
   const [commentText, setCommentText] = useState('');
   const [commentList, setCommentList] = useState(comments);
-  const [commentUsers, setCommentUsers] = useState({});
+  const [commentUsers, setCommentUsers] = useState(() =>
+    comments.reduce((acc, comment) => {
+      if (comment.author) acc[comment.user_id] = comment.author;
+      return acc;
+    }, {})
+  );
   const [streak, setStreak] = useState(0);
 
   const BASE_URL = 'http://127.0.0.1:8000';
@@ -53,8 +60,10 @@ const ActivityCard = ({ activity }) => {
       }
     };
 
-    fetchUser();
-  }, [user_id, getToken]);
+    if (!author) {
+      fetchUser();
+    }
+  }, [user_id, author, getToken]);
 
   useEffect(() => {
     const fetchStreak = async () => {
@@ -78,9 +87,18 @@ const ActivityCard = ({ activity }) => {
 
   useEffect(() => {
     const fetchCommentUsers = async () => {
-      const usersToFetch = commentList
+      const embedded = commentList.filter(comment => comment.author && !commentUsers[comment.user_id]);
+      if (embedded.length > 0) {
+        setCommentUsers(prevCommentUsers => embedded.reduce(
+          (acc, comment) => ({ ...acc, [comment.user_id]: comment.author }),
+          prevCommentUsers
+        ));
+        return;
+      }
+
+      const usersToFetch = [...new Set(commentList
         .filter(comment => !commentUsers[comment.user_id])
-        .map(comment => comment.user_id);
+        .map(comment => comment.user_id))];
 
       if (usersToFetch.length > 0) {
         const responses = await Promise.all(
@@ -118,12 +136,15 @@ const ActivityCard = ({ activity }) => {
     return `${streak} days`;
   };
 
+  // Cards show the feed-sized copy; the full-size image is only loaded in the modal
+  const feedImage = (index) => image_variants[index]?.feed || images[index];
+
   const renderImages = () => {
     if (images.length === 1) {
       return (
         <div className="w-full h-64">
           <img
-            src={images[0]}
+            src={feedImage(0)}
             alt="Activity"
             className="w-full h-full object-cover rounded-sm cursor-pointer"
             onClick={() => openModal(0)}
@@ -136,7 +157,7 @@ const ActivityCard = ({ activity }) => {
         {images.map((url, index) => (
           <div key={index} className="relative w-full h-48">
             <img
-              src={url}
+              src={feedImage(index)}
               alt={`Activity ${index}`}
               className="absolute inset-0 w-full h-full object-cover rounded-lg cursor-pointer"
               onClick={() => openModal(index)}
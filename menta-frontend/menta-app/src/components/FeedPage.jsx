@@ -14,6 +14,7 @@ function FeedPage() {
   const [isDropdownOpen, setIsDropdownOpen] = useState(false);
   const [latestActivities, setLatestActivities] = useState([]);
   const [allUsers, setAllUsers] = useState([]);
+  const [followingIds, setFollowingIds] = useState(new Set());
 
   useEffect(() => {
     if (!isLoggedIn) {
@@ -22,9 +23,28 @@ function FeedPage() {
       fetchActivities();
       fetchLatestActivities();
       fetchAllUsers();
+      fetchFollowingIds();
     }
   }, [isLoggedIn, navigate]);
 
+  // New activities and comments from followed accounts are pushed instead of re-fetched
+  useEffect(() => {
+    if (!isLoggedIn) return;
+    const socket = new WebSocket(`ws://127.0.0.1:8000/ws/feed?token=${getToken()}`);
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'activity') {
+        setActivities((current) => current.some((item) => item.id === message.data.id) ? current : [message.data, ...current]);
+      } else if (message.type === 'comment') {
+        const comment = message.data;
+        setActivities((current) => current.map((item) => item.id === comment.activity_id
+          ? { ...item, comments: [...(item.comments || []), comment].slice(-3), comment_count: (item.comment_count || 0) + 1 }
+          : item));
+      }
+    };
+    return () => socket.close();
+  }, [isLoggedIn]);
+
   const fetchActivities = async () => {
     try {
       const response = await axios.get('http://127.0.0.1:8000/activities', {
@@ -32,7 +52,7 @@ function FeedPage() {
           Authorization: `Bearer ${getToken()}`,
         },
       });
-      setActivities(response.data);
+      setActivities(response.data.items);
     } catch (error) {
       console.error('Error fetching activities:', error);
     }
@@ -43,18 +63,37 @@ function FeedPage() {
       const response = await axios.get(`http://127.0.0.1:8000/activities/user/${user.id}`, {
         headers: { Authorization: `Bearer ${getToken()}` }
       });
-      setLatestActivities(response.data);
+      setLatestActivities(response.data.items);
     } catch (error) {
       console.error('Error fetching latest activities:', error);
     }
   };
 
+  const fetchFollowingIds = async () => {
+    try {
+      // Walk every page, or accounts followed after the first 100 would show as not followed
+      const ids = new Set();
+      let cursor = null;
+      do {
+        const response = await axios.get(`http://127.0.0.1:8000/users/${user.id}/following`, {
+          headers: { Authorization: `Bearer ${getToken()}` },
+          params: { limit: 100, ...(cursor ? { cursor } : {}) }
+        });
+        response.data.items.forEach((followed) => ids.add(followed.id));
+        cursor = response.data.next_cursor;
+      } while (cursor);
+      setFollowingIds(ids);
+    } catch (error) {
+      console.error('Error fetching following:', error);
+    }
+  };
+
   const fetchAllUsers = async () => {
     try {
       const response = await axios.get('http://127.0.0.1:8000/users', {
         headers: { Authorization: `Bearer ${getToken()}` }
       });
-      setAllUsers(response.data);
+      setAllUsers(response.data.items);
     } catch (error) {
       console.error('Error fetching users:', error);
     }
@@ -76,11 +115,11 @@ function FeedPage() {
     if (filter === 'Followers') {
       return (
         activity.privacy_type === 'Everyone' ||
-        (activity.privacy_type === 'Followers' && user.following.includes(activity.user_id))
+        (activity.privacy_type === 'Followers' && followingIds.has(activity.user_id))
       );
     }
     if (filter === 'Following') {
-      return user.following.includes(activity.user_id);
+      return followingIds.has(activity.user_id);
     }
     return false;
   };
@@ -106,7 +145,7 @@ function FeedPage() {
             </div>
           )}
           <h2 className="text-xl font-semibold">{user.first_name} {user.last_name}</h2>
-          <p className="text-gray-500">Following: {user.following.length} | Followers: {user.followers.length} </p> 
+          <p className="text-gray-500">Following: {user.following_count} | Followers: {user.follower_count} </p> 
           <p className="text-gray-500"> Total Activities: {activities.length}</p>
         </div>
         <button 
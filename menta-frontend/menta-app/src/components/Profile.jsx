@@ -28,15 +28,18 @@ const Profile = () => {
           headers: { Authorization: `Bearer ${token}` }
         });
         setUser(response.data);
-        setFollowers(response.data.followers.length);
-        setFollowing(response.data.following.length);
+        setFollowers(response.data.follower_count);
+        setFollowing(response.data.following_count);
         setCategories(response.data.interests); // Assuming interests are an array of strings
         if (response.data.interests.length > 0) {
           setSelectedCategory(response.data.interests[0]);
         }
 
         // Check if the current user is following this user
-        setIsFollowing(response.data.followers.includes(authUser.id));
+        const followResponse = await axios.get(`http://127.0.0.1:8000/follow/${userId}`, {
+          headers: { Authorization: `Bearer ${token}` }
+        });
+        setIsFollowing(followResponse.data.following);
 
       } catch (error) {
         console.error('Error fetching user data:', error);
@@ -49,7 +52,7 @@ const Profile = () => {
         const response = await axios.get(`http://127.0.0.1:8000/activities/user/${userId}`, {
           headers: { Authorization: `Bearer ${token}` }
         });
-        setLatestActivities(response.data);
+        setLatestActivities(response.data.items);
       } catch (error) {
         console.error('Error fetching latest activities:', error);
       }
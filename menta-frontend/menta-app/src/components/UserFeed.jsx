@@ -24,7 +24,7 @@ function UserFeed() {
           Authorization: `Bearer ${getToken()}`,
         },
       });
-      setActivities(response.data);
+      setActivities(response.data.items);
     } catch (error) {
       console.error('Error fetching activities:', error);
     }